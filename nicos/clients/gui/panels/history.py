@@ -106,6 +106,24 @@ class View(QObject):
         # + 60 seconds: get all values, also those added while querying
         hist_totime = self.totime or currenttime() + 60
         hist_cache = {}
+        if fromtime is not None:
+            # query the history of all keys at once, and let the cache
+            # downsample to the plot interval
+            keys = list(OrderedDict.fromkeys(k[0] for k in keys_indices))
+            histories = query_func(keys, self.fromtime, hist_totime,
+                                   interval) or [[]] * len(keys)
+            hist_cache = dict(zip(keys, histories))
+            for key in keys:
+                if not hist_cache.get(key):
+                    from nicos.clients.gui.main import log
+                    if log is None:
+                        from __main__ import log  # pylint: disable=no-name-in-module
+                    log.error('Error getting history for %s.', key)
+                    QMessageBox.warning(widget, 'Error',
+                                        'Could not get history for %s, '
+                                        'there are no values to show.\n'
+                                        'Is it spelled correctly?' % key)
+                    hist_cache[key] = []
 
         iterator = enumerate(keys_indices)
         if fromtime is not None:
@@ -119,21 +137,7 @@ class View(QObject):
             self.uniq_keys.add(key)
 
             if fromtime is not None:
-                if key not in hist_cache:
-                    history = query_func(key, self.fromtime, hist_totime)
-                    if not history:
-                        from nicos.clients.gui.main import log
-                        if log is None:
-                            from __main__ import log  # pylint: disable=no-name-in-module
-                        log.error('Error getting history for %s.', key)
-                        QMessageBox.warning(widget, 'Error',
-                                            'Could not get history for %s, '
-                                            'there are no values to show.\n'
-                                            'Is it spelled correctly?' % key)
-                        history = []
-                    hist_cache[key] = history
-                else:
-                    history = hist_cache[key]
+                history = hist_cache[key]
                 # if the value is a list/tuple and we don't have an index
                 # specified, add a plot for each item
                 if history:
@@ -1110,6 +1114,9 @@ class HistoryPanel(BaseHistoryWindow, Panel):
         self.layout().addWidget(self.statusBar)
 
         self._disconnected_since = 0
+        # set if the daemon only supports gethistory for a single key and
+        # without downsampling
+        self._gethistory_compat = False
 
         self.splitter.setSizes([20, 80])
         self.splitter.restoreState(self.splitterstate)
@@ -1142,14 +1149,28 @@ class HistoryPanel(BaseHistoryWindow, Panel):
         self.client.cache.disconnect(self.newvalue_callback)
         return True
 
-    def gethistory_callback(self, key, fromtime, totime):
-        return self.client.ask('gethistory', key, str(fromtime), str(totime),
-                               default=[])
+    def gethistory_callback(self, keys, fromtime, totime, interval):
+        if not self._gethistory_compat:
+            histories = self.client.ask('gethistory', ','.join(keys),
+                                        str(fromtime), str(totime),
+                                        str(interval), noerror=True)
+            if histories is not None:
+                if len(keys) == 1:
+                    return [histories]
+                return histories
+            if not self.client.isconnected:
+                return []
+            # older daemons reject the interval argument
+            self._gethistory_compat = True
+        return [self.client.ask('gethistory', key, str(fromtime), str(totime),
+                                default=[]) for key in keys]
 
     def on_client_disconnected(self):
         self._disconnected_since = currenttime()
 
     def on_client_connected(self):
+        # the daemon might have been updated
+        self._gethistory_compat = False
         # If the client was disconnected for longer than a few seconds, refresh
         # all open plots to avoid mysterious "flatlines" for that period.
         if currenttime() - self._disconnected_since < 5:
@@ -1215,8 +1236,8 @@ class StandaloneHistoryWindow(DlgUtils, BaseHistoryWindow, QMainWindow):
         self.statusBar = QStatusBar(self)
         self.setStatusBar(self.statusBar)
 
-    def gethistory_callback(self, key, fromtime, totime):
-        return self.app.history(None, key, fromtime, totime)
+    def gethistory_callback(self, keys, fromtime, totime, interval):
+        return self.app.history_many(keys, fromtime, totime, interval)
 
     def closeEvent(self, event):
         self.saveSettings(self.settings)
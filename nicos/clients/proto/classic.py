@@ -107,7 +107,8 @@ class ClientTransport(BaseClientTransport):
             start += data
         length, = LENGTH.unpack(start)
         got = 0
-        buf = np.zeros(length, 'c')  # Py3: replace with bytearray+memoryview
+        # no need to initialize the buffer, it is filled completely
+        buf = np.empty(length, 'c')
         while got < length:
             read = self.event_sock.recv_into(buf[got:], length - got)
             if not read:
@@ -50,12 +50,15 @@ class config:
     setup_subdirs = None  # setup groups to be used like 'panda,frm2'
     pid_path = 'pid'
     logging_path = 'log'
+    setup_cache_path = None  # e.g. 'setupcache'
     systemd_props = ''  # additional systemd Service properties
     systemd_network_timeout = 10  # timeout for finding a hostname in systemd
 
     simple_mode = False
     sandbox_simulation = False
     sandbox_simulation_debug = False
+    simulation_template = False
+    device_creation_workers = 0
     services = 'cache,poller'
     keystorepaths = ['/etc/nicos/keystore', '~/.config/nicos/keystore']
 
@@ -79,6 +82,8 @@ class config:
         # Type-coerce booleans.
         cls.simple_mode = to_bool(cls.simple_mode)
         cls.sandbox_simulation = to_bool(cls.sandbox_simulation)
+        cls.simulation_template = to_bool(cls.simulation_template)
+        cls.device_creation_workers = int(cls.device_creation_workers)
 
         # Apply environment variables.
         for key, value in environment.items():
@@ -31,7 +31,33 @@ from nicos import session
 from nicos.core.constants import FINAL, INTERRUPTED, SIMULATION
 from nicos.core.errors import NicosError
 from nicos.core.params import Value
-from nicos.core.utils import waitForCompletion
+from nicos.core.utils import DeviceWaiter, devIter, multiCall, \
+    waitForCompletion
+
+
+def acquire_workers():
+    """Return the number of threads to use for concurrent device access during
+    acquisition (see the instrument's ``acquireworkers`` parameter).
+    """
+    if session.mode == SIMULATION or not session.instrument:
+        return 0
+    return session.instrument.acquireworkers
+
+
+def _count_wait(detectors, elapsed, delay, maxdelay):
+    """Return how long the count loop can sleep before checking the
+    *detectors* again.
+    """
+    wait = maxdelay
+    for det in detectors:
+        nextevent = det.nextMeasureEvent(elapsed)
+        if nextevent is None:
+            return delay
+        wait = min(wait, nextevent - elapsed)
+        eta = det.estimateTime(elapsed)
+        if eta is not None:
+            wait = min(wait, eta)
+    return max(wait, delay)
 
 
 def _wait_for_continuation(delay, only_pause=False):
@@ -88,13 +114,26 @@ def acquire(point, preset, iscompletefunc=None):
     synchronisation, e.g. stopping of the detector when the movement of
     the scanned axis has been finished although the preset has not yet
     been fulfilled.
+
+    Without *iscompletefunc*, if the instrument's ``countloopmaxdelay`` is
+    set and all detectors tell when they need to be checked next (see
+    `.Measurable.nextMeasureEvent`), the loop sleeps until then, but at most
+    for ``countloopmaxdelay``.  It is woken
+    up earlier by `.Measurable.signalCountLoop`, status updates of the
+    detectors and their channels in the cache, and pause or finish requests.
     """
-    if iscompletefunc is None:  # do not influence count loop using callback
-        iscompletefunc = lambda: False
     # put detectors in a set and discard them when completed
     detset = set(point.detectors)
     delay = (session.instrument and session.instrument.countloopdelay or 0.025
              if session.mode != SIMULATION else 0.0)
+    maxdelay = (session.instrument and session.instrument.countloopmaxdelay
+                or 0.0 if session.mode != SIMULATION else 0.0)
+    waiter = None
+    if iscompletefunc is None:  # do not influence count loop using callback
+        iscompletefunc = lambda: False
+        if maxdelay > delay:
+            waiter = DeviceWaiter(devIter(point.detectors, allwaiters=True),
+                                  maxdelay, 'status')
 
     dataman = session.experiment.data
 
@@ -104,20 +143,23 @@ def acquire(point, preset, iscompletefunc=None):
     for det in point.detectors:
         det.setPreset(**preset)
 
-    for det in point.detectors:
-        det.prepare()
+    workers = acquire_workers()
+    multiCall(lambda det: det.prepare(), point.detectors, workers)
     for det in point.detectors:
         waitForCompletion(det)
 
     dataman.updateMetainfo()
     point.started = currenttime()
     try:
-        for det in point.detectors:
-            det.start()
+        multiCall(lambda det: det.start(), point.detectors, workers)
     except BaseException:
         session.endActionScope()
         raise
     session.delay(delay)
+    if waiter:
+        for dev in waiter.devices:
+            dev._countloop_waiter = waiter
+        session.countloop_waiter = waiter
     try:
         quality = None
         while True:
@@ -155,7 +197,11 @@ def acquire(point, preset, iscompletefunc=None):
             if iscompletefunc():  # stop via callback function
                 for det in detset:
                     det.stop()
-            session.delay(delay)
+            if waiter:
+                waiter.sleep(_count_wait(detset, currenttime() - point.started,
+                                         delay, maxdelay))
+            else:
+                session.delay(delay)
     except BaseException as err:
         point.finished = currenttime()
         if err.__class__.__name__ != 'ControlStop':
@@ -180,26 +226,36 @@ def acquire(point, preset, iscompletefunc=None):
         raise err
     finally:
         point.finished = currenttime()
+        if waiter:
+            session.countloop_waiter = None
+            for dev in waiter.devices:
+                dev._countloop_waiter = None
+            waiter.close()
         session.endActionScope()
 
 
 def read_environment(envlist):
     """Read out environment devices to get entries in the dataset."""
-    values = {}
-    for dev in envlist:
+    def read(dev):
         if isinstance(dev, DevStatistics):
             try:
                 if dev.dev:
                     dev.dev.read(0)
             except NicosError:
                 pass
-            continue
+            return None
         try:
             val = dev.read(0)
         except Exception as err:
             dev.log.warning('error reading for scan data', exc=err)
             val = [None] * len(dev.valueInfo())
-        values[dev.name] = (currenttime(), val)
+        return (currenttime(), val)
+
+    values = {}
+    results = multiCall(read, envlist, acquire_workers())
+    for dev, value in zip(envlist, results):
+        if value is not None:
+            values[dev.name] = value
     session.experiment.data.putValues(values)
 
 
@@ -125,7 +125,7 @@ class BaseDataset:
     def dispatch(self, method, *args):
         """Dispatch calling 'method' to all sink handlers."""
         for handler in self.handlers:
-            getattr(handler, method)(*args)
+            handler.sink.callHandler(handler, method, *args)
 
     def trimResult(self):
         """Trim objects that are not required to be kept after finish()."""
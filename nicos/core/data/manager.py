@@ -26,6 +26,7 @@
 
 import logging
 import os
+import threading
 from os import path
 from time import time as currenttime
 
@@ -128,13 +129,25 @@ class DataManager:
         dataset = PointDataset(**kwds)
         return self._init(dataset, skip_handlers=True)
 
-    def finishPoint(self):
-        """Finish the current point dataset."""
+    def finishPoint(self, pipeline=None):
+        """Finish the current point dataset.
+
+        If a *pipeline* (see `nicos.core.scan.PointPipeline`) is given, the
+        point is removed from the stack immediately, but dispatched to the
+        sinks in the background.
+        """
         if self._current.settype != POINT:
             self.log.warning('no data point to finish here')
             return
         point = self._stack.pop()
-        self._finish(point)
+        if pipeline is None:
+            self._finish(point)
+            if not self._stack:
+                self.flushSinks()
+        else:
+            if point.finished is None:
+                point.finished = currenttime()
+            pipeline.put(self._finish, point, self._current)
 
     def finishScan(self):
         """Finish the current scan dataset."""
@@ -143,6 +156,7 @@ class DataManager:
             return
         scan = self._stack.pop()
         self._finish(scan)
+        self.flushSinks()
 
     def finishBlock(self):
         """Finish the current block dataset."""
@@ -151,6 +165,24 @@ class DataManager:
             return
         block = self._stack.pop()
         self._finish(block)
+        self.flushSinks()
+
+    def flushSinks(self):
+        """Wait until all sinks have handled the data given to them so far.
+
+        The first error raised by a sink is re-raised.
+        """
+        error = None
+        for sink in session.datasinks:
+            try:
+                sink.flush()
+            except Exception as err:
+                if error is None:
+                    error = err
+                else:
+                    sink.log.exception('error handling data')
+        if error is not None:
+            raise error
 
     def iterParents(self, dataset):
         """Yield recursive parents of the given dataset, with the immediate
@@ -195,15 +227,39 @@ class DataManager:
             except Exception:
                 self.log.exception('while cleaning up dataset %s', last)
 
-    def _finish(self, dataset):
-        """Finish up the dataset."""
+    def _finish(self, dataset, parent=None):
+        """Finish up the dataset.
+
+        The *parent* defaults to the dataset on top of the stack.
+        """
         if dataset.finished is None:
             dataset.finished = currenttime()
         self.log.debug('finishing up %s', dataset)
         dataset.dispatch('end')
-        if self._stack:
-            self._stack[-1].dispatch('addSubset', dataset)
-        dataset.trimResult()
+        if parent is None:
+            parent = self._current
+        if parent is not None:
+            parent.dispatch('addSubset', dataset)
+        # handlers called in a separate thread may not have seen the data yet,
+        # trim only after all of them are done
+        sinks = {handler.sink for handlerset in (dataset, parent)
+                 if handlerset is not None for handler in handlerset.handlers
+                 if handler.sink.isDispatched()}
+        if not sinks:
+            dataset.trimResult()
+            return
+        pending = [len(sinks)]
+        lock = threading.Lock()
+
+        def trim():
+            with lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            dataset.trimResult()
+
+        for sink in sinks:
+            sink.callAfterHandlers(trim)
 
     #
     # Filling datasets with data
@@ -24,6 +24,7 @@
 
 """Base classes for NICOS data sinks."""
 
+import queue
 from gzip import GzipFile as StdGzipFile
 from io import TextIOWrapper
 from os import path
@@ -33,9 +34,10 @@ from nicos.core.constants import POINT, SIMULATION
 from nicos.core.data.dataset import SETTYPES
 from nicos.core.device import Device
 from nicos.core.errors import ProgrammingError
-from nicos.core.params import INFO_CATEGORIES, Override, Param, listof, setof
+from nicos.core.params import INFO_CATEGORIES, Override, Param, intrange, \
+    listof, oneof, setof
 from nicos.core.status import statuses
-from nicos.utils import File, enableDisableFileItem
+from nicos.utils import File, createThread, enableDisableFileItem
 
 
 class DataFileBase:
@@ -243,6 +245,56 @@ class NicosMetaWriterMixin:
         wrapper.detach()
 
 
+class SinkDispatcher:
+    """Calls the handler methods of one sink in a separate thread.
+
+    The calls are queued and done in order.  With a *maxlag* greater than
+    zero, at most that many calls can be pending; further calls block until
+    the sink has caught up.  The first error raised by a handler method is
+    re-raised by the next `put` or `flush`, further errors are logged.
+    """
+
+    def __init__(self, sink, maxlag=0):
+        self.sink = sink
+        self._queue = queue.Queue(maxlag)
+        self._error = None
+        self._thread = createThread('sink %s' % sink, self._worker)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                handler, method, args = item
+                try:
+                    getattr(handler, method)(*args)
+                except Exception as err:
+                    if self._error is None:
+                        self._error = err
+                    else:
+                        self.sink.log.exception('error in %s()', method)
+            finally:
+                self._queue.task_done()
+
+    def _reraise(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def put(self, handler, method, args):
+        self._reraise()
+        self._queue.put((handler, method, args))
+
+    def flush(self):
+        self._queue.join()
+        self._reraise()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
 class DataSink(Device):
     """The base class for data sinks.
 
@@ -270,6 +322,18 @@ class DataSink(Device):
        such as a "write scan data to the console" sink.
 
     .. automethod:: isActive
+
+    With the ``dispatchmode`` parameter, the handlers can be called in a
+    separate thread per sink instead of the thread producing the data, so that
+    a slow sink does not delay the measurement.  The calls are still done in
+    order, and the data manager waits for them to be finished at the end of
+    each scan, block and standalone point.  Since the handlers run later, they
+    should use the arguments passed to them rather than the current state of
+    the dataset; the data manager only trims finished datasets once their
+    handler calls are done.  `DataSinkHandler.prepare` is always called
+    directly, after all pending calls of the sink are done.
+
+    .. automethod:: flush
     """
 
     parameters = {
@@ -278,6 +342,15 @@ class DataSink(Device):
         'settypes':  Param('List of dataset types to activate this sink '
                            '(default is for all settypes the sink supports)',
                            type=setof(*SETTYPES)),
+        'dispatchmode': Param('How to call the handlers: directly ("sync"), '
+                              'in a separate thread ("async"), or in a '
+                              'separate thread with at most "maxlag" pending '
+                              'calls ("bounded")',
+                              type=oneof('sync', 'async', 'bounded'),
+                              default='sync'),
+        'maxlag':    Param('Maximum number of pending handler calls in '
+                           '"bounded" dispatch mode',
+                           type=intrange(1, 100000), default=100),
     }
 
     parameter_overrides = {
@@ -290,6 +363,53 @@ class DataSink(Device):
     # Set this to the corresponding Handler class.
     handlerclass = None
 
+    _dispatcher = None
+
+    def doShutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+            self._dispatcher = None
+
+    def callHandler(self, handler, method, *args):
+        """Call the *method* of one of this sink's handlers, according to the
+        dispatch mode.
+        """
+        if not self.isDispatched():
+            getattr(handler, method)(*args)
+            return
+        if self._dispatcher is None:
+            self._dispatcher = SinkDispatcher(
+                self, self.maxlag if self.dispatchmode == 'bounded' else 0)
+        if method == 'prepare':
+            # prepare() assigns counters and requests files, which must not be
+            # delayed or overlap with the handling of previous datasets
+            self._dispatcher.flush()
+            getattr(handler, method)(*args)
+        else:
+            self._dispatcher.put(handler, method, args)
+
+    def isDispatched(self):
+        """Return True if the handlers are called in a separate thread."""
+        return self.dispatchmode != 'sync' and session.mode != SIMULATION
+
+    def callAfterHandlers(self, func):
+        """Call *func* once all handler calls queued so far are done.
+
+        It is called in the same thread as the handlers.
+        """
+        if self._dispatcher is None:
+            func()
+        else:
+            self._dispatcher.put(func, '__call__', ())
+
+    def flush(self):
+        """Wait until all pending handler calls are done.
+
+        Errors raised by the handlers are re-raised here.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.flush()
+
     def isActive(self, dataset):
         """Should return True if the sink can and should process this dataset.
 
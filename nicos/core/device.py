@@ -160,6 +160,10 @@ class DeviceMeta(DeviceMixinMeta):
                     if param not in self._params:
                         self._initParam(param)
                     if self._cache and param != 'name':  # no renaming !
+                        # during init, values to be put are not in the cache
+                        # yet
+                        if self._pending_puts and param in self._pending_puts:
+                            return self._pending_puts[param]
                         value = self._cache.get(self, param, Ellipsis)
                         if value is not Ellipsis:
                             self._params[param] = value
@@ -179,8 +183,7 @@ class DeviceMeta(DeviceMixinMeta):
                     value = rmethod(self)
                     if value == self._params.get(param, Ellipsis):
                         return value
-                    if self._cache:
-                        self._cache.put(self, param, value)
+                    self._putParam(param, value)
                     self._params[param] = value
                     return value
 
@@ -237,8 +240,7 @@ class DeviceMeta(DeviceMixinMeta):
                             self.log.info('%s set to %s (was %s)',
                                           param, valuestr, oldvstr)
                     self._params[param] = value
-                    if self._cache:
-                        self._cache.put(self, param, value)
+                    self._putParam(param, value)
 
             # create a property and attach to the new device class
             setattr(newtype, param,
@@ -323,6 +325,9 @@ class Device(metaclass=DeviceMeta):
     # at runtime.
     _sim_intercept = True
 
+    # While initializing parameters, values to put into the cache at once.
+    _pending_puts = None
+
     # Autogenerated inventory of the class' user methods.
     methods = {}
 
@@ -503,6 +508,8 @@ class Device(metaclass=DeviceMeta):
             new_classes = self.doReadClasses()
             if old_classes != new_classes and self._mode == MASTER:
                 self._cache.put(self, 'classes', new_classes)
+        # cached values of the parameters, read at once before each phase
+        cached = {}
 
         def _init_param(param, paraminfo):
             param = param.lower()
@@ -515,9 +522,10 @@ class Device(metaclass=DeviceMeta):
             value = Ellipsis
             # try to get from cache
             if self._cache:
-                value = self._cache.get(self, param, Ellipsis)
+                value = self._pending_puts.get(param,
+                                               cached.get(param, Ellipsis))
                 if param == 'name':  # clean up legacy, wrong values
-                    self._cache.put(self, 'name', self._name)
+                    self._pending_puts['name'] = self._name
                     value = self._name
                 if value is not Ellipsis:
                     try:
@@ -546,7 +554,7 @@ class Device(metaclass=DeviceMeta):
                                 'since it was changed in the setup file',
                                 param, valuestr, cfgvstr)
                             value = cfgvalue
-                            self._cache.put(self, param, value)
+                            self._pending_puts[param] = value
                         elif prefercache:
                             self.log.warning(
                                 "value of '%s' from cache (%s) differs from "
@@ -558,7 +566,7 @@ class Device(metaclass=DeviceMeta):
                                 'configured value (%s), using configured',
                                 param, valuestr, cfgvstr)
                             value = cfgvalue
-                            self._cache.put(self, param, value)
+                            self._pending_puts[param] = value
                 elif not paraminfo.settable and paraminfo.prefercache is False:
                     # parameter is in cache, but not in config: if it is not
                     # settable and has a default, use that (since most probably
@@ -575,7 +583,7 @@ class Device(metaclass=DeviceMeta):
                             'default value (%s), using default',
                             param, valuestr, defvstr)
                         value = paraminfo.default
-                        self._cache.put(self, param, value)
+                        self._pending_puts[param] = value
                 umethod = getattr(self, 'doUpdate' + param.title(), None)
                 if umethod:
                     umethod(value)
@@ -600,20 +608,37 @@ class Device(metaclass=DeviceMeta):
                                              paraminfo.unit))
             # end of _init_param()
 
+        def _init_params(params):
+            if self._cache:
+                cached.clear()
+                cached.update(self._cache.get_device(
+                    self, [param.lower() for (param, _) in params], Ellipsis))
+                self._pending_puts = {}
+            try:
+                for param, paraminfo in params:
+                    _init_param(param, paraminfo)
+            finally:
+                if self._pending_puts:
+                    self._cache.put_many(self,
+                                         list(self._pending_puts.items()))
+                self._pending_puts = None
+
         notfromcache = []
+        early = []
         later = []
 
         for param, paraminfo in self.parameters.items():
             if paraminfo.preinit:
-                _init_param(param, paraminfo)
+                early.append((param, paraminfo))
             else:
                 later.append((param, paraminfo))
 
+        _init_params(early)
+
         if hasattr(self, 'doPreinit'):
             self.doPreinit(self._mode)
 
-        for param, paraminfo in later:
-            _init_param(param, paraminfo)
+        _init_params(later)
 
         # warn about parameters that weren't present in cache
         if self._cache and notfromcache:
@@ -683,8 +708,7 @@ class Device(metaclass=DeviceMeta):
         elif not done:
             value = self._config.get(param, paraminfo.default)
         value = self._validateType(value, param, paraminfo)
-        if self._cache:  # will not be there in simulation mode
-            self._cache.put(self, param, value)
+        self._putParam(param, value)
         # always call update methods, they should be working for simulation
         if umethod:
             umethod(value)
@@ -699,7 +723,15 @@ class Device(metaclass=DeviceMeta):
         """
         value = self._validateType(value, param)
         self._params[param] = value
-        if self._cache:
+        self._putParam(param, value)
+
+    def _putParam(self, param, value):
+        """Put a new parameter value into the cache."""
+        if self._pending_puts is not None:
+            # during init(), put together with the other parameters; until
+            # then, the parameter getters and init() take it from here
+            self._pending_puts[param] = value
+        elif self._cache:  # will not be there in simulation mode
             self._cache.put(self, param, value)
 
     def _getParamConfig(self, param):
@@ -1852,6 +1884,9 @@ class Measurable(Waitable):
 
     errorstates = {status.ERROR: NicosError}
 
+    # the waiter of a count loop currently waiting for this device
+    _countloop_waiter = None
+
     def _setMode(self, mode):
         # overwritten from Readable: don't read out detectors, it's not useful
         self._sim_intercept = mode == SIMULATION and self.hardware_access
@@ -1927,6 +1962,33 @@ class Measurable(Waitable):
         how often this should be done.
         """
 
+    def nextMeasureEvent(self, elapsed):
+        """Return when the count loop needs to check the detector next.
+
+        The result is the time since the detector was started (like the
+        *elapsed* argument) at which `duringMeasureHook` needs to be called
+        next, or ``float('inf')`` if it has nothing to do.  If the
+        instrument's ``countloopmaxdelay`` is set, the count loop then sleeps
+        until this time or the estimated end of the measurement
+        (see `estimateTime`), unless it is woken up earlier by
+        `signalCountLoop` or status updates of the detector and its
+        subdevices in the cache.
+
+        The default implementation returns None, which means that the count
+        loop checks the detector every ``countloopdelay`` seconds.
+        """
+        return None
+
+    def signalCountLoop(self):
+        """Wake up the count loop waiting for this device, if any.
+
+        This can be called by detectors (and their channels) from other
+        threads, when the measurement has completed or new data is available.
+        """
+        waiter = self._countloop_waiter
+        if waiter is not None:
+            waiter.set()
+
     @usermethod
     def pause(self):
         """Pause the measurement, if possible.
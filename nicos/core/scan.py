@@ -25,6 +25,7 @@
 
 """Scan classes, new API."""
 
+import queue
 from contextlib import contextmanager
 from time import time as currenttime
 
@@ -39,7 +40,7 @@ from nicos.core.errors import LimitError, ModeError, NicosError, UsageError
 from nicos.core.mixins import HasLimits
 from nicos.core.params import Value
 from nicos.core.utils import CONTINUE_EXCEPTIONS, SKIP_EXCEPTIONS, multiWait
-from nicos.utils import Repeater, number_types
+from nicos.utils import Repeater, createThread, number_types
 
 
 class SkipPoint(Exception):
@@ -50,6 +51,65 @@ class StopScan(Exception):
     """Custom exception class to stop the rest of the scan."""
 
 
+class PointPipeline:
+    """Background stage to finish the points of a scan.
+
+    Finished points are handed to a worker thread through a bounded queue, so
+    that their data sink handling overlaps with the movement to the next
+    point.  `put` blocks while the queue is full, and `drain` waits until all
+    queued points have been finished, since the sinks must be done with a
+    point before the next one begins.  The first error from the worker is
+    re-raised by `drain`.
+    """
+
+    def __init__(self, maxsize=1):
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        # time spent finishing points, and waiting for the worker
+        self.busytime = 0.
+        self.waittime = 0.
+        self._thread = createThread('scan pipeline', self._worker)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            func, args = item
+            started = currenttime()
+            try:
+                func(*args)
+            except Exception as err:
+                if self._error is None:
+                    self._error = err
+                else:
+                    session.log.exception('error finishing point')
+            finally:
+                self.busytime += currenttime() - started
+                self._queue.task_done()
+
+    def put(self, func, *args):
+        started = currenttime()
+        self._queue.put((func, args))
+        self.waittime += currenttime() - started
+
+    def drain(self):
+        started = currenttime()
+        self._queue.join()
+        self.waittime += currenttime() - started
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            session.log.error('error finishing point', exc=self._error)
+            self._error = None
+
+
 class Scan:
     """
     Represents a general scan over some devices with specified detectors.
@@ -348,7 +408,37 @@ class Scan:
 
     def acquire(self, point, preset):
         preset.pop("live", None)
-        acquire(point, preset, iscompletefunc=self.acquireCompleted)
+        if type(self).acquireCompleted is Scan.acquireCompleted:
+            # no need to check it in the count loop
+            acquire(point, preset)
+        else:
+            acquire(point, preset, iscompletefunc=self.acquireCompleted)
+
+    def _usePipeline(self):
+        return not self._subscan and session.mode != SIMULATION and \
+            session.instrument and session.instrument.pipelinescans
+
+    def _drainPipeline(self, pipeline, num):
+        """Wait until *pipeline* has finished point *num*, and handle errors
+        while finishing it like counting errors of that point.
+        """
+        try:
+            pipeline.drain()
+        except NicosError as err:
+            session.log.warning('Could not finish point %d', num)
+            self.handleError('count', err)
+
+    def _reportTimings(self, pipeline):
+        timings = self.timings
+        msg = ('scan stage times: moving %.2f s, reading environment %.2f s, '
+               'counting %.2f s, finishing points %.2f s' %
+               (timings['move'], timings['read'], timings['count'],
+                timings['finish']))
+        if pipeline:
+            session.log.info('%s (in the background, %.2f s waited for it)',
+                             msg, timings['wait'])
+        else:
+            session.log.debug(msg)
 
     def _inner_run(self):
         dataman = session.experiment.data
@@ -362,9 +452,15 @@ class Scan:
             skip_first_point = True
         # if the scan was already aborted, we haven't started writing
         self.beginScan()
+        pipeline = PointPipeline() if self._usePipeline() else None
+        # number of the last point handed to the pipeline
+        lastnum = 0
+        timings = self.timings = dict.fromkeys(
+            ('move', 'read', 'count', 'finish', 'wait'), 0.)
         try:
             for i, position in enumerate(self._startpositions):
                 with self.pointScope(i + 1):
+                    started = currenttime()
                     try:
                         self.preparePoint(i + 1, position)
                         if i == 0 and skip_first_point:
@@ -384,27 +480,46 @@ class Scan:
                         except Exception:
                             session.log.exception('could not finish point')
                         raise err
+                    timings['move'] += currenttime() - started
+                    if pipeline and lastnum:
+                        # the sinks must be done with the last point
+                        self._drainPipeline(pipeline, lastnum)
+                        lastnum = 0
                     try:
                         # measure...
                         # XXX(dataapi): is target= needed?
                         point = dataman.beginPoint(target=position,
                                                    preset=self._preset)
                         dataman.putValues(waitresults)
+                        started = currenttime()
                         self.readEnvironment()
+                        timings['read'] += currenttime() - started
+                        started = currenttime()
                         try:
                             self.acquire(point, self._preset)
                         finally:
-                            dataman.finishPoint()
+                            timings['count'] += currenttime() - started
+                            started = currenttime()
+                            dataman.finishPoint(pipeline)
+                            timings['finish'] += currenttime() - started
+                            lastnum = i + 1
                     except NicosError as err:
                         self.handleError('count', err)
                     except SkipPoint:
                         pass
                     finally:
                         self.finishPoint()
+            if pipeline and lastnum:
+                self._drainPipeline(pipeline, lastnum)
         except StopScan:
             pass
         finally:
+            if pipeline:
+                pipeline.close()
+                timings['finish'] = pipeline.busytime
+                timings['wait'] = pipeline.waittime
             self.endScan()
+        self._reportTimings(pipeline)
 
 
 class ElapsedTime(DevStatistics):
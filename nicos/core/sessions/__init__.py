@@ -35,8 +35,10 @@ import copy
 import inspect
 import logging
 import os
+import queue
 import stat
 import sys
+import threading
 from os import path
 from shutil import which
 from time import sleep, time as currenttime
@@ -61,12 +63,18 @@ from nicos.devices.cacheclient import CacheClient, CacheLockError, \
 from nicos.devices.instrument import Instrument
 from nicos.devices.notifiers import Notifier
 from nicos.protocols.cache import FLAG_NO_STORE
-from nicos.utils import fixupScript, formatArgs, formatDocstring, \
-    formatScriptError
+from nicos.utils import createThread, fixupScript, formatArgs, \
+    formatDocstring, formatScriptError
 from nicos.utils.loggers import ColoredConsoleHandler, NicosLogfileHandler, \
     NicosLogger, get_facility_log_handlers, initLoggers
 
 
+class CreationDeferred(Exception):
+    """Raised in a thread creating devices in parallel if a device needs a
+    device that is not yet created.
+    """
+
+
 class Session:
     """The Session class provides all low-level routines needed for NICOS
     operations and keeps the global state: devices, configuration, loggers.
@@ -86,6 +94,8 @@ class Session:
     name = 'session'
     cache_class = CacheClient
     sessiontype = MAIN
+    # the waiter of the currently running count loop
+    countloop_waiter = None
 
     def __str__(self):
         # used for cache operations
@@ -131,6 +141,10 @@ class Session:
         self._failed_devices = None
         self._success_devices = None
         self._multi_level = 0
+        # serializes session state updates when creating devices in parallel
+        self._creation_lock = threading.RLock()
+        # set in the threads that create devices in parallel
+        self._creation_local = threading.local()
         # info about all loadable setups
         self._setup_info = {}
         # namespace to place user-accessible items in
@@ -159,6 +173,9 @@ class Session:
         self._script_text = ''
         # will be filled with the path to the sandbox helper if necessary
         self._sandbox_helper = None
+        # pre-warmed simulation process, if configured
+        self._simulation_template = None
+        self._simulation_lock = threading.Lock()
 
         # cache connection
         self.cache = None
@@ -193,6 +210,17 @@ class Session:
         """The current :term:`execution mode` of the session."""
         return self._mode
 
+    @property
+    def countloop_request(self):
+        """A pending request to pause or finish the count loop."""
+        return self._countloop_request
+
+    @countloop_request.setter
+    def countloop_request(self, value):
+        self._countloop_request = value
+        if value and self.countloop_waiter is not None:
+            self.countloop_waiter.set()
+
     def setMode(self, mode):
         """Set a new mode for the session.
 
@@ -287,15 +315,19 @@ class Session:
         cache the result, as it may be called several times
         """
         if self.simulation_db is None:
-            client = SyncCacheClient('Syncer',
-                                     cache=self.current_sysconfig['cache'],
-                                     prefix='nicos/', lowlevel=True)
-            try:
-                self.simulation_db = client.get_values()
-            finally:
-                client.doShutdown()
+            self.simulation_db = self.readSyncDb()
         return self.simulation_db
 
+    def readSyncDb(self):
+        """Read all current cache values for simulation from the cache."""
+        client = SyncCacheClient('Syncer',
+                                 cache=self.current_sysconfig['cache'],
+                                 prefix='nicos/', lowlevel=True)
+        try:
+            return client.get_values()
+        finally:
+            client.doShutdown()
+
     def simulationSync(self, db=None):
         """Synchronize device values and parameters from current cached values.
         """
@@ -308,27 +340,47 @@ class Session:
         self._simulationSync_applyValues(db)
 
     def _simulationSync_applyValues(self, db):
+        # keys with the value Ellipsis have been deleted from the cache since
+        # the last synchronization (see `.CacheClient.get_changes`)
         setups = db.get('session/mastersetupexplicit')
-        if setups is not None and set(setups) != set(self.explicit_setups):
+        if setups is not None and setups is not Ellipsis and \
+           set(setups) != set(self.explicit_setups):
             self.unloadSetup()
             self.loadSetup(setups)
         self.simulation_db = None  # clear cache for getSyncDb
-        # set alias parameter first, needed to set parameters on alias devices
-        for devname, dev in self.devices.items():
-            aliaskey = '%s/alias' % devname.lower()
-            if isinstance(dev, DeviceAlias) and aliaskey in db:
-                dev.alias = db[aliaskey]
         # cache keys are always lowercase, while device names can be mixed,
-        # so we build a map once to get fast lookup
-        lowerdevs = {d.name.lower(): d for d in self.devices.values()}
-        umethods_to_call = []
+        # so we look up the devices by the lowercase names; only the devices
+        # that have keys in the db are touched
+        entries = []
+        aliases = []
         for key, value in db.items():
             if key.count('/') != 1:
                 continue
-            dev, param = key.split('/')
-            if dev not in lowerdevs:
+            devname, param = key.split('/')
+            dev = self.devices.get(self.device_case_map.get(devname))
+            if dev is None:
+                continue
+            entries.append((dev, param, value))
+            if param == 'alias' and isinstance(dev, DeviceAlias) and \
+               value is not Ellipsis:
+                aliases.append((dev, value))
+        # set alias parameter first, needed to set parameters on alias devices
+        for dev, value in aliases:
+            dev.alias = value
+        umethods_to_call = []
+        deleted_params = []
+        for dev, param, value in entries:
+            if value is Ellipsis:
+                # go back to the state of a newly created device
+                if param == 'value':
+                    if isinstance(dev, DeviceAlias) and not dev.alias:
+                        continue
+                    dev._sim_value = 0
+                    dev._sim_min = dev._sim_max = dev._sim_old_value = None
+                elif param in dev.parameters and param != 'name' and \
+                        not dev.parameters[param].no_sim_restore:
+                    deleted_params.append((dev, param))
                 continue
-            dev = lowerdevs[dev]
             if param == 'value':
                 # getting/setting attributes on dangling aliases raises,
                 # so don't try it
@@ -351,6 +403,10 @@ class Session:
                 umethod = getattr(dev, 'doUpdate' + param.title(), None)
                 if umethod:
                     umethods_to_call.append((umethod, value))
+        for dev, param in deleted_params:
+            # gets the value from the setup or the default
+            dev._params.pop(param, None)
+            dev._initParam(param)
         for umethod, value in umethods_to_call:
             umethod(value)
         self.log.info('synchronization complete')
@@ -707,15 +763,33 @@ class Session:
             autocreate_devices = self.autocreate_devices
         if autocreate_devices:
             self.log.debug('autocreating devices...')
-            for devname, (_, devconfig) in sorted(devlist.items()):
+            devnames = sorted(devlist)
+            timings = {}
+            started = currenttime()
+            if config.device_creation_workers > 1 and \
+               self._mode != SIMULATION:
+                failed, devnames = self._createDevicesParallel(
+                    devnames, config.device_creation_workers, timings)
+                for devname, err in failed:
+                    if raise_failed:
+                        raise err
+                    self.log.error("device '%s' failed to create", devname,
+                                   exc_info=(type(err), err,
+                                             err.__traceback__))
+                    failed_devs.append(devname)
+            for devname in devnames:
+                devstarted = currenttime()
                 try:
-                    lowlevel = devconfig.get('lowlevel', False)
+                    lowlevel = devlist[devname][1].get('lowlevel', False)
                     self.createDevice(devname, explicit=not lowlevel)
                 except Exception:
                     if raise_failed:
                         raise
                     self.log.exception("device '%s' failed to create", devname)
                     failed_devs.append(devname)
+                else:
+                    timings[devname] = currenttime() - devstarted
+            self._reportCreationTimes(timings, currenttime() - started)
 
         # validate and try to attach sysconfig devices
         self.log.debug('creating sysconfig devices...')
@@ -778,11 +852,115 @@ class Session:
         if setupnames:
             self.log.info('setups loaded: %s', ', '.join(setupnames))
 
+    def _createDevicesParallel(self, devnames, workers, timings):
+        """Create the given devices in up to *workers* threads.
+
+        A device is only created when all devices it attaches (according to
+        the configuration) have been created.  Returns a list of (device name,
+        exception) for devices that failed to create, and a list of devices
+        that must be created serially: those that need a device during
+        creation that is not created yet, and those attaching them.
+        """
+        deps = {}
+        dependents = {devname: [] for devname in devnames}
+        for devname in devnames:
+            deps[devname] = {dep for dep in self._attachedDeviceNames(devname)
+                             if dep in dependents}
+            for dep in deps[devname]:
+                dependents[dep].append(devname)
+        # devices not yet created by the threads
+        pending = set(devnames)
+        todo = queue.Queue()
+        results = queue.Queue()
+
+        def worker():
+            self._creation_local.pending = pending
+            while True:
+                devname = todo.get()
+                if devname is None:
+                    return
+                started = currenttime()
+                try:
+                    lowlevel = self.configured_devices[devname][1].get(
+                        'lowlevel', False)
+                    self.createDevice(devname, explicit=not lowlevel)
+                except Exception as err:
+                    results.put((devname, err, 0))
+                else:
+                    results.put((devname, None, currenttime() - started))
+
+        threads = [createThread('device creation %d' % (i + 1), worker)
+                   for i in range(min(workers, len(devnames)))]
+        running = 0
+        for devname in devnames:
+            if not deps[devname]:
+                todo.put(devname)
+                running += 1
+        created = set()
+        failed = []
+        while running:
+            devname, err, elapsed = results.get()
+            running -= 1
+            pending.discard(devname)
+            if err is None:
+                created.add(devname)
+                timings[devname] = elapsed
+                for dependent in dependents[devname]:
+                    deps[dependent].discard(devname)
+                    if not deps[dependent]:
+                        todo.put(dependent)
+                        running += 1
+            elif not isinstance(err, CreationDeferred):
+                failed.append((devname, err))
+        for _ in threads:
+            todo.put(None)
+        for thread in threads:
+            thread.join()
+        failed_names = {devname for (devname, _) in failed}
+        return failed, [devname for devname in devnames
+                        if devname not in created | failed_names]
+
+    def _attachedDeviceNames(self, devname):
+        """Return the names of not yet created devices that are configured as
+        attached devices of *devname*.
+        """
+        try:
+            devcls, devconfig = self.importDevice(devname)
+        except Exception:
+            # will be reported when creating the device
+            return set()
+        devconfig = {key.lower(): value for (key, value) in devconfig.items()}
+        result = set()
+        for aname in devcls.attached_devices:
+            value = devconfig.get(aname.lower())
+            for name in (value if isinstance(value, (list, tuple))
+                         else [value]):
+                if isinstance(name, str) and name not in self.devices:
+                    result.add(name)
+        return result
+
+    def _reportCreationTimes(self, timings, elapsed):
+        """Log the time spent creating devices, and the slowest devices."""
+        slowest = sorted(timings, key=timings.get, reverse=True)
+        for devname in slowest:
+            self.log.debug("creating device '%s' took %.3f s",
+                           devname, timings[devname])
+        if elapsed >= 1:
+            self.log.info('creating %d devices took %.2f s, slowest: %s',
+                          len(timings), elapsed,
+                          ', '.join('%s (%.2f s)' % (devname, timings[devname])
+                                    for devname in slowest[:5]))
+
     def unloadSetup(self):
         """Unload the current setup.
 
         This shuts down all created devices and clears the NICOS namespace.
         """
+        with self._simulation_lock:
+            if self._simulation_template:
+                self._simulation_template.shutdown()
+                self._simulation_template = None
+
         # shutdown according to device dependencies
         devs = list(self.devices.values())
         already_shutdown = set()
@@ -1068,6 +1246,12 @@ class Session:
         If given, it is a tuple of ``(old_class, new_class, new_devconfig)``.
         """
         if isinstance(dev, str):
+            pending = getattr(self._creation_local, 'pending', None)
+            if pending is not None and dev in self.configured_devices and \
+               (dev in pending or dev not in self.devices):
+                # the device is created by another thread, or not at all
+                # while creating devices in parallel
+                raise CreationDeferred(dev)
             if dev in self.devices:
                 dev = self.devices[dev]
             elif dev in self.configured_devices:
@@ -1164,21 +1348,25 @@ class Session:
 
             dev = devcls(devname, **devconfig)
             self.log.debug("device '%s' created", devname)
+        except CreationDeferred:
+            raise
         except Exception as err:
-            if self._failed_devices is not None:
-                self._failed_devices[devname] = err
-            else:
-                self.deviceCallback('failed', {devname: str(err)})
-            self.device_failures[devname] = str(err)
+            with self._creation_lock:
+                if self._failed_devices is not None:
+                    self._failed_devices[devname] = err
+                else:
+                    self.deviceCallback('failed', {devname: str(err)})
+                self.device_failures[devname] = str(err)
             raise
-        self.device_failures.pop(devname, None)
-        if self._success_devices is not None:
-            self._success_devices.append(devname)
-        else:
-            self.deviceCallback('create', [devname])
-        if explicit:
-            self.explicit_devices.add(devname)
-            self.export(devname, dev)
+        with self._creation_lock:
+            self.device_failures.pop(devname, None)
+            if self._success_devices is not None:
+                self._success_devices.append(devname)
+            else:
+                self.deviceCallback('create', [devname])
+            if explicit:
+                self.explicit_devices.add(devname)
+                self.export(devname, dev)
         return dev
 
     def destroyDevice(self, devname):
@@ -1454,16 +1642,43 @@ class Session:
         # messages to the client(s)
         from nicos.core.sessions.simulation import SimulationSupervisor
         emitter = getattr(self, 'daemon_device', None)
-        setups = [setup for setup in self.loaded_setups if
-                  setup in self.explicit_setups or
-                  self._setup_info[setup]['extended'].get('dynamic_loaded')]
+        setups = self._simulationSetups()
         user = self.getExecutingUser()
-        supervisor = SimulationSupervisor(self._sandbox_helper, uuid, code,
-                                          setups, user, emitter, quiet=quiet)
+        supervisor = SimulationSupervisor(
+            self._sandbox_helper, uuid, code, setups, user, emitter,
+            quiet=quiet, template=self.getSimulationTemplate(setups))
         supervisor.start()
         if wait:
             supervisor.join()
 
+    def _simulationSetups(self):
+        return [setup for setup in self.loaded_setups if
+                setup in self.explicit_setups or
+                self._setup_info[setup]['extended'].get('dynamic_loaded')]
+
+    def getSimulationTemplate(self, setups=None):
+        """Return the pre-warmed simulation process for the given setups
+        (by default the currently loaded ones), and start it if necessary.
+
+        Returns None if simulation templates are not enabled.
+        """
+        if not config.simulation_template or config.sandbox_simulation or \
+           not hasattr(os, 'fork') or not self.cache:
+            return None
+        from nicos.core.sessions.simulation import SimulationTemplate
+        if setups is None:
+            setups = self._simulationSetups()
+        with self._simulation_lock:
+            template = self._simulation_template
+            if template and (set(template.setups) != set(setups) or
+                             not template.alive()):
+                template.shutdown()
+                template = None
+            if template is None:
+                template = self._simulation_template = \
+                    SimulationTemplate(setups, system_user)
+            return template
+
     # -- Session-specific behavior --------------------------------------------
 
     def updateLiveData(self, parameters, databuffers, labelbuffers=None):
@@ -0,0 +1,195 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Persistent cache for the information read from setup files."""
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+from os import path
+
+from nicos import config
+
+# increase when the layout of the stored entries changes
+CACHE_VERSION = 1
+
+
+def fileStamp(filename):
+    """Return a (mtime, size) tuple for quick change detection of a file."""
+    st = os.stat(filename)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def fileHash(filename):
+    with open(filename, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+class SetupCache:
+    """A store of setup information that persists between processes.
+
+    Entries are keyed by the setup file name.  They contain the pickled
+    information read from the setup file, together with modification time,
+    size and content hash of the setup file and all files consulted via
+    ``configdata()``.  An entry is valid as long as these files are unchanged;
+    a file with a changed modification time is still considered unchanged if
+    its content hash matches.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    @classmethod
+    def fromConfig(cls):
+        """Return the cache configured in nicos.conf, or None if disabled."""
+        if not config.setup_cache_path:
+            return None
+        return cls(path.join(config.nicos_root, config.setup_cache_path,
+                             'setupinfo-py%d%d.pickle' % sys.version_info[:2]))
+
+    def load(self, logger):
+        self.entries = {}
+        self._dirty = False
+        try:
+            with open(self.filename, 'rb') as fp:
+                data = pickle.load(fp)
+            if data['version'] != CACHE_VERSION:
+                raise ValueError('cache version %s is not supported' %
+                                 data['version'])
+            self.entries = data['entries']
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning('setup cache %s is unusable and will be rebuilt: '
+                           '%s', self.filename, err)
+            self._dirty = True
+
+    def save(self, logger):
+        # forget about setup files that have been removed
+        for filename in list(self.entries):
+            if not path.isfile(filename):
+                del self.entries[filename]
+                self._dirty = True
+        if not self._dirty:
+            return
+        tmpname = None
+        try:
+            dirname = path.dirname(self.filename)
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.setupinfo')
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump({'version': CACHE_VERSION,
+                             'entries': self.entries},
+                            fp, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpname, 0o644)
+            # atomically replace, other processes might read the cache
+            os.replace(tmpname, self.filename)
+        except OSError as err:
+            logger.debug('could not write setup cache %s: %s',
+                         self.filename, err)
+            if tmpname and path.exists(tmpname):
+                os.unlink(tmpname)
+        else:
+            self._dirty = False
+
+    def clear(self):
+        self.entries = {}
+        if path.isfile(self.filename):
+            os.unlink(self.filename)
+
+    def check(self, filename, all_setups):
+        """Return True if the entry for *filename* is valid.
+
+        *all_setups* maps setup names to file names; an entry is invalid if a
+        setup used via ``configdata()`` now resolves to a different file.
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return False
+        for (i, (depname, stamp, digest)) in enumerate(entry['files']):
+            if i > 0:
+                setupname = path.splitext(path.basename(depname))[0]
+                if all_setups.get(setupname) != depname:
+                    return False
+            try:
+                newstamp = fileStamp(depname)
+                if newstamp != stamp:
+                    if fileHash(depname) != digest:
+                        return False
+                    # touched, but not changed
+                    entry['files'][i] = (depname, newstamp, digest)
+                    self._dirty = True
+            except OSError:
+                return False
+        return True
+
+    def get(self, setupname, filename, all_setups):
+        """Return the cached (info, explicit) data for a setup, or None."""
+        entry = self.entries.get(filename)
+        if entry is not None and entry['setupname'] == setupname and \
+           self.check(filename, all_setups):
+            try:
+                result = pickle.loads(entry['data'])
+            except Exception:
+                pass
+            else:
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, setupname, filename, code, data):
+        """Store the *data* read from the given setup file.
+
+        *code* is the content of the setup file that was executed.
+        """
+        try:
+            pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # setup contains values that cannot be stored; read it every time
+            self.entries.pop(filename, None)
+            return
+        digest = hashlib.sha1(code).hexdigest()
+        try:
+            stamp = fileStamp(filename)
+            if fileHash(filename) != digest:
+                # changed while reading it
+                return
+            files = [(filename, stamp, digest)]
+            for depname in data[0]['filenames'][1:]:
+                files.append((depname, fileStamp(depname), fileHash(depname)))
+        except OSError:
+            return
+        self.entries[filename] = {
+            'setupname': setupname,
+            'files': files,
+            'data': pickled,
+        }
+        self._dirty = True
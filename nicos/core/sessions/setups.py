@@ -25,6 +25,7 @@
 """Setup file handling."""
 
 from nicos.core.params import nicosdev_re
+from nicos.core.sessions.setupcache import SetupCache
 from nicos.utils import Device
 from nicos.utils.files import iterSetups
 
@@ -126,12 +127,24 @@ class SetupBlock(MonitorElement):
         return 'SetupBlock<%s:%s>' % (self._setupname, self._blockname)
 
 
-def readSetups(paths, logger):
-    """Read all setups on the given paths."""
+def readSetups(paths, logger, cache=None):
+    """Read all setups on the given paths.
+
+    Unchanged setups are taken from the given `.SetupCache`, or the one
+    configured in nicos.conf if *cache* is None.  Pass False to read all setup
+    files without a cache.
+    """
+    if cache is None:
+        cache = SetupCache.fromConfig()
+    if cache:
+        cache.load(logger)
     infodict = {}
     all_setups = dict(iterSetups(paths))
     for (setupname, filename) in all_setups.items():
-        readSetup(infodict, setupname, filename, all_setups, logger)
+        readSetup(infodict, setupname, filename, all_setups, logger,
+                  cache or None)
+    if cache:
+        cache.save(logger)
     # check if all includes exist
     for name, info in infodict.items():
         if info is None:
@@ -228,28 +241,33 @@ def fixup_stacked_devices(logger, devdict):
     return devdict
 
 
-def readSetup(infodict, modname, filepath, all_setups, logger):
+def executeSetup(modname, filepath, all_setups, logger, cache=None):
+    """Execute a setup file and return the information read from it.
+
+    The result is a tuple of the setup info dictionary and a dictionary of
+    the values that are explicitly given in the file, or None on errors.
+    """
     try:
         with open(filepath, 'rb') as modfile:
             code = modfile.read()
     except OSError as err:
         logger.exception('Could not read setup '
                          'module %r: %s', filepath, err)
-        return
+        return None
     ns = prepareNamespace(modname, filepath, all_setups)
     try:
         exec(code, ns)
     except Exception as err:
         logger.exception('An error occurred while processing '
                          'setup %r: %s', filepath, err)
-        return
+        return None
     devices = fixup_stacked_devices(logger, ns.get('devices', {}))
     for devname in devices:
         if not nicosdev_re.match(devname):
             logger.exception('While processing setup %r: device name %r is '
                              'invalid, names must be Python identifiers',
                              filepath, devname)
-            return
+            return None
     info = {
         'description': ns.get('description', modname),
         'group': ns.get('group', 'optional'),
@@ -266,6 +284,22 @@ def readSetup(infodict, modname, filepath, all_setups, logger):
         'monitor_blocks': ns.get('monitor_blocks', {}),
         'watch_conditions': ns.get('watch_conditions', []),
     }
+    explicit = {key: ns[key] for key in ('description', 'group',
+                                         'display_order') if key in ns}
+    if cache is not None:
+        cache.put(modname, filepath, code, (info, explicit))
+    return info, explicit
+
+
+def readSetup(infodict, modname, filepath, all_setups, logger, cache=None):
+    data = None
+    if cache is not None:
+        data = cache.get(modname, filepath, all_setups)
+    if data is None:
+        data = executeSetup(modname, filepath, all_setups, logger, cache)
+        if data is None:
+            return
+    info, explicit = data
     if info['group'] not in SETUP_GROUPS:
         logger.warning('Setup %s has an invalid group (valid groups '
                        'are: %s)', modname, ', '.join(SETUP_GROUPS))
@@ -273,9 +307,9 @@ def readSetup(infodict, modname, filepath, all_setups, logger):
     if modname in infodict:
         # setup already exists; override/extend with new values
         oldinfo = infodict[modname] or {}
-        oldinfo['description'] = ns.get('description',
-                                        oldinfo['description'])
-        oldinfo['group'] = ns.get('group', oldinfo['group'])
+        oldinfo['description'] = explicit.get('description',
+                                              oldinfo['description'])
+        oldinfo['group'] = explicit.get('group', oldinfo['group'])
         oldinfo['sysconfig'].update(info['sysconfig'])
         oldinfo['includes'].extend(info['includes'])
         oldinfo['excludes'].extend(info['excludes'])
@@ -287,8 +321,8 @@ def readSetup(infodict, modname, filepath, all_setups, logger):
                 del oldinfo['devices'][devname]
         oldinfo['startupcode'] += '\n' + info['startupcode']
         oldinfo['alias_config'].update(info['alias_config'])
-        oldinfo['display_order'] = ns.get('display_order',
-                                          oldinfo['display_order'])
+        oldinfo['display_order'] = explicit.get('display_order',
+                                                oldinfo['display_order'])
         oldinfo['extended'].update(info['extended'])
         oldinfo['filenames'].extend(info['filenames'])
         oldinfo['monitor_blocks'].update(info['monitor_blocks'])
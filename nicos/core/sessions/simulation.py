@@ -27,11 +27,13 @@
 import logging
 import os
 import pickle
+import signal
 import sys
 import tempfile
+from multiprocessing.connection import Connection, Pipe
 from os import path
-from threading import Thread
-from time import sleep
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 
 import zmq
 
@@ -42,7 +44,7 @@ from nicos.core.sessions import Session
 from nicos.core.sessions.utils import LoggingStdout
 from nicos.core.utils import User
 from nicos.services.daemon.script import parseScript
-from nicos.utils import createSubprocess
+from nicos.utils import createSubprocess, createThread
 from nicos.utils.loggers import ACTION, SimDebugHandler, recordToMessage
 from nicos.utils.messaging import nicos_zmq_ctx
 
@@ -91,7 +93,7 @@ class SimLogSender(logging.Handler):
         self.level = 0
 
     def emit(self, record):
-        if record.levelno == ACTION:
+        if record.levelno == ACTION or self.socket is None:
             return
         if not self.quiet:
             msg = recordToMessage(record, self.simuuid)
@@ -102,6 +104,8 @@ class SimLogSender(logging.Handler):
                                     [block, time, self.simuuid])))
 
     def finish(self, exception=False):
+        if self.socket is None:
+            return
         stoptime = -1 if exception else self.session.clock.time
         devinfo = {}
         for devname in self.devices:
@@ -160,71 +164,155 @@ class SimulationSession(Session):
         # send log messages back to daemon if requested
         session.log_sender = SimLogSender(socket, session, uuid, quiet)
 
+        if not session._setupSimulation(setups, user, db):
+            return 1
+        session._runCode(code)
+
+    @classmethod
+    def runTemplate(cls, fds, setups, user, debug=False):
+        """Load the setups and then fork a new simulation for each request
+        from the `SimulationTemplate` in the daemon.
+
+        *fds* are the file descriptors of the pipes for requests and replies,
+        separated by a comma.
+        """
+        session.__class__ = cls
+        session._is_sandboxed = False
+        session._debug_log = debug
+
+        rfd, wfd = (int(fd) for fd in fds.split(','))
+        requests = Connection(rfd, writable=False)
+        replies = Connection(wfd, readable=False)
+
+        # the first request is the cache database to synchronize to
+        db = requests.recv()
+
+        # messages are only sent by the forked simulations
+        session.log_sender = SimLogSender(None, session, '', True)
+
+        if not session._setupSimulation(setups, user, db):
+            replies.send(None)
+            return 1
+        replies.send(os.getpid())
+
+        # forked simulations are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        while True:
+            try:
+                sock, uuid, user, code, quiet, delta = requests.recv()
+            except EOFError:
+                break
+            try:
+                # only the values changed since the last request are sent
+                session._simulationSync_applyValues(delta)
+            except Exception:
+                session.log.exception('Exception while synchronizing')
+                replies.send(None)
+                break
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    requests.close()
+                    replies.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    session._runForked(sock, uuid, user, code, quiet)
+                finally:
+                    os._exit(0)
+            replies.send(pid)
+        session.shutdown()
+        return 0
+
+    def _setupSimulation(self, setups, user, db):
+        """Initialize the session and load the setups, return True if
+        successful.
+        """
         username, level = user.rsplit(',', 1)
-        session._user = User(username, int(level))
+        self._user = User(username, int(level))
 
         try:
-            session.__init__(SIMULATION)
+            self.__init__(SIMULATION)
         except Exception as err:
             try:
-                session.log.exception('Fatal error while initializing')
+                self.log.exception('Fatal error while initializing')
             finally:
                 print('Fatal error while initializing:', err, file=sys.stderr)
-            return 1
+            return False
 
         # Give a sign of life and then tell the log handler to only log
         # errors during setup.
-        session.log.info('setting up dry run...')
-        session.begin_setup()
+        self.log.info('setting up dry run...')
+        self.begin_setup()
         # Handle "print" statements in the script.
         sys.stdout = LoggingStdout()
 
         try:
             # Initialize the session in simulation mode.
-            session._mode = SIMULATION
+            self._mode = SIMULATION
 
             # Load the setups from the original system, this should give the
             # information about the cache address.
-            session.log.info('loading simulation mode setups: %s',
-                             ', '.join(setups))
-            session.loadSetup(setups, allow_startupcode=False)
+            self.log.info('loading simulation mode setups: %s',
+                          ', '.join(setups))
+            self.loadSetup(setups, allow_startupcode=False)
 
             # Synchronize setups and cache values.
-            session.log.info('synchronizing to master session')
-            session.simulationSync(db)
+            self.log.info('synchronizing to master session')
+            self.simulationSync(db)
 
             # Set session to always abort on errors.
-            session.experiment.errorbehavior = 'abort'
+            self.experiment.errorbehavior = 'abort'
         except BaseException:
-            session.log.exception('Exception in dry run setup')
-            session.log_sender.finish()
-            session.shutdown()
-            return 1
+            self.log.exception('Exception in dry run setup')
+            self.log_sender.finish()
+            self.shutdown()
+            return False
+        return True
+
+    def _runForked(self, sock, uuid, user, code, quiet):
+        """Run the *code* in a process forked from the template process."""
+        # kill forcibly after 10 minutes, like the non-forked processes
+        if hasattr(signal, 'alarm'):
+            signal.alarm(600)
+        # the zmq context of the template must not be used after forking
+        context = zmq.Context()
+        socket = context.socket(zmq.DEALER)
+        socket.connect(sock)
+        self.log_sender.socket = socket
+        self.log_sender.simuuid = uuid
+        self.log_sender.quiet = quiet
+        username, level = user.rsplit(',', 1)
+        self._user = User(username, int(level))
+        try:
+            self._runCode(code)
+        finally:
+            socket.close(linger=5000)
+            context.term()
 
+    def _runCode(self, code):
         # Set up log handlers to output everything.
-        session.log_sender.begin_exec()
+        self.log_sender.begin_exec()
         # Execute the script code.
         exception = False
         try:
-            last_clock = session.clock.time
+            last_clock = self.clock.time
             code, _ = parseScript(code)
             for i, c in enumerate(code):
-                exec(c, session.namespace)
-                time = session.clock.time - last_clock
-                last_clock = session.clock.time
-                session.log_sender.send_block_result(i, time)
+                exec(c, self.namespace)
+                time = self.clock.time - last_clock
+                last_clock = self.clock.time
+                self.log_sender.send_block_result(i, time)
         except Abort:
-            session.log.info('Dry run finished by abort()')
+            self.log.info('Dry run finished by abort()')
         except BaseException:
-            session.log.exception('Exception in dry run')
+            self.log.exception('Exception in dry run')
             exception = True
         else:
-            session.log.info('Dry run finished')
+            self.log.info('Dry run finished')
         finally:
-            session.log_sender.finish(exception)
+            self.log_sender.finish(exception)
 
         # Shut down.
-        session.shutdown()
+        self.shutdown()
 
     def _initLogging(self, prefix=None, console=True):
         Session._initLogging(self, prefix, console=False,
@@ -244,21 +332,158 @@ class SimulationSession(Session):
         raise Abort
 
 
+class SimulationTemplate:
+    """Handle for a simulation process that has loaded the given setups and
+    forks a new simulation for each dry run.
+
+    Before forking, the template only applies the cache values that changed
+    since the last dry run, according to the change journal of the session's
+    cache client.  Deleted values are reset to those of newly created devices,
+    while expired values keep their last known value, as they would for a new
+    simulation process reading them from the cache.
+    """
+
+    def __init__(self, setups, user):
+        self.setups = setups
+        self._lock = Lock()
+        self._ready = Event()
+        self._stopped = False
+        self._proc = None
+        self._requests = self._replies = None
+        # the version of the cache data the template is synchronized to
+        self._version = None
+        createThread('simulation template', self._start, args=(user,))
+
+    def _start(self, user):
+        started = monotonic()
+        requests_r, requests_w = Pipe(duplex=False)
+        replies_r, replies_w = Pipe(duplex=False)
+        fds = (requests_r.fileno(), replies_w.fileno())
+        scriptname = path.join(config.nicos_root, 'bin', 'nicos-simulate')
+        args = ['%d,%d' % fds, 'template', ','.join(self.setups),
+                '%s,%d' % (user.name, user.level), '', '--template']
+        if config.sandbox_simulation_debug:
+            args.append('--debug')
+        with self._lock:
+            if self._stopped:
+                return
+            self._proc = createSubprocess([sys.executable, scriptname] + args,
+                                          pass_fds=fds)
+            self._requests, self._replies = requests_w, replies_r
+        requests_r.close()
+        replies_w.close()
+        try:
+            # values changing while reading are sent again with the first run
+            version, _ = session.cache.get_changes()
+            self._requests.send(session.readSyncDb())
+            if self._replies.recv() is None:
+                raise NicosError('setup of the template failed')
+        except Exception as err:
+            if not self._stopped:
+                session.log.warning('could not start the simulation '
+                                    'template: %s', err)
+            self.shutdown()
+            return
+        self._version = version
+        self._ready.set()
+        session.log.debug('simulation template for setups %s ready after '
+                          '%.2f s', ', '.join(self.setups),
+                          monotonic() - started)
+
+    def alive(self):
+        """Return True if the template is starting up or ready."""
+        return not self._stopped and (self._proc is None or
+                                      self._proc.poll() is None)
+
+    def wait(self, timeout=None):
+        """Wait until the template is ready, return True if it is."""
+        return self._ready.wait(timeout) and self.alive()
+
+    def fork(self, sock, uuid, user, code, quiet):
+        """Fork a simulation of *code* that sends its messages to the zmq
+        socket *sock*, and return its process ID.
+
+        Returns None if the template is not ready (yet).
+        """
+        if not self._ready.is_set():
+            return None
+        with self._lock:
+            if not self.alive():
+                return None
+            version, delta = session.cache.get_changes(self._version)
+            try:
+                self._requests.send((sock, uuid, user, code, quiet, delta))
+                if not self._replies.poll(10):
+                    raise NicosError('no reply from the template')
+                pid = self._replies.recv()
+            except Exception as err:
+                session.log.warning('simulation template failed: %s', err)
+                pid = None
+            if pid is None:
+                self._stop()
+                return None
+            self._version = version
+            return pid
+
+    def shutdown(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        self._stopped = True
+        self._ready.clear()
+        for conn in (self._requests, self._replies):
+            if conn is not None:
+                conn.close()
+        self._requests = self._replies = None
+        if self._proc is not None and self._proc.poll() is None:
+            # the simulations forked by the template are not affected
+            self._proc.terminate()
+            self._proc.wait()
+
+
+class ForkedProcess:
+    """Replacement for `subprocess.Popen` for simulation processes forked by
+    the template, which are not children of this process.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def poll(self):
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return 0
+        except OSError:
+            pass
+        return None
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutError
+            sleep(0.01)
+        return 0
+
+
 class SimulationSupervisor(Thread):
     """Thread for starting a simulation process, receiving messages from a zmq
     socket and displaying/sending them to the client.
     """
 
     def __init__(self, sandbox, uuid, code, setups, user, emitter,
-                 more_args=None, quiet=False):
+                 more_args=None, quiet=False, template=None):
         Thread.__init__(self, target=self._run,
                         name='SimulationSupervisor',
                         args=(sandbox, uuid, code, setups, user, emitter,
-                              more_args or [], quiet))
+                              more_args or [], quiet, template))
         # "daemonize this thread" attribute, not referring to the NICOS daemon.
         self.daemon = True
 
-    def _run(self, sandbox, uuid, code, setups, user, emitter, args, quiet):
+    def _run(self, sandbox, uuid, code, setups, user, emitter, args, quiet,
+             template):
         socket = nicos_zmq_ctx.socket(zmq.DEALER)
         poller = zmq.Poller()
         poller.register(socket, zmq.POLLIN)
@@ -276,22 +501,29 @@ class SimulationSupervisor(Thread):
             port = socket.bind_to_random_port('tcp://127.0.0.1')
             sockname = 'tcp://127.0.0.1:%s' % port
             prefixargs = []
-        scriptname = path.join(config.nicos_root, 'bin', 'nicos-simulate')
         userstr = '%s,%d' % (user.name, user.level)
-        if quiet:
-            args.append('--quiet')
-        if config.sandbox_simulation_debug:
-            args.append('--debug')
-        proc = createSubprocess(prefixargs +
-                                [sys.executable, scriptname, sockname, uuid,
-                                 ','.join(setups), userstr, code] + args)
-        if sandbox:
-            if not session.current_sysconfig.get('cache'):
-                raise NicosError('no cache is configured')
-            socket.send(pickle.dumps(session.cache.get_values()))
+        pid = None
+        if template is not None:
+            pid = template.fork(sockname, uuid, userstr, code, quiet)
+        if pid is not None:
+            proc = ForkedProcess(pid)
         else:
-            # let the subprocess connect to the cache
-            socket.send(b'')
+            scriptname = path.join(config.nicos_root, 'bin', 'nicos-simulate')
+            if quiet:
+                args.append('--quiet')
+            if config.sandbox_simulation_debug:
+                args.append('--debug')
+            proc = createSubprocess(prefixargs +
+                                    [sys.executable, scriptname, sockname,
+                                     uuid, ','.join(setups), userstr, code] +
+                                    args)
+            if sandbox:
+                if not session.current_sysconfig.get('cache'):
+                    raise NicosError('no cache is configured')
+                socket.send(pickle.dumps(session.cache.get_values()))
+            else:
+                # let the subprocess connect to the cache
+                socket.send(b'')
         while True:
             res = poller.poll(500)
             if not res:
@@ -26,6 +26,7 @@
 
 """NICOS core utility functions."""
 
+import threading
 from collections import namedtuple
 from functools import wraps
 from time import localtime, time as currenttime
@@ -43,6 +44,8 @@ CONTINUE_EXCEPTIONS = (PositionError, MoveError, NicosTimeoutError)
 # Exceptions at which a scan point is skipped.
 SKIP_EXCEPTIONS = (InvalidValueError, LimitError, CommunicationError,
                    ComputationError)
+# Initial delay between checks when waiting for devices.
+WAIT_MIN_DELAY = 0.01
 
 
 # user access levels
@@ -178,6 +181,96 @@ def multiStatus(devices, maxage=None):
                                'implemented?)'
 
 
+class DeviceWaiter:
+    """Sleeps between the checks while waiting for *devices*.
+
+    If the session uses a cache, the sleep ends early whenever a key of one of
+    the devices (like its status or value, or only the given *key*) is updated
+    by this process or another one (like the poller), and at the latest after
+    *maxdelay*.  A busy status that was put into the cache by others since the
+    last check of a device is used by `isCompleted` instead of asking the
+    hardware again.
+
+    Without a cache, the delay between checks starts at `WAIT_MIN_DELAY` and
+    is doubled after each check up to *maxdelay*, so that short movements are
+    detected early without too many checks for long ones.
+
+    The sleep also ends early when `set` is called from another thread.
+    """
+
+    def __init__(self, devices, maxdelay, key=None):
+        self.maxdelay = maxdelay
+        self.key = key
+        self.delay = min(WAIT_MIN_DELAY, maxdelay)
+        self.devices = list(devices)
+        self.event = threading.Event()
+        self.thread = threading.current_thread()
+        self.cache = None
+        # device -> time of its last check by asking the hardware
+        self._checked = {}
+        if session.mode != SIMULATION and session.cache:
+            self.cache = session.cache
+            self.delay = maxdelay
+            for dev in self.devices:
+                self.cache.addWakeup(dev, self, key)
+
+    def set(self):
+        # updates from the checks themselves must not cause more checks
+        if threading.current_thread() is not self.thread:
+            self.event.set()
+
+    def isCompleted(self, dev):
+        """Check for completion of *dev*, like ``dev.isCompleted()``.
+
+        The hardware is only asked if there is no cache, the device overrides
+        the check, or no fresh busy status from others is in the cache.
+        """
+        if self.cache is not None and not hasattr(dev, 'doIsCompleted') \
+           and dev in self._checked:
+            entry = self.cache.get_entry(dev, 'status')
+            if entry is not None and entry[0] and \
+               entry[0][0] in dev.busystates and \
+               entry[1] >= max(self._checked[dev],
+                               currenttime() - self.maxdelay):
+                return False
+        try:
+            return dev.isCompleted()
+        finally:
+            self._checked[dev] = currenttime()
+
+    def sleep(self, delay=None):
+        """Sleep until the next check; return the time slept.
+
+        If no *delay* is given, the current back-off delay is used, or
+        *maxdelay* if there is a cache.
+        """
+        if delay is None:
+            delay = self.delay
+            self.delay = min(2 * self.delay, self.maxdelay)
+        if session.mode == SIMULATION:
+            # (the simulation session does not really sleep)
+            session.delay(delay)
+            return delay
+        started = currenttime()
+        session.breakpoint(5)
+        self.event.wait(delay)
+        self.event.clear()
+        session.breakpoint(5)
+        return currenttime() - started
+
+    def close(self):
+        if self.cache is not None:
+            for dev in self.devices:
+                self.cache.removeWakeup(dev, self, self.key)
+            self.cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def multiWait(devices):
     """Wait for the *devices*.
 
@@ -200,7 +293,6 @@ def multiWait(devices):
                          if hasattr(dev, 'target') else str(dev)
                          for dev in reversed(devlist))
 
-    delay = 0.3
     final_exc = None
     devlist = list(devIter(devices, baseclass=Waitable, allwaiters=True))
     session.log.debug('multiWait: initial devices %s, all waiters %s',
@@ -213,6 +305,7 @@ def multiWait(devices):
     eta_str = ''
     target_str = get_target_str()
     session.action(target_str)
+    waiter = DeviceWaiter(devlist, 0.3)
     try:
         while devlist:
             session.log.debug('multiWait: iteration %d, devices left %s',
@@ -220,7 +313,7 @@ def multiWait(devices):
             loops += 1
             for dev in devlist[:]:
                 try:
-                    done = dev.isCompleted()
+                    done = waiter.isCompleted(dev)
                     if done:
                         dev.finish()
                 except Exception as exc:
@@ -260,11 +353,11 @@ def multiWait(devices):
                     eta_str = ('estimated %s left / ' % formatDuration(max(eta))
                                if eta else '')
                     session.action(eta_str + target_str)
-                session.delay(delay)
-                eta_update += delay
+                eta_update += waiter.sleep()
         if final_exc:
             raise final_exc
     finally:
+        waiter.close()
         session.endActionScope()
         session.log.debug('multiWait: finished')
     return values
@@ -288,11 +381,12 @@ def waitForState(dev, state, delay=0.3, ignore_errors=False):
     Calls `status` until it returns `state` on its first element or raises.
     """
     try:
-        while True:
-            st = dev.status()[0]
-            if st == state:
-                break
-            session.delay(delay)
+        with DeviceWaiter([dev], delay) as waiter:
+            while True:
+                st = dev.status()[0]
+                if st == state:
+                    break
+                waiter.sleep()
     except Exception:
         if ignore_errors:
             return
@@ -305,8 +399,9 @@ def waitForCompletion(dev, delay=0.3, ignore_errors=False):
     Calls `isCompleted` until it returns true or raises.
     """
     try:
-        while not dev.isCompleted():
-            session.delay(delay)
+        with DeviceWaiter([dev], delay) as waiter:
+            while not waiter.isCompleted(dev):
+                waiter.sleep()
     except NicosError:
         if ignore_errors:
             return
@@ -355,6 +450,71 @@ def multiReference(dev, subdevs, parallel=False):
                                   in zip(subdevs, errored) if err))
 
 
+def commResource(dev):
+    """Return the name of the communication resource used by *dev*.
+
+    This is the name of the first attached device that handles communication
+    without being readable itself (like a bus), or else the name of the device.
+    """
+    from nicos.core.device import Readable
+    from nicos.core.mixins import HasCommunication
+
+    for adev in getattr(dev, '_adevs', {}).values():
+        if isinstance(adev, HasCommunication) and \
+           not isinstance(adev, Readable):
+            return adev.name
+    return str(dev)
+
+
+def multiCall(func, devices, workers=0):
+    """Call ``func(dev)`` for each of the *devices* and return the results.
+
+    With *workers* greater than one, up to that many threads are used to do
+    the calls concurrently; calls for devices using the same communication
+    resource (see `commResource`) are still done one after the other.  The
+    results are returned in the order of the devices.  If calls raise, the
+    exception of the first device is re-raised after all calls have been
+    finished, all other exceptions are logged.
+    """
+    devices = list(devices)
+    if workers <= 1 or len(devices) <= 1:
+        return [func(dev) for dev in devices]
+
+    groups = {}
+    for (i, dev) in enumerate(devices):
+        groups.setdefault(commResource(dev), []).append(i)
+    groups = list(groups.values())
+    results = [None] * len(devices)
+    errors = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not groups:
+                    return
+                indices = groups.pop(0)
+            for i in indices:
+                try:
+                    results[i] = func(devices[i])
+                except BaseException as err:
+                    errors[i] = err
+
+    # the calling thread is one of the workers
+    threads = [createThread('multicall %d' % (n + 1), worker)
+               for n in range(min(workers, len(groups)) - 1)]
+    worker()
+    for thread in threads:
+        thread.join()
+    if errors:
+        first = min(errors)
+        for i in sorted(errors)[1:]:
+            getattr(devices[i], 'log', session.log).error(
+                'error in concurrent call', exc=errors[i])
+        raise errors[first]
+    return results
+
+
 def formatStatus(st):
     const, message = st
     const = status.statuses.get(const, str(const))
@@ -28,17 +28,29 @@
 import queue
 import select
 import threading
-from time import sleep, time as currenttime
+from time import monotonic, sleep, time as currenttime
 
 from nicos import session
-from nicos.core import CacheError, CacheLockError, Device, Param, host
+from nicos.core import CacheError, CacheLockError, Device, Override, Param, \
+    host, intrange, oneof
 from nicos.protocols.cache import BUFSIZE, CYCLETIME, DEFAULT_CACHE_PORT, \
-    END_MARKER, OP_ASK, OP_LOCK, OP_LOCK_LOCK, OP_LOCK_UNLOCK, OP_REWRITE, \
-    OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, OP_UNSUBSCRIBE, OP_WILDCARD, \
-    SYNC_MARKER, cache_dump, cache_load, line_pattern, msg_pattern
+    ENCODING_KEY, ENCODINGS, END_MARKER, OP_ASK, OP_LOCK, OP_LOCK_LOCK, \
+    OP_LOCK_UNLOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, \
+    OP_UNSUBSCRIBE, OP_WILDCARD, SYNC_MARKER, ValueDecoder, cache_dump, \
+    cache_load, line_pattern, msg_pattern, parse_msg
 from nicos.utils import closeSocket, createThread, getSysInfo, tcpSocket
 
 
+class SendQueue(queue.Queue):
+    """A queue that remembers when each item was put into it.
+
+    `get()` returns tuples ``(monotonic time of put, item)``.
+    """
+
+    def _put(self, item):
+        self.queue.append((monotonic(), item))
+
+
 class BaseCacheClient(Device):
     """
     An extensible read/write client for the NICOS cache.
@@ -49,6 +61,17 @@ class BaseCacheClient(Device):
                         type=host(defaultport=DEFAULT_CACHE_PORT),
                         mandatory=True),
         'prefix': Param('Cache key prefix', type=str, mandatory=True),
+        'encoding': Param('Value encoding to request from the cache server '
+                          '(PyON is used if the server does not support it)',
+                          type=oneof(*ENCODINGS), default='pyon'),
+        'sendbatch': Param('Maximum number of bytes of queued messages to send '
+                           'to the server at once',
+                           type=intrange(1024, 16 * 1024 * 1024),
+                           default=64 * 1024),
+        'coalesce': Param('Send only the last of several queued updates of '
+                          'the same key (only for keys with the prefix); '
+                          'the superseded values will be missing in the '
+                          'history', type=bool, default=False),
     }
 
     remote_callbacks = True
@@ -79,10 +102,17 @@ class BaseCacheClient(Device):
         # maps oldprefix -> set of new prefixes without self._prefix prepended
         self._rewrites = {}
         self._prefixcallbacks = {}
+        # value encoding negotiated with the server, and the decoder for
+        # received values (only used in the worker thread)
+        self._encoding = 'pyon'
+        self._decode = ValueDecoder()
 
         self._stoprequest = False
-        self._queue = queue.Queue()
+        self._queue = SendQueue()
         self._synced = True
+        # statistics about the sent messages
+        self._sendstats = dict(messages=0, coalesced=0, batches=0,
+                               latency=0., maxlatency=0.)
 
         # create worker thread, but do not start yet, leave that to subclasses
         self._worker = createThread('CacheClient worker', self._worker_thread,
@@ -111,6 +141,7 @@ class BaseCacheClient(Device):
             self._connected = True
             self._disconnect_warnings = 0
             try:
+                self._negotiate_encoding()
                 self._connect_action()
             except Exception as err:
                 self._disconnect('unable to init connection to %s: %s' %
@@ -141,6 +172,24 @@ class BaseCacheClient(Device):
     def _wait_data(self):
         pass
 
+    def _negotiate_encoding(self):
+        self._encoding = 'pyon'
+        if self.encoding == 'pyon':
+            return
+        self._socket.sendall(('%s%s%s\n' % (ENCODING_KEY, OP_ASK,
+                                            self.encoding)).encode())
+        data = b''
+        while not data.endswith(b'\n'):
+            newdata = self._socket.recv(BUFSIZE)
+            if not newdata:
+                raise CacheError('connection closed during negotiation')
+            data += newdata
+        # old servers reply with OP_TELLOLD: the key is unknown
+        msg = parse_msg(data.decode().strip())
+        if msg and msg[5] == OP_TELL and msg[6] in ENCODINGS:
+            self._encoding = msg[6]
+        self.log.debug('using %s value encoding', self._encoding)
+
     def _connect_action(self):
         # send request for all keys and updates....
         # (send a single request for a nonexisting key afterwards to
@@ -171,7 +220,7 @@ class BaseCacheClient(Device):
         raise NotImplementedError('implement _handle_msg in subclasses')
 
     def _process_data(self, data, sync_str=(SYNC_MARKER + OP_TELLOLD).encode(),
-                      lmatch=line_pattern.match, mmatch=msg_pattern.match):
+                      lmatch=line_pattern.match, parse=parse_msg):
         # n = 0
         i = 0  # avoid making a string copy for every line
         match = lmatch(data, i)
@@ -182,15 +231,15 @@ class BaseCacheClient(Device):
                 self.log.debug('process data: received sync: %r', line)
                 self._synced = True
             else:
-                msgmatch = mmatch(line.decode())
+                line = line.decode()
+                msg = parse(line)
                 # ignore invalid lines
-                if msgmatch:
+                if msg:
                     # n += 1
                     try:
-                        self._handle_msg(**msgmatch.groupdict())
+                        self._handle_msg(*msg)
                     except Exception:
-                        self.log.exception('error handling message %r',
-                                           msgmatch.group())
+                        self.log.exception('error handling message %r', line)
             # continue loop
             match = lmatch(data, i)
         # self.log.debug('processed %d items', n)
@@ -257,19 +306,11 @@ class BaseCacheClient(Device):
                     break
 
                 if res[1]:
-                    # determine if something needs to be sent
-                    tosend = ''
-                    itemcount = 0
-                    try:
-                        # bunch a few messages together, but not unlimited
-                        for _ in range(10):
-                            tosend += self._queue.get(False)
-                            itemcount += 1
-                    except queue.Empty:
-                        pass
+                    # determine what needs to be sent
+                    tosend, itemcount = self._get_batch()
                     # write data
                     try:
-                        self._socket.sendall(tosend.encode())
+                        self._socket.sendall(tosend)
                     except Exception:
                         self._disconnect('disconnect: send failed')
                         # report data as processed, but then re-queue it to send
@@ -277,7 +318,7 @@ class BaseCacheClient(Device):
                         for _ in range(itemcount):
                             self._queue.task_done()
                         data = b''
-                        self._queue.put(tosend)
+                        self._queue.put(tosend.decode())
                         break
                     for _ in range(itemcount):
                         self._queue.task_done()
@@ -296,28 +337,86 @@ class BaseCacheClient(Device):
 
         if self._socket:
             # send rest of data
-            tosend = ''
-            itemcount = 0
-            try:
-                while 1:
-                    tosend += self._queue.get(False)
-                    itemcount += 1
-            except queue.Empty:
-                pass
-            try:
-                self._socket.sendall(tosend.encode())
-            except Exception:
-                self.log.debug('exception while sending last batch of updates',
-                               exc=1)
-                # no reraise, we'll disconnect below anyways
-            for _ in range(itemcount):
-                self._queue.task_done()
+            while not self._queue.empty():
+                tosend, itemcount = self._get_batch()
+                try:
+                    self._socket.sendall(tosend)
+                except Exception:
+                    self.log.debug('exception while sending last batch of '
+                                   'updates', exc=1)
+                    # no reraise, we'll disconnect below anyways
+                finally:
+                    for _ in range(itemcount):
+                        self._queue.task_done()
 
         # end of while loop
         self._disconnect()
 
-    def _single_request(self, tosend, sentinel=b'\n', retry=2, sync=False):
-        """Communicate over the secondary socket."""
+    def _get_batch(self, parse=parse_msg):
+        """Get queued messages, up to *sendbatch* bytes, to send at once.
+
+        If *coalesce* is set, updates of a key that are superseded by a later
+        update of the same key in the batch are dropped.  Since the flag is
+        part of the key, this only happens for updates with the same flag.
+        All other messages act as barriers: updates are never coalesced across
+        them.
+
+        Returns the encoded data and the number of items taken from the queue.
+        """
+        stats = self._sendstats
+        coalesce = self.coalesce
+        prefix = self._prefix
+        budget = self.sendbatch
+        batch = []
+        latest = {}
+        size = 0
+        try:
+            while size < budget:
+                queued, msg = self._queue.get(False)
+                batch.append(msg)
+                size += len(msg)
+                latency = monotonic() - queued
+                stats['latency'] += latency
+                if latency > stats['maxlatency']:
+                    stats['maxlatency'] = latency
+                if not coalesce:
+                    continue
+                # only single, complete lines can be updates
+                parsed = msg.find('\n') == len(msg) - 1 and parse(msg)
+                if parsed and parsed[5] == OP_TELL and \
+                   parsed[4].startswith(prefix):
+                    key = parsed[4]
+                    if key in latest:
+                        batch[latest[key]] = None
+                        stats['coalesced'] += 1
+                    latest[key] = len(batch) - 1
+                else:
+                    latest.clear()
+        except queue.Empty:
+            pass
+        stats['messages'] += len(batch)
+        stats['batches'] += 1
+        if coalesce:
+            return ''.join(filter(None, batch)).encode(), len(batch)
+        return ''.join(batch).encode(), len(batch)
+
+    def statusinfo(self):
+        """Log statistics about the sent messages."""
+        stats = self._sendstats
+        self.log.info('%d messages sent in %d batches, %d updates coalesced; '
+                      'queue latency %.1f ms on average, %.1f ms maximum',
+                      stats['messages'], stats['batches'], stats['coalesced'],
+                      1000. * stats['latency'] / (stats['messages'] or 1),
+                      1000. * stats['maxlatency'])
+
+    def _single_request(self, tosend, sentinel=b'\n', retry=2, sync=False,
+                        count=1, timeout=10):
+        """Communicate over the secondary socket.
+
+        The response is complete when it ends with *sentinel*, and contains it
+        *count* times (for pipelined requests).  Connecting and getting the
+        whole response may take at most *timeout* seconds per try.
+        """
         if not self._socket:
             self._disconnect('single request: no socket')
             if not self._socket:
@@ -328,7 +427,8 @@ class BaseCacheClient(Device):
         with self._sec_lock:
             if not self._secsocket:
                 try:
-                    self._secsocket = tcpSocket(self.cache, DEFAULT_CACHE_PORT)
+                    self._secsocket = tcpSocket(self.cache, DEFAULT_CACHE_PORT,
+                                                timeout)
                 except Exception as err:
                     self.log.warning('unable to connect secondary socket '
                                      'to %s: %s', self.cache, err)
@@ -340,26 +440,40 @@ class BaseCacheClient(Device):
             try:
                 # write request
                 # self.log.debug("get_explicit: sending %r", tosend)
+                self._secsocket.settimeout(timeout)
                 self._secsocket.sendall(tosend.encode())
 
-                # give 10 seconds time to get the whole reply
-                timeout = currenttime() + 10
-                # read response
-                data = b''
-                while not data.endswith(sentinel):
+                # give some time to get the whole reply
+                deadline = currenttime() + timeout
+                # read response (collect the chunks, pipelined requests can
+                # produce long replies)
+                chunks = []
+                tail = b''
+                found = 0
+                while True:
                     newdata = self._secsocket.recv(BUFSIZE)  # blocking read
                     if not newdata:
                         raise OSError('cache closed connection')
-                    if currenttime() > timeout:
+                    if currenttime() > deadline:
                         # do not just break, we need to reopen the socket
                         raise OSError('getting response took too long')
-                    data += newdata
+                    chunks.append(newdata)
+                    # the tail kept from the previous data is too short to
+                    # contain a complete sentinel, so nothing is counted twice
+                    window = tail + newdata
+                    found += window.count(sentinel)
+                    if found >= count and window.endswith(sentinel):
+                        break
+                    tail = window[len(window) - len(sentinel) + 1:]
+                data = b''.join(chunks)
             except OSError:
                 self.log.warning('error during cache query', exc=1)
                 closeSocket(self._secsocket)
                 self._secsocket = None
                 if retry:
-                    yield from self._single_request(tosend, sentinel, retry - 1)
+                    yield from self._single_request(tosend, sentinel, retry - 1,
+                                                    count=count,
+                                                    timeout=timeout)
                     return
                 raise
 
@@ -371,13 +485,13 @@ class BaseCacheClient(Device):
         while match:
             line = match.group(1)
             i = match.end()
+            match = lmatch(data, i)
             msgmatch = mmatch(line.decode())
             if not msgmatch:
                 # ignore invalid lines
                 continue
             # self.log.debug('line processed: %r', line)
             yield msgmatch
-            match = lmatch(data, i)
 
     def waitForStartup(self, timeout):
         self._startup_done.wait(timeout)
@@ -462,6 +576,17 @@ class BaseCacheClient(Device):
 
 class CacheClient(BaseCacheClient):
 
+    parameters = {
+        'skipunchanged': Param('Do not call the callbacks for updates that '
+                               'do not change the value of a key',
+                               type=bool, default=False),
+    }
+
+    parameter_overrides = {
+        # all values are decoded, so they don't need to stay in PyON
+        'encoding': Override(default='compact'),
+    }
+
     temporary = True
     _dblock = None
 
@@ -470,6 +595,17 @@ class CacheClient(BaseCacheClient):
         self._db = {}
         self._dblock = threading.Lock()
         self._callbacks = {}
+        # map device name -> events to set on updates of its keys
+        self._wakeups = {}
+        # map key -> (raw value, decoded value) of the last received update,
+        # to skip decoding if the same value is sent again
+        self._lastvalues = {}
+        self._stats = dict(updates=0, unchanged=0, suppressed=0)
+        # version of the local database, and map key -> version of its last
+        # change in the order of the changes (only kept once get_changes()
+        # has been called)
+        self._version = 0
+        self._journal = None
 
         # the execution master lock needs to be refreshed every now and then
         self._ismaster = False
@@ -527,7 +663,7 @@ class CacheClient(BaseCacheClient):
             for cb in self._prefixcallbacks:
                 if key.startswith(cb):
                     if value is not None:
-                        value = cache_load(value)
+                        value = self._decode(value)
                     time = time and float(time)
                     try:
                         self._prefixcallbacks[cb](key, value, time,
@@ -550,16 +686,55 @@ class CacheClient(BaseCacheClient):
         if not value or op == OP_TELLOLD:
             with self._dblock:
                 self._db.pop(key, None)
+                # expired values are still in the cache, only deletions are
+                # changes
+                if not value and self._journal is not None:
+                    self._record_change(key)
         else:
-            value = cache_load(value)
+            value = self._load_value(key, value)
             with self._dblock:
+                old = self._db.get(key)
                 self._db[key] = (value, time)
+                if self._journal is not None:
+                    self._record_change(key)
+            if self._wakeups:
+                self._wake(key)
             if self._do_callbacks:
                 if key in self._callbacks:
-                    self._call_callbacks(key, value, time)
+                    if self.skipunchanged and old and old[0] is value:
+                        self._stats['suppressed'] += 1
+                    else:
+                        self._call_callbacks(key, value, time)
                 if key.endswith('/value') and session.experiment:
                     session.experiment.data.cacheCallback(key, value, time)
 
+    def _load_value(self, key, raw):
+        """Decode the *raw* value of an update, reusing the last decoded value
+        for the same key if the raw value has not changed.
+        """
+        self._stats['updates'] += 1
+        last = self._lastvalues.get(key)
+        if last is not None and last[0] == raw:
+            self._stats['unchanged'] += 1
+            return last[1]
+        value = self._decode(raw)
+        self._lastvalues[key] = (raw, value)
+        return value
+
+    def statusinfo(self):
+        """Log statistics about the sent messages and received updates."""
+        BaseCacheClient.statusinfo(self)
+        stats = self._stats
+        decoded = self._decode.hits + self._decode.misses
+        self.log.info('%d updates received, %.1f%% unchanged, %d callbacks '
+                      'suppressed; %.1f%% of the changed values decoded from '
+                      'the memo; %s value encoding',
+                      stats['updates'],
+                      100. * stats['unchanged'] / (stats['updates'] or 1),
+                      stats['suppressed'],
+                      100. * self._decode.hits / (decoded or 1),
+                      self._encoding)
+
     def _call_callbacks(self, key, value, time):
         with self._dblock:
             # copy is intented here to avoid races with add/removeCallback
@@ -593,6 +768,32 @@ class CacheClient(BaseCacheClient):
                     # emty list: remove!
                     self._callbacks.pop(('%s/%s' % (dev, key)).lower(), None)
 
+    def addWakeup(self, dev, event, key=None):
+        """Add an event (an object with a ``set()`` method) to be set when any
+        key (or only the given subkey) of the given device is updated, by
+        others or (unlike for callbacks) by this client.
+        """
+        dbkey = (key and '%s/%s' % (dev, key) or str(dev)).lower()
+        with self._dblock:
+            self._wakeups.setdefault(dbkey, []).append(event)
+
+    def removeWakeup(self, dev, event, key=None):
+        """Remove the given wakeup event for the given device, if present."""
+        dbkey = (key and '%s/%s' % (dev, key) or str(dev)).lower()
+        with self._dblock:
+            events = self._wakeups.get(dbkey)
+            if events and event in events:
+                events.remove(event)
+                if not events:
+                    del self._wakeups[dbkey]
+
+    def _wake(self, key):
+        for events in (self._wakeups.get(key.partition('/')[0]),
+                       self._wakeups.get(key)):
+            if events:
+                for event in events:
+                    event.set()
+
     def get(self, dev, key, default=None, mintime=None):
         """Get a value from the local cache for the given device and subkey.
 
@@ -629,10 +830,75 @@ class CacheClient(BaseCacheClient):
                 return default
         return value
 
+    def get_entry(self, dev, key):
+        """Get the ``(value, time)`` entry for the given device and subkey
+        from the local cache, or None if it is missing.
+
+        Unlike `get`, this never asks the cache server.
+        """
+        with self._dblock:
+            return self._db.get(('%s/%s' % (dev, key)).lower())
+
+    def get_device(self, dev, keys, default=None):
+        """Get the values of several subkeys of a device from the local cache.
+
+        This is like calling `get` for each of the *keys*, but faster.  Returns
+        a dictionary mapping the keys to the values, or *default* if missing.
+        """
+        if not self._stoprequest and not self._startup_done.wait(15):
+            self.log.warning('Cache _startup_done took more than 15s!')
+            raise CacheError(self, 'Cache _startup_done took more than 15s!')
+        devprefix = str(dev).lower() + '/'
+        result = {}
+        missing = []
+        with self._dblock:
+            db = self._db
+            for key in keys:
+                entry = db.get(devprefix + key.lower())
+                if entry is None:
+                    result[key] = default
+                    missing.append(key)
+                else:
+                    result[key] = entry[0]
+        if missing and self.is_connected() and \
+           str(dev).lower() in self._inv_rewrites:
+            result.update(self.get_device(
+                self._inv_rewrites[str(dev).lower()], missing, default))
+        return result
+
     def get_values(self):
         with self._dblock:
             return {key: value for (key, (value, _)) in self._db.items()}
 
+    def get_changes(self, since=None):
+        """Return the current version of the local cache data, and a dictionary
+        of the values that changed since the version *since*.
+
+        If *since* is None, all values are returned; this also starts keeping
+        track of changes.  Keys that have been deleted since *since* are
+        included with the value ``Ellipsis``.
+        """
+        with self._dblock:
+            if self._journal is None:
+                self._journal = {}
+            if since is None:
+                return self._version, {key: value for (key, (value, _))
+                                       in self._db.items()}
+            changes = {}
+            for key, version in reversed(self._journal.items()):
+                if version <= since:
+                    break
+                entry = self._db.get(key)
+                changes[key] = Ellipsis if entry is None else entry[0]
+            return self._version, changes
+
+    def _record_change(self, key):
+        # must be called with the db lock held; the key is moved to the end
+        # so that the journal stays ordered by version
+        self._version += 1
+        self._journal.pop(key, None)
+        self._journal[key] = self._version
+
     def get_explicit(self, dev, key, default=None):
         """Get a value from the cache server, bypassing the local cache.  This
         is needed if the current update time and ttl is required.
@@ -653,6 +919,31 @@ class CacheClient(BaseCacheClient):
                     default)
         return (None, None, default)  # shouldn't happen
 
+    def get_many(self, keys, default=None):
+        """Get the values of many keys from the cache server, like
+        `get_explicit`, but with a single round trip.
+
+        *keys* are the keys without the prefix, i.e. ``'dev/subkey'``.  Returns
+        a list of ``(time, ttl, value)`` tuples in the order of the keys;
+        missing keys give ``(None, None, default)``.
+        """
+        keys = [key.lower() for key in keys]
+        if not keys:
+            return []
+        tosend = ''.join('@%s%s%s\n' % (self._prefix, key, OP_ASK)
+                         for key in keys) + '%s%s\n' % (END_MARKER, OP_ASK)
+        prefixlen = len(self._prefix)
+        replies = {}
+        for msgmatch in self._single_request(
+                tosend, (END_MARKER + OP_TELLOLD + '\n').encode()):
+            time, ttl, value = msgmatch.group('time'), msgmatch.group('ttl'), \
+                msgmatch.group('value')
+            if msgmatch.group('tsop') is None or not value:
+                continue
+            replies[msgmatch.group('key')[prefixlen:]] = (
+                time and float(time), ttl and float(ttl), cache_load(value))
+        return [replies.get(key, (None, None, default)) for key in keys]
+
     def get_raw(self, key, default=None):
         """Get a value from the cache server by full name."""
         tosend = '%s%s\n' % (key, OP_ASK)
@@ -676,12 +967,16 @@ class CacheClient(BaseCacheClient):
         dbkey = ('%s/%s' % (dev, key)).lower()
         with self._dblock:
             self._db[dbkey] = (value, time)
+            if self._journal is not None:
+                self._record_change(dbkey)
         dvalue = cache_dump(value)
         msg = '%r%s@%s%s%s%s%s\n' % (time, ttlstr, self._prefix, dbkey,
                                      flag, OP_TELL, dvalue)
         # self.log.debug('putting %s=%s', dbkey, value)
         self._queue.put(msg)
         self._propagate((time, dbkey, OP_TELL, dvalue))
+        if self._wakeups:
+            self._wake(dbkey)
         if key == 'value' and session.experiment:
             session.experiment.data.cacheCallback(dbkey, value, time)
         # we have to check rewrites here, since the cache server won't send
@@ -691,10 +986,44 @@ class CacheClient(BaseCacheClient):
                 rdbkey = ('%s/%s' % (newprefix, key)).lower()
                 with self._dblock:
                     self._db[rdbkey] = (value, time)
+                    if self._journal is not None:
+                        self._record_change(rdbkey)
                 self._propagate((time, rdbkey, OP_TELL, dvalue))
                 if key == 'value' and session.experiment:
                     session.experiment.data.cacheCallback(rdbkey, value, time)
 
+    def put_many(self, dev, items, time=None):
+        """Put values for several subkeys of a device, given as a list of
+        ``(key, value)`` pairs.
+
+        This is like calling `put` for each of them, but the updates are queued
+        to be sent as one message.
+        """
+        if time is None:
+            time = currenttime()
+        devname = str(dev).lower()
+        if devname in self._rewrites:
+            for key, value in items:
+                self.put(dev, key, value, time)
+            return
+        msgs = []
+        for key, value in items:
+            dbkey = '%s/%s' % (devname, key.lower())
+            with self._dblock:
+                self._db[dbkey] = (value, time)
+                if self._journal is not None:
+                    self._record_change(dbkey)
+            dvalue = cache_dump(value)
+            msgs.append('%r@%s%s%s%s\n' % (time, self._prefix, dbkey,
+                                           OP_TELL, dvalue))
+            self._propagate((time, dbkey, OP_TELL, dvalue))
+            if self._wakeups:
+                self._wake(dbkey)
+            if key == 'value' and session.experiment:
+                session.experiment.data.cacheCallback(dbkey, value, time)
+        if msgs:
+            self._queue.put(''.join(msgs))
+
     def delete(self, dev, key, time=None):
         """Delete a given device's subkey."""
         if time is None:
@@ -702,7 +1031,9 @@ class CacheClient(BaseCacheClient):
         dbkey = ('%s/%s' % (dev, key)).lower()
         with self._dblock:
             self._db.pop(dbkey, None)
-        msg = '%r@%s%s%s' % (time, self._prefix, dbkey, OP_TELL)
+            if self._journal is not None:
+                self._record_change(dbkey)
+        msg = '%r@%s%s%s\n' % (time, self._prefix, dbkey, OP_TELL)
         self._queue.put(msg)
         self._propagate((time, dbkey, OP_TELL, ''))
         if str(dev).lower() in self._rewrites:
@@ -710,6 +1041,8 @@ class CacheClient(BaseCacheClient):
                 rdbkey = ('%s/%s' % (newprefix, key)).lower()
                 with self._dblock:
                     self._db.pop(rdbkey, None)
+                    if self._journal is not None:
+                        self._record_change(rdbkey)
                 self._propagate((time, rdbkey, OP_TELL, ''))
 
     def put_raw(self, key, value, time=None, ttl=None, flag=''):
@@ -765,6 +1098,8 @@ class CacheClient(BaseCacheClient):
                         continue
                     msg = '%r@%s%s%s\n' % (time, self._prefix, dbkey, OP_TELL)
                     self._db.pop(dbkey, None)
+                    if self._journal is not None:
+                        self._record_change(dbkey)
                     self._queue.put(msg)
                     self._propagate((time, dbkey, OP_TELL, ''))
 
@@ -775,6 +1110,8 @@ class CacheClient(BaseCacheClient):
             for dbkey in list(self._db):
                 msg = '%r@%s%s%s\n' % (time, self._prefix, dbkey, OP_TELL)
                 self._db.pop(dbkey, None)
+                if self._journal is not None:
+                    self._record_change(dbkey)
                 self._queue.put(msg)
                 self._propagate((time, dbkey, OP_TELL, ''))
 
@@ -786,24 +1123,53 @@ class CacheClient(BaseCacheClient):
         dbkey = ('%s/%s' % (dev, key)).lower()
         self.log.debug('invalidating %s', dbkey)
         with self._dblock:
+            # not a change, the value is still in the remote cache
             self._db.pop(dbkey, None)
 
-    def history(self, dev, key, fromtime, totime):
+    def history(self, dev, key, fromtime, totime, interval=None,
+                mode='minmax'):
         """History query: opens a separate connection since it is otherwise not
         possible to determine which response lines belong to it.
+
+        If *interval* is given, the server downsamples the history to buckets
+        of this many seconds, returning their minimum and maximum values (or
+        with *mode* 'mean', their mean value).
         """
         if dev:
             key = ('%s/%s' % (dev, key)).lower()
-        tosend = '%r-%r@%s%s%s\n###?\n' % (fromtime, totime,
-                                           self._prefix, key, OP_ASK)
-        ret = []
-        for msgmatch in self._single_request(tosend, b'###!\n', sync=False):
+        return self.history_many([key], fromtime, totime, interval, mode)[0]
+
+    def history_many(self, keys, fromtime, totime, interval=None,
+                     mode='minmax'):
+        """Query the history of many keys (without the prefix) for the same
+        time range, with a single round trip.
+
+        Returns a list of histories in the order of the keys; see `history`.
+        """
+        resolution = ''
+        if interval:
+            resolution = '%r,%s' % (float(interval), mode)
+        # every query is terminated by a marker, so that the response lines
+        # can be assigned to the queries
+        tosend = ''.join('%r-%r@%s%s%s%s\n%s%s\n' % (
+            fromtime, totime, self._prefix, key.lower(), OP_ASK, resolution,
+            END_MARKER, OP_ASK) for key in keys)
+        ret = [[] for _ in keys]
+        if not keys:
+            return ret
+        sentinel = (END_MARKER + OP_TELLOLD + '\n').encode()
+        index = 0
+        for msgmatch in self._single_request(tosend, sentinel, sync=False,
+                                             count=len(keys)):
             # process data
             time, value = msgmatch.group('time'), msgmatch.group('value')
             if time is None:
-                break  # it's the '###' value
-            if value:
-                ret.append((float(time), cache_load(value)))
+                # it's the end marker of a query
+                index += 1
+                if index == len(keys):
+                    break
+            elif value:
+                ret[index].append((float(time), cache_load(value)))
         return ret
 
     def query_db(self, query, tries=3):
@@ -816,12 +1182,22 @@ class CacheClient(BaseCacheClient):
 
 
 class DaemonCacheClient(CacheClient):
+
+    parameter_overrides = {
+        # the raw values are propagated to the GUI clients, which expect PyON
+        'encoding': Override(default='pyon'),
+    }
+
     def _propagate(self, args):
         session.emitfunc('cache', args)
 
 
 class SyncCacheClient(BaseCacheClient):
 
+    parameter_overrides = {
+        'encoding': Override(default='compact'),
+    }
+
     temporary = True
 
     def doInit(self, mode):
@@ -858,4 +1234,4 @@ class SyncCacheClient(BaseCacheClient):
             self._db.pop(key, None)
         else:
             # even with TELLOLD; an old value is better than no value
-            self._db[key] = cache_load(value)
+            self._db[key] = self._decode(value)
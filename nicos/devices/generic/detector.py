@@ -37,7 +37,8 @@ from nicos.core import INTERMEDIATE, LIVE, Attach, DeviceMixinBase, \
 from nicos.core.constants import FINAL
 from nicos.core.errors import ConfigurationError
 from nicos.core.scan import Scan
-from nicos.core.utils import multiWait
+from nicos.core.acquire import acquire_workers
+from nicos.core.utils import multiCall, multiWait
 from nicos.utils import uniq
 
 
@@ -575,10 +576,9 @@ class Detector(Measurable):
         self.log.debug("    slaves: %s", self._slaves)
 
     def doPrepare(self):
-        for slave in self._slaves:
-            slave.prepare()
-        for master in self._masters:
-            master.prepare()
+        workers = acquire_workers()
+        multiCall(lambda ch: ch.prepare(), self._slaves, workers)
+        multiCall(lambda ch: ch.prepare(), self._masters, workers)
 
     def doStart(self):
         # setting this to -interval, instead of 0, will send some live data at
@@ -586,10 +586,9 @@ class Detector(Measurable):
         self._last_live = -(self.liveinterval or 0)
         self._last_save = 0
         self._last_save_index = 0
-        for slave in self._slaves:
-            slave.start()
-        for master in self._masters:
-            master.start()
+        workers = acquire_workers()
+        multiCall(lambda ch: ch.start(), self._slaves, workers)
+        multiCall(lambda ch: ch.start(), self._masters, workers)
 
     def doTime(self, preset):
         self.doSetPreset(**preset)  # okay in simmode
@@ -628,8 +627,11 @@ class Detector(Measurable):
         return ret
 
     def doReadArrays(self, quality):
-        arrays = [img.readArray(quality) for img in self._attached_images]
-        results = [dev.read(0) for dev in self._postpassives]
+        workers = acquire_workers()
+        arrays = multiCall(lambda img: img.readArray(quality),
+                           self._attached_images, workers)
+        results = multiCall(lambda dev: dev.read(0), self._postpassives,
+                            workers)
         for postdev, img_or_passive_devs in self._postprocess:
             postarrays, postresults = [], []
             for dev in img_or_passive_devs:
@@ -654,6 +656,18 @@ class Detector(Measurable):
                 return INTERMEDIATE
         return None
 
+    def nextMeasureEvent(self, elapsed):
+        if type(self).duringMeasureHook is not Detector.duringMeasureHook:
+            # subclasses may need to do something else during measurement
+            return None
+        events = [float('inf')]
+        if self.liveinterval is not None:
+            events.append(self._last_live + self.liveinterval)
+        if self.saveintervals:
+            events.append(self._last_save +
+                          self.saveintervals[self._last_save_index])
+        return min(events)
+
     def doSimulate(self, preset):
         self.doSetPreset(**preset)  # okay in simmode
         return self.doRead()
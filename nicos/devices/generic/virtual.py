@@ -302,6 +302,7 @@ class VirtualTimer(VirtualChannel):
                 self.curvalue += self._base_loop_delay
         finally:
             self.curstatus = (status.OK, 'idle')
+            self.signalCountLoop()
 
     def doSimulate(self, preset):
         if self.ismaster:
@@ -362,6 +363,7 @@ class VirtualCounter(VirtualChannel):
                 self.curvalue = int(self._fcurrent)
         finally:
             self.curstatus = (status.OK, 'idle')
+            self.signalCountLoop()
 
     def doSimulate(self, preset):
         if self.ismaster:
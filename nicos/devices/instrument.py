@@ -24,7 +24,8 @@
 
 """NICOS Instrument device."""
 
-from nicos.core import Device, Param, listof, mailaddress
+from nicos.core import Device, Param, floatrange, intrange, listof, \
+    mailaddress
 
 
 class Instrument(Device):
@@ -49,6 +50,22 @@ class Instrument(Device):
                              category='instrument'),
         'countloopdelay': Param('Loop delay in checking for counting finished',
                                 type=float, default=0.025, userparam=False),
+        'countloopmaxdelay': Param('Maximum loop delay while counting with '
+                                   'detectors that tell when they need to be '
+                                   'checked next (0 to always use the '
+                                   'countloopdelay); only useful if all '
+                                   'detectors signal the count loop',
+                                   type=floatrange(0), default=0,
+                                   userparam=False),
+        'acquireworkers': Param('Number of threads used to read environment '
+                                'devices and to prepare and start detectors '
+                                'and their channels concurrently (0 to '
+                                'disable)', type=intrange(0, 64), default=0,
+                                userparam=False),
+        'pipelinescans': Param('Hand finished scan points to the data sinks '
+                               'in the background while moving to the next '
+                               'point', type=bool, default=False,
+                               userparam=False),
         'website': Param('Instrument URL', type=str, category='instrument',
                          settable=False, default='http://www.mlz-garching.de'),
         'operators': Param('Instrument operators', type=listof(str),
@@ -75,13 +75,18 @@ Operation: ``OP_ASK`` or ``'?'``
 - When an ``@`` is present, the timestamp is returned with the reply.
 - With ``time1-time2@`` or ``time1+timeinterval@``, a history query is made and
   several values can be returned.
-- The value, if present, is ignored.
+- For history queries, the value can give a resolution in seconds.  The
+  history is then downsampled to the minimum and maximum value in each time
+  bucket of that size.  With ``resolution,mean``, the mean value of each
+  bucket is returned instead.
+- Otherwise, the value, if present, is ignored.
 
 Examples::
 
   nicos/temp/value?                         # request only the value
   @nicos/temp/value?                        # request value with timestamp
   1327504780-1327504790@nicos/temp/value?   # request all values in time range
+  1327504780-1327590780@nicos/temp/value?60 # request range at 1 min resolution
 
 Response: except for history queries, a single line in the form ``key=value``
 or ``time@key=value``, see below.  If the key is nonexistent or expired, the
@@ -179,6 +184,27 @@ cache is configured for that).
 
 Response: none.
 
+Value encoding
+--------------
+
+Operation: ``OP_ASK`` on the special key ``'#encoding'``
+
+Values are normally transferred in the "PyON" format written by `cache_dump`.
+Decoding it needs a Python parser, which is slow for large values.  A client
+can request that the server sends values in the "compact" encoding on its
+connection: ::
+
+    #encoding?compact
+
+Response: ``#encoding=compact`` if the server supports the encoding, otherwise
+``#encoding=pyon`` (or ``#encoding!`` from servers that do not know this
+request).
+
+With the compact encoding, the server still may send any value in PyON, but
+tuples, lists, dicts and sets are usually sent as marshalled data in base64,
+prefixed with ``'%'``.  `cache_load` decodes both formats.  Clients always send
+values in PyON, which is also the format stored by the server.
+
 Optional Flags
 --------------
 
@@ -196,6 +222,7 @@ Works only with the "set a key" operator.  This flag makes no sense otherwise.
 
 """
 
+import marshal
 import pickle
 import re
 from ast import Add, BinOp, Bytes, Call, Dict, List, Name, NameConstant, Num, \
@@ -225,6 +252,13 @@ FLAG_NO_STORE = '#'
 END_MARKER = '###'
 SYNC_MARKER = '#sync#'
 
+# special key to negotiate the value encoding, and the supported encodings
+ENCODING_KEY = '#encoding'
+ENCODINGS = ('pyon', 'compact')
+
+# prefix for values in compact encoding
+COMPACT_TAG = '%'
+
 # Time constant
 CYCLETIME = 0.1
 
@@ -251,6 +285,57 @@ msg_pattern = re.compile(r'''
 
 line_pattern = re.compile(br'([^\r\n]*)\r?\n')
 
+_op_search = re.compile('[%s]' % re.escape(opkeys)).search
+
+
+def _parse_msg_re(line):
+    match = msg_pattern.match(line)
+    return match.groups() if match else None
+
+
+def parse_msg(line):
+    """Split a cache protocol message into its components.
+
+    Returns the tuple ``(time, ttlop, ttl, tsop, key, op, value)`` with exactly
+    the same contents as ``msg_pattern.match(line).groups()``, or None if the
+    line is not a valid message.
+
+    The common message forms are handled by plain string operations; anything
+    unusual (whitespace or exponents in the timestamp part, lines with
+    embedded newlines) is left to `msg_pattern`.
+    """
+    # the key cannot contain any operator, so the first one found is the op;
+    # check for the most common one first without invoking the regex engine
+    i = line.find(OP_TELL)
+    head = line[:i]
+    if i == -1 or '?' in head or '*' in head or ':' in head or \
+       '|' in head or '!' in head or '$' in head or '~' in head:
+        opmatch = _op_search(line)
+        if opmatch is None:
+            return None
+        i = opmatch.start()
+        head = line[:i]
+    value = line[i + 1:].strip()
+    if '\n' in value or '\r' in value:
+        return _parse_msg_re(line)
+    if '@' not in head:
+        return (None, None, None, None, head.strip(), line[i], value)
+    prefix, _, key = head.partition('@')
+    if not prefix:
+        return (None, '', None, '@', key.strip(), line[i], value)
+    if prefix.isascii():
+        time, ttlop, ttl = prefix.partition('+')
+        if not ttlop:
+            time, ttlop, ttl = prefix.partition('-')
+        # time and ttl must look like r'\d+\.?\d*'
+        if (not time or time[0].isdigit() and
+                time.replace('.', '', 1).isdigit()) and \
+           (not ttl or ttl[0].isdigit() and
+                ttl.replace('.', '', 1).isdigit()):
+            return (time or None, ttlop, ttl or None, '@', key.strip(),
+                    line[i], value)
+    return _parse_msg_re(line)
+
 
 # PyON -- "Python object notation"
 
@@ -354,9 +439,100 @@ def ast_eval(node):
 
 def cache_load(entry):
     try:
+        if entry[:1] == COMPACT_TAG:
+            return compact_load(entry)
         # parsing with 'eval' always gives an ast.Expression node
         expr = parse(entry, mode='eval').body
         return ast_eval(expr)
     except Exception as err:
         raise ValueError(
             'corrupt cache entry: %r (%s)' % (entry, err)) from err
+
+
+# Compact encoding -- marshal in base64, only for the types supported by PyON
+
+_scalar_types = frozenset((int, float, complex, bool, str, bytes, type(None)))
+
+
+def _to_builtin(obj):
+    # convert readonly containers to the builtin types supported by marshal
+    if isinstance(obj, list):
+        if all(type(item) in _scalar_types for item in obj):
+            return list(obj)
+        return [_to_builtin(item) for item in obj]
+    elif isinstance(obj, tuple):
+        if all(type(item) in _scalar_types for item in obj):
+            return tuple(obj)
+        return tuple(_to_builtin(item) for item in obj)
+    elif isinstance(obj, dict):
+        return {_to_builtin(k): _to_builtin(v) for (k, v) in obj.items()}
+    elif isinstance(obj, frozenset):
+        return frozenset(_to_builtin(item) for item in obj)
+    return obj
+
+
+def _to_readonly(obj):
+    # convert lists and dicts to the readonly types returned by cache_load
+    objtype = type(obj)
+    if objtype is list:
+        if all(type(item) in _scalar_types for item in obj):
+            return readonlylist(obj)
+        return readonlylist(map(_to_readonly, obj))
+    elif objtype is tuple:
+        if all(type(item) in _scalar_types for item in obj):
+            return obj
+        return tuple(map(_to_readonly, obj))
+    elif objtype is dict:
+        return readonlydict((_to_readonly(k), _to_readonly(v))
+                            for (k, v) in obj.items())
+    return obj
+
+
+def compact_dump(obj):
+    """Serialize *obj* in the compact encoding.
+
+    Only the types supported by PyON without pickling are allowed, otherwise
+    ValueError is raised.
+    """
+    return COMPACT_TAG + b64encode(marshal.dumps(_to_builtin(obj), 4)).decode()
+
+
+def compact_load(entry):
+    """Deserialize a value in the compact encoding.
+
+    Usually, `cache_load` should be used, which handles both encodings.
+    """
+    return _to_readonly(marshal.loads(b64decode(entry[1:])))
+
+
+class ValueDecoder:
+    """Memoizing replacement for `cache_load`.
+
+    Decoding a value string that was seen recently (e.g. a device status)
+    returns the object decoded before.  This is safe since decoded values are
+    immutable, except for pickled objects, which are never memoized.  Not
+    thread-safe: use one instance per thread.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memo = {}
+
+    def __call__(self, entry):
+        try:
+            value = self._memo[entry]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = cache_load(entry)
+        if 'cache_unpickle' not in entry:
+            if len(self._memo) >= self.maxsize:
+                # forget the oldest entry
+                del self._memo[next(iter(self._memo))]
+            self._memo[entry] = value
+        return value
@@ -254,6 +254,15 @@ class ServerTransport:
         """
         raise NotImplementedError
 
+    def send_events(self, events):
+        """Send several events to the client, as efficiently as possible.
+
+        *events* is a list of (evtname, payload, blobs) tuples as for
+        `send_event`.
+        """
+        for (evtname, payload, blobs) in events:
+            self.send_event(evtname, payload, blobs)
+
 
 class ClientTransport:
     """Represents the transport of data, client side."""
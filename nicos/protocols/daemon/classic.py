@@ -28,6 +28,12 @@
 import json
 import pickle
 import struct
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from nicos.protocols.daemon import DAEMON_COMMANDS, DAEMON_EVENTS, \
     Serializer as BaseSerializer
@@ -163,7 +169,90 @@ class JsonSerializer(BaseSerializer):
         return evtname, self.decoder.decode(data.decode())
 
 
+class MsgpackSerializer(BaseSerializer):
+    """Compact binary serializer, needs the ``msgpack`` module.
+
+    Tuples and all objects that msgpack can not represent natively are
+    encoded as extension types, so that the same objects arrive as with the
+    classic serializer.
+    """
+
+    name = 'msgpack'
+
+    # extension type codes
+    EXT_PICKLE = 0
+    EXT_TUPLE = 1
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('the msgpack serializer needs the msgpack '
+                              'module')
+        # packers are expensive to create, but not thread-safe, and one
+        # packer is needed for each level of nested tuples
+        self._local = threading.local()
+
+    def _pack(self, obj):
+        local = self._local
+        packers = local.__dict__.setdefault('packers', [])
+        depth = local.__dict__.get('depth', 0)
+        if depth == len(packers):
+            packers.append(msgpack.Packer(default=self._serialize_default,
+                                          use_bin_type=True,
+                                          strict_types=True))
+        local.depth = depth + 1
+        try:
+            return packers[depth].pack(obj)
+        finally:
+            local.depth = depth
+
+    def _unpack(self, data):
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False,
+                               strict_map_key=False)
+
+    def _serialize_default(self, obj):
+        if type(obj) is tuple:
+            return msgpack.ExtType(self.EXT_TUPLE, self._pack(list(obj)))
+        return msgpack.ExtType(self.EXT_PICKLE, pickle.dumps(obj, 2))
+
+    def _ext_hook(self, code, data):
+        if code == self.EXT_TUPLE:
+            return tuple(self._unpack(data))
+        if code == self.EXT_PICKLE:
+            return pickle.loads(data, encoding='latin1')
+        return msgpack.ExtType(code, data)
+
+    # serializing
+
+    def serialize_cmd(self, cmdname, args):
+        return self._pack(args)
+
+    def serialize_ok_reply(self, payload):
+        return self._pack(payload)
+
+    def serialize_error_reply(self, reason):
+        return self._pack(reason)
+
+    def serialize_event(self, evtname, payload):
+        return self._pack(payload)
+
+    # deserializing
+
+    def deserialize_cmd(self, data, cmdname=None):
+        return cmdname, self._unpack(data)
+
+    def deserialize_reply(self, data, success=None):
+        assert success is not None
+        data = self._unpack(data) if data else None
+        return success, data
+
+    def deserialize_event(self, data, evtname=None):
+        return evtname, self._unpack(data)
+
+
 SERIALIZERS = {
     ClassicSerializer.name: ClassicSerializer,
     JsonSerializer.name: JsonSerializer,
 }
+
+if msgpack is not None:
+    SERIALIZERS[MsgpackSerializer.name] = MsgpackSerializer
@@ -24,5 +24,6 @@
 
 from nicos.services.cache.database.base import CacheDatabase
 from nicos.services.cache.database.flatfile import FlatfileCacheDatabase
+from nicos.services.cache.database.follower import FollowerCacheDatabase
 from nicos.services.cache.database.memory import MemoryCacheDatabase, \
     MemoryCacheDatabaseWithHistory
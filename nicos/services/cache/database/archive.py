@@ -0,0 +1,246 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Columnar archive of the history stored by the flatfile cache database.
+
+Finished days of the store are compacted into numpy arrays, one set per store
+file (one category on one day) in a directory ``<category>``:
+
+* ``raw/<subkey>.npy`` contains the times and float values of all updates of
+  a numeric key, as an array of shape (2, N).  Deleted values are NaN.
+* ``<level>/<subkey>.npy`` contain the downsampled "pyramid" of the key for
+  each resolution (in seconds) in `LEVELS`, as an array of shape (7, M) with
+  the columns given by the ``START`` ... ``COUNT`` constants: the start of the
+  time bucket, time and value of the minimum and maximum, mean value and
+  number of updates in the bucket.
+
+Keys with non-numeric values are not archived.  All arrays can be memory
+mapped, and history queries at a coarse resolution only need to read as many
+buckets as points are requested.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+#: resolutions of the precomputed pyramids in seconds
+LEVELS = (10, 60, 600, 3600)
+
+#: columns of the pyramid arrays
+START, TMIN, VMIN, TMAX, VMAX, MEAN, COUNT = range(7)
+
+
+def parse_value(value):
+    """Return the float for a store file *value* (NaN for a deleted value).
+
+    Raises ValueError if the value is not numeric.
+    """
+    if value == '-':
+        return np.nan
+    return float(value)
+
+
+def bucketize(times, values, interval):
+    """Downsample the updates given by the *times* and *values* arrays into
+    buckets of *interval* seconds.  Deleted (NaN) values are skipped.
+    """
+    valid = ~np.isnan(values)
+    times = times[valid]
+    values = values[valid]
+    if not len(times):
+        return np.empty((7, 0))
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    values = values[order]
+    group = np.floor(times / interval)
+    return _reduce(group * interval, times, values, times, values, values,
+                   np.ones(len(times)))
+
+
+def merge(rows, interval):
+    """Merge downsampled *rows* into coarser buckets of *interval* seconds."""
+    if not rows.shape[1]:
+        return rows
+    group = np.floor(rows[START] / interval)
+    return _reduce(group * interval, rows[TMIN], rows[VMIN], rows[TMAX],
+                   rows[VMAX], rows[MEAN], rows[COUNT])
+
+
+def _reduce(starts, tmin, vmin, tmax, vmax, mean, count):
+    # all input arrays are sorted by bucket start
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:], len(starts)] - 1
+    rows = np.empty((7, len(first)))
+    rows[START] = starts[first]
+    # sort by value within each bucket to find minimum and maximum
+    order = np.lexsort((vmin, starts))
+    rows[TMIN] = tmin[order[first]]
+    rows[VMIN] = vmin[order[first]]
+    order = np.lexsort((vmax, starts))
+    rows[TMAX] = tmax[order[last]]
+    rows[VMAX] = vmax[order[last]]
+    rows[COUNT] = np.add.reduceat(count, first)
+    rows[MEAN] = np.add.reduceat(mean * count, first) / rows[COUNT]
+    return rows
+
+
+def points(rows, interval, mode='minmax'):
+    """Return the (time, value) points to send for downsampled *rows*.
+
+    In "minmax" mode, the minimum and maximum of every bucket are returned in
+    the order of their occurrence.  In "mean" mode, the mean value of every
+    bucket is returned at the center of the bucket.
+    """
+    if mode == 'mean':
+        return list(zip((rows[START] + interval / 2).tolist(),
+                        rows[MEAN].tolist()))
+    result = []
+    for tmin, vmin, tmax, vmax in zip(rows[TMIN].tolist(),
+                                      rows[VMIN].tolist(),
+                                      rows[TMAX].tolist(),
+                                      rows[VMAX].tolist()):
+        if tmin < tmax:
+            result.append((tmin, vmin))
+            result.append((tmax, vmax))
+        elif tmin > tmax:
+            result.append((tmax, vmax))
+            result.append((tmin, vmin))
+        else:
+            result.append((tmin, vmin))
+    return result
+
+
+def reduce_records(records, interval, mode='minmax'):
+    """Downsample a list of (time, value) records as returned by a history
+    query, with the values in string form.
+
+    Returns (time, value string) records.  If any value is not numeric, the
+    last record of every bucket is returned instead.
+    """
+    try:
+        values = np.array([parse_value(value or '-')
+                           for (_, value) in records], dtype=float)
+    except ValueError:
+        result = {}
+        for time, value in records:
+            result[time // interval] = (time, value)
+        return sorted(result.values())
+    times = np.array([time for (time, _) in records], dtype=float)
+    return [(time, repr(value)) for (time, value) in
+            points(bucketize(times, values, interval), interval, mode)]
+
+
+def select(rows, fromtime, totime):
+    """Return the buckets of *rows* that overlap the range *fromtime* to
+    *totime*.  The first row of *rows* is the bucket start or update time.
+    """
+    first = np.searchsorted(rows[0], fromtime, 'right')
+    last = np.searchsorted(rows[0], totime, 'right')
+    return rows[:, max(first - 1, 0):last]
+
+
+def compact(filename, outdir):
+    """Compact the store file *filename* into the archive directory *outdir*.
+
+    Returns the number of archived keys.
+    """
+    keys = {}
+    nonnumeric = set()
+    with open(filename, 'r', encoding='utf-8', errors='replace') as fd:
+        nsplit = 2
+        for i, line in enumerate(fd):
+            if i == 0 and line.startswith('# NICOS cache store file v2'):
+                nsplit = 3
+                continue
+            fields = line.rstrip().split(None, nsplit)
+            if len(fields) < 3 or fields[0] in nonnumeric:
+                continue
+            try:
+                time = float(fields[1])
+                value = parse_value(fields[-1])
+            except ValueError:
+                nonnumeric.add(fields[0])
+                keys.pop(fields[0], None)
+                continue
+            keys.setdefault(fields[0], ([], []))
+            keys[fields[0]][0].append(time)
+            keys[fields[0]][1].append(value)
+
+    # write into a temporary directory first, so that the archive is either
+    # complete or missing
+    tmpdir = outdir + '.tmp'
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    for level in ('raw',) + LEVELS:
+        os.makedirs(os.path.join(tmpdir, str(level)))
+    for subkey, (times, values) in keys.items():
+        raw = np.array([times, values])
+        raw = raw[:, np.argsort(raw[0], kind='stable')]
+        np.save(os.path.join(tmpdir, 'raw', subkey + '.npy'), raw)
+        rows = None
+        for level in LEVELS:
+            if rows is None:
+                rows = bucketize(raw[0], raw[1], level)
+            else:
+                rows = merge(rows, level)
+            np.save(os.path.join(tmpdir, str(level), subkey + '.npy'), rows)
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.replace(tmpdir, outdir)
+    return len(keys)
+
+
+def load(archdir, subkey, interval):
+    """Return the memory-mapped array that is best suited for a query of
+    *subkey* at the given *interval* from the archive directory *archdir*.
+
+    This is the raw data if *interval* is smaller than the finest pyramid
+    level.  Returns None if the key is not archived.
+    """
+    level = 'raw'
+    for lvl in LEVELS:
+        if lvl <= interval:
+            level = lvl
+    filename = os.path.join(archdir, str(level), subkey + '.npy')
+    if not os.path.isfile(filename):
+        return None
+    return level, np.load(filename, mmap_mode='r')
+
+
+def query(archdir, subkey, fromtime, totime, interval, mode='minmax'):
+    """Return the downsampled (time, value) points of *subkey* between
+    *fromtime* and *totime*, or None if the key is not archived.
+    """
+    loaded = load(archdir, subkey, interval)
+    if loaded is None:
+        return None
+    level, data = loaded
+    if level == 'raw':
+        lo = np.searchsorted(data[0], fromtime, 'left')
+        hi = np.searchsorted(data[0], totime, 'right')
+        rows = bucketize(np.array(data[0, lo:hi]), np.array(data[1, lo:hi]),
+                         interval)
+    else:
+        rows = merge(np.array(select(data, fromtime, totime)), interval)
+    return [(time, value) for (time, value) in points(rows, interval, mode)
+            if fromtime <= time <= totime]
@@ -27,7 +27,9 @@ from time import time as currenttime
 
 from nicos.core import ConfigurationError, Device
 from nicos.protocols.cache import OP_LOCK, OP_LOCK_LOCK, OP_LOCK_UNLOCK
+from nicos.services.cache.database.archive import reduce_records
 from nicos.services.cache.entry import CacheEntry
+from nicos.services.cache.index import SubscriptionMatcher
 
 
 class CacheDatabase(Device):
@@ -42,6 +44,8 @@ class CacheDatabase(Device):
         self._rewrites = {}
         # map new prefix -> incoming prefix
         self._inv_rewrites = {}
+        # not "_subscriptions", which Device uses for parameter callbacks
+        self._submatcher = SubscriptionMatcher()
 
     def initDatabase(self):
         """Initialize the database from persistent store, if present."""
@@ -50,6 +54,44 @@ class CacheDatabase(Device):
         """Clear the database also from persistent store, if present."""
         self.log.info('clearing database')
 
+    def subscribe(self, client, key, ts):
+        """Subscribe the client to updates of all keys containing *key*."""
+        self._submatcher.subscribe(client, key, ts)
+
+    def unsubscribe(self, client, key, ts):
+        self._submatcher.unsubscribe(client, key, ts)
+
+    def remove_client(self, client):
+        """Forget all subscriptions of a disconnected client."""
+        self._submatcher.remove_client(client)
+
+    def _update_clients(self, key, op, value, time, ttl, from_client=None):
+        """Send an update to all clients that subscribed to the key."""
+        for client, ts in self._submatcher.match(key):
+            if client is not from_client and client.is_active():
+                client.send_update(key, op, value, time, ttl, ts)
+
+    def ask_hist_downsampled(self, key, fromtime, totime, interval, mode):
+        """History query that downsamples the values to buckets of *interval*
+        seconds (see `archive.points` for the *mode*).
+
+        This default implementation reduces the result of `ask_hist`.
+        """
+        before = []
+        records = []
+        for chunk in self.ask_hist(key, fromtime, totime):
+            for line in chunk.splitlines():
+                time, _, rest = line.partition('@')
+                time = float(time)
+                value = rest.partition('=')[2]
+                if time < fromtime:
+                    before.append(line + '\n')
+                else:
+                    records.append((time, value))
+        return [''.join(before + ['%r@%s=%s\n' % (time, key, value)
+                                  for (time, value) in
+                                  reduce_records(records, interval, mode)])]
+
     def rewrite(self, key, value):
         """Rewrite handling."""
         if value:
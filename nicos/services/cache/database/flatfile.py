@@ -24,16 +24,21 @@
 # *****************************************************************************
 
 import os
+import queue
 import shutil
 import threading
+from collections import OrderedDict, deque
 from os import path
-from time import localtime, mktime, sleep, time as currenttime
+from time import localtime, mktime, monotonic, sleep, time as currenttime
 
 from nicos import config
-from nicos.core import Param, oneof
+from nicos.core import Param, floatrange, intrange, oneof
 from nicos.protocols.cache import FLAG_NO_STORE, OP_TELL, OP_TELLOLD
+from nicos.services.cache.database import archive
 from nicos.services.cache.database.base import CacheDatabase
+from nicos.services.cache.database.histindex import StoreFileIndex
 from nicos.services.cache.entry import CacheEntry
+from nicos.services.cache.index import KeyIndex
 from nicos.utils import allDays, createThread, ensureDirectory
 
 
@@ -70,6 +75,23 @@ class FlatfileCacheDatabase(CacheDatabase):
     cache server, rather by the NICOS clients.  The value can also a single
     dash, this indicates that at the given timestamp the latest value for this
     key expired.
+
+    To speed up history queries, an index file for each store file of a
+    finished day is kept in the hierarchy ``.index/YYYY/MM-DD`` below the
+    store path.  It is built after the rollover, or on the first query for
+    that day.
+
+    For history queries at a reduced resolution, finished days are also
+    compacted into a columnar archive of numeric values with precomputed
+    downsampled levels (see `nicos.services.cache.database.archive`) in the
+    hierarchy ``.archive/YYYY/MM-DD``.  This is done by a background thread
+    after the rollover, or after the first query for a day that has no archive
+    yet; until then, such queries are answered from the store files.
+
+    With ``writemode = 'batched'``, lines are not written and flushed one by
+    one, but queued and written in batches by a background thread.  The
+    statistics of this writer are published under ``cache/<dbname>/...``
+    keys (not stored on disk).
     """
 
     parameters = {
@@ -79,11 +101,37 @@ class FlatfileCacheDatabase(CacheDatabase):
                            'store hierarchy (auto meaning none on Windows, '
                            'hard else)', default='auto',
                            type=oneof('auto', 'hard', 'soft', 'none')),
+        'writemode':  Param('Write every update immediately, or queue them '
+                            'and write in batches from a background thread',
+                            type=oneof('immediate', 'batched'),
+                            default='immediate'),
+        'flushinterval': Param('Maximum delay before queued updates are '
+                               'written in batched mode', unit='s',
+                               type=floatrange(0.01, 60), default=0.5),
+        'flushbatch': Param('Number of queued updates that trigger an '
+                            'immediate write in batched mode',
+                            type=intrange(1, 1000000), default=1000),
+        'fsync':      Param('When to force written data to disk: never, after '
+                            'every written batch (or line in immediate mode) '
+                            'or only when the files are closed at rollover',
+                            type=oneof('never', 'batch', 'rollover'),
+                            default='never'),
+        'statsinterval': Param('Interval for publishing the writer statistics '
+                               'in batched mode (0 to disable)', unit='s',
+                               type=floatrange(0, 3600), default=10),
+
+        'histindex':  Param('Use index files to answer history queries',
+                            type=bool, default=True),
+        'archive':    Param('Compact finished days into a columnar archive '
+                            'for downsampled history queries',
+                            type=bool, default=True),
     }
 
     def doInit(self, mode):
         self._cat = {}
         self._cat_lock = threading.Lock()
+        # index of the full keys of all entries, for wildcard queries
+        self._index = KeyIndex()
         CacheDatabase.doInit(self, mode)
 
         if self.makelinks == 'auto':
@@ -109,9 +157,133 @@ class FlatfileCacheDatabase(CacheDatabase):
         self._stoprequest = False
         self._cleaner = createThread('cleaner', self._clean)
 
+        # recently used history indexes, map (year, monthday, category) ->
+        # [lock, StoreFileIndex or None]; the lock of an entry protects its
+        # index, the global lock only the map
+        self._histindexes = OrderedDict()
+        self._histindex_lock = threading.Lock()
+        # store files of finished days to compact by the archiver thread, as
+        # (year, monthday, category); the lock protects the pending set
+        self._archive_queue = queue.Queue()
+        self._archive_pending = set()
+        self._archive_lock = threading.Lock()
+        if self.archive:
+            self._archiver = createThread('history archiver',
+                                          self._archive_loop)
+
+        # queue of (category, line, queued time) for the batched writer; it
+        # must hold _writer_lock while writing or touching the file objects
+        self._journal = None
+        self._writer_lock = threading.Lock()
+        if self.writemode == 'batched':
+            self._journal = deque()
+            self._journal_event = threading.Event()
+            self._stats = dict(written=0, latency=0, flushtime=0, maxqueue=0)
+            self._writer = createThread('writer', self._write_loop)
+
     def doShutdown(self):
         self._stoprequest = True
         self._cleaner.join()
+        if self.archive:
+            # an archive that is being written is completed on the next start
+            self._archive_queue.put(None)
+        if self._journal is not None:
+            self._journal_event.set()
+            self._writer.join()
+
+    def _store(self, category, line):
+        """Write a line to the store file of the category.
+
+        Must be called with the category lock held.
+        """
+        if self._journal is not None:
+            self._journal.append((category, line, monotonic()))
+            if len(self._journal) >= self.flushbatch:
+                self._journal_event.set()
+            return
+        fd = self._cat[category][0]
+        if fd is None:
+            fd = self._create_fd(category)
+            self._cat[category][0] = fd
+        fd.write(line)
+        fd.flush()
+        if self.fsync == 'batch':
+            os.fsync(fd.fileno())
+
+    def _write_loop(self):
+        lastpublish = monotonic()
+        while not self._stoprequest:
+            self._journal_event.wait(self.flushinterval)
+            self._journal_event.clear()
+            with self._writer_lock:
+                self._write_journal()
+            if self.statsinterval and \
+               monotonic() > lastpublish + self.statsinterval:
+                lastpublish = monotonic()
+                self._publish_stats()
+        # make sure everything is on disk on shutdown
+        with self._writer_lock:
+            self._write_journal()
+
+    def _write_journal(self):
+        """Write all queued lines.  Must be called with _writer_lock held."""
+        journal = self._journal
+        if not journal:
+            return
+        started = monotonic()
+        self._stats['maxqueue'] = max(self._stats['maxqueue'], len(journal))
+        bycat = {}
+        oldest = started
+        try:
+            while True:
+                category, line, queued = journal.popleft()
+                bycat.setdefault(category, []).append(line)
+                oldest = min(oldest, queued)
+        except IndexError:
+            pass
+        nlines = 0
+        for category, lines in bycat.items():
+            entry = self._cat.get(category)
+            try:
+                if entry is None:
+                    # category was removed in the meantime
+                    with self._create_fd(category) as fd:
+                        fd.write(''.join(lines))
+                    continue
+                if entry[0] is None:
+                    entry[0] = self._create_fd(category)
+                entry[0].write(''.join(lines))
+                entry[0].flush()
+                if self.fsync == 'batch':
+                    os.fsync(entry[0].fileno())
+            except Exception:
+                self.log.exception('error writing store file for %s',
+                                   category)
+            nlines += len(lines)
+        finished = monotonic()
+        stats = self._stats
+        stats['written'] += nlines
+        stats['latency'] = max(stats['latency'], finished - oldest)
+        stats['flushtime'] = max(stats['flushtime'], finished - started)
+
+    def _flush_journal(self, totime):
+        """In batched mode, write the queued lines before a history query up to
+        *totime* reads the store files of the current day.
+        """
+        if self._journal and totime >= self._midnight:
+            with self._writer_lock:
+                self._write_journal()
+
+    def _publish_stats(self):
+        # the statistics keys are only sent to clients, not stored on disk
+        stats, self._stats = self._stats, dict(written=0, latency=0,
+                                               flushtime=0, maxqueue=0)
+        stats['queued'] = len(self._journal)
+        now = currenttime()
+        prefix = 'cache/%s/' % self.name.lower()
+        for key, value in stats.items():
+            self.tell(prefix + key + FLAG_NO_STORE, repr(value), now, None,
+                      None)
 
     def _read_one_storefile(self, filename):
         with open(filename, 'r+', encoding='utf-8') as fd:
@@ -173,6 +345,8 @@ class FlatfileCacheDatabase(CacheDatabase):
                     db = self._read_one_storefile(path.join(curdir, fn))
                     lock = threading.Lock()
                     self._cat[cat] = [None, lock, db]
+                    for subkey in db:
+                        self._index.add(self._fullkey(cat, subkey))
                     nkeys += len(db)
                 except Exception:
                     self.log.warning('could not read cache file %s', fn, exc=1)
@@ -196,7 +370,15 @@ class FlatfileCacheDatabase(CacheDatabase):
 
     def _rollover(self):
         """Must be called with self._cat_lock held."""
+        with self._writer_lock:
+            # first write all pending lines to the files of the old day
+            if self._journal is not None:
+                self._write_journal()
+            self._rollover_files()
+
+    def _rollover_files(self):
         self.log.info('midnight passed, data file rollover started')
+        lastday = (self._year, self._currday)
         ltime = localtime()
         # set the days and midnight time correctly
         self._year = str(ltime[0])
@@ -206,6 +388,9 @@ class FlatfileCacheDatabase(CacheDatabase):
         # roll over all file descriptors
         for category, (fd, _, db) in self._cat.items():
             if fd:
+                if self.fsync != 'never':
+                    fd.flush()
+                    os.fsync(fd.fileno())
                 fd.close()
                 self._cat[category][0] = None
             fd = self._create_fd(category)
@@ -221,6 +406,10 @@ class FlatfileCacheDatabase(CacheDatabase):
         # set the 'lastday' symlink to the current day directory
         self._set_lastday()
         # old files could be compressed here, but it is probably not worth it
+        if self.histindex:
+            createThread('history indexer', self._index_day, args=lastday)
+        if self.archive:
+            self._archive_day(*lastday)
 
     def _set_lastday(self):
         if not hasattr(os, 'symlink'):
@@ -287,39 +476,170 @@ class FlatfileCacheDatabase(CacheDatabase):
         else:
             return [key + op + entry.value + '\n']
 
+    def _fullkey(self, category, subkey):
+        return category + '/' + subkey if category != 'nocat' else subkey
+
     def ask_wc(self, key, ts, time, ttl):
         ret = set()
         # look for matching keys
-        for cat, (_, lock, db) in list(self._cat.items()):
-            prefix = cat + '/' if cat != 'nocat' else ''
-            with lock:
-                for subkey, entry in db.items():
-                    if key not in prefix+subkey:
-                        continue
-                    # check for removed keys
-                    if entry.value is None:
-                        continue
-                    # check for expired keys
-                    op = entry.expired and OP_TELLOLD or OP_TELL
-                    if entry.ttl:
-                        if ts:
-                            ret.add('%r+%s@%s%s%s\n' %
-                                    (entry.time, entry.ttl, prefix+subkey,
-                                     op, entry.value))
-                        else:
-                            ret.add(prefix+subkey + op + entry.value + '\n')
-                    elif ts:
-                        ret.add('%r@%s%s%s\n' % (entry.time, prefix+subkey,
-                                                 op, entry.value))
-                    else:
-                        ret.add(prefix+subkey + op + entry.value + '\n')
+        for fullkey in self._index.match(key):
+            try:
+                category, subkey = fullkey.rsplit('/', 1)
+            except ValueError:
+                category = 'nocat'
+                subkey = fullkey
+            try:
+                _, lock, db = self._cat[category]
+                with lock:
+                    entry = db[subkey]
+            except KeyError:
+                continue
+            # check for removed keys
+            if entry.value is None:
+                continue
+            # check for expired keys
+            op = entry.expired and OP_TELLOLD or OP_TELL
+            if entry.ttl:
+                if ts:
+                    ret.add('%r+%s@%s%s%s\n' % (entry.time, entry.ttl,
+                                                fullkey, op, entry.value))
+                else:
+                    ret.add(fullkey + op + entry.value + '\n')
+            elif ts:
+                ret.add('%r@%s%s%s\n' % (entry.time, fullkey, op, entry.value))
+            else:
+                ret.add(fullkey + op + entry.value + '\n')
         return [''.join(ret)]
 
+    def _get_histentry(self, year, monthday, category):
+        """Return the ``[lock, index]`` entry for the index of a store file."""
+        ident = (year, monthday, category)
+        with self._histindex_lock:
+            entry = self._histindexes.get(ident)
+            if entry is not None:
+                self._histindexes.move_to_end(ident)
+                return entry
+            entry = self._histindexes[ident] = [threading.Lock(), None]
+            if len(self._histindexes) > 500:
+                self._histindexes.popitem(last=False)
+            return entry
+
+    def _get_histindex(self, entry, year, monthday, category):
+        """Return the up-to-date index for a store file, or None if the file
+        does not exist.  Must be called with the lock of the *entry* (from
+        `_get_histentry`) held.
+        """
+        index = entry[1]
+        if index is not None:
+            if (year, monthday) == (self._year, self._currday):
+                # today's files are still growing
+                index.update()
+            return index
+        filename = path.join(self._basepath, year, monthday, category)
+        if not path.isfile(filename):
+            return None
+        finished = (year, monthday) != (self._year, self._currday)
+        indexfile = path.join(self._basepath, '.index', year, monthday,
+                              category)
+        index = StoreFileIndex.load(filename, indexfile)
+        if index is None:
+            index = StoreFileIndex(filename)
+        if index.update() and finished:
+            try:
+                ensureDirectory(path.dirname(indexfile))
+                index.save(indexfile)
+            except Exception:
+                self.log.warning('could not save history index %s',
+                                 indexfile, exc=1)
+        entry[1] = index
+        return index
+
+    def _index_day(self, year, monthday):
+        """Create the history indexes for all store files of a day."""
+        daydir = path.join(self._basepath, year, monthday)
+        self.log.info('creating history indexes for %s', daydir)
+        try:
+            for category in os.listdir(daydir):
+                entry = self._get_histentry(year, monthday, category)
+                with entry[0]:
+                    # drop a cached index that may not be complete
+                    entry[1] = None
+                    self._get_histindex(entry, year, monthday, category)
+        except Exception:
+            self.log.warning('error creating history indexes', exc=1)
+
+    def _get_archive(self, year, monthday, category):
+        """Return the archive directory for a store file of a finished day, or
+        None if there is no archive (yet).
+
+        Missing archives are created in the background.
+        """
+        if (year, monthday) == (self._year, self._currday):
+            return None
+        archdir = path.join(self._basepath, '.archive', year, monthday,
+                            category)
+        if path.isdir(archdir):
+            return archdir
+        if path.isfile(path.join(self._basepath, year, monthday, category)):
+            self._queue_archive(year, monthday, category)
+        return None
+
+    def _queue_archive(self, year, monthday, category):
+        ident = (year, monthday, category)
+        with self._archive_lock:
+            if ident in self._archive_pending:
+                return
+            self._archive_pending.add(ident)
+        self._archive_queue.put(ident)
+
+    def _archive_day(self, year, monthday):
+        """Queue the creation of the archive for all store files of a day."""
+        daydir = path.join(self._basepath, year, monthday)
+        try:
+            for category in os.listdir(daydir):
+                self._queue_archive(year, monthday, category)
+        except Exception:
+            self.log.warning('error archiving history of %s', daydir, exc=1)
+
+    def _archive_loop(self):
+        while True:
+            ident = self._archive_queue.get()
+            if ident is None:
+                return
+            year, monthday, category = ident
+            filename = path.join(self._basepath, year, monthday, category)
+            archdir = path.join(self._basepath, '.archive', year, monthday,
+                                category)
+            try:
+                if not path.isdir(archdir):
+                    self.log.debug('archiving history of %s', filename)
+                    ensureDirectory(path.dirname(archdir))
+                    archive.compact(filename, archdir)
+            except Exception:
+                self.log.warning('error archiving history of %s', filename,
+                                 exc=1)
+            finally:
+                with self._archive_lock:
+                    self._archive_pending.discard(ident)
+
+    def _read_one_histfile_indexed(self, year, monthday, category, subkey,
+                                   fromtime, totime):
+        """Like `_read_one_histfile`, but only yield the lines that are needed
+        for a query from *fromtime* to *totime*.
+        """
+        entry = self._get_histentry(year, monthday, category)
+        with entry[0]:
+            index = self._get_histindex(entry, year, monthday, category)
+            if index is None:
+                return
+            offsets = index.select(subkey, fromtime, totime)
+        yield from index.read(offsets)
+
     def _read_one_histfile(self, year, monthday, category, subkey):
         fn = path.join(self._basepath, year, monthday, category)
         if not path.isfile(fn):
             return
-        with open(fn, 'U', encoding='utf-8') as fd:
+        with open(fn, 'r', encoding='utf-8') as fd:
             firstline = fd.readline()
             nsplit = 2
             if firstline.startswith('# NICOS cache store file v2'):
@@ -347,7 +667,8 @@ class FlatfileCacheDatabase(CacheDatabase):
             subkey = key
         if fromtime > totime:
             return
-        elif fromtime >= self._midnight:
+        self._flush_journal(totime)
+        if fromtime >= self._midnight:
             days = [(self._year, self._currday)]
         else:
             days = allDays(fromtime, totime)
@@ -356,9 +677,14 @@ class FlatfileCacheDatabase(CacheDatabase):
         lastvalue = None
         inrange = False
         for year, monthday in days:
+            if self.histindex:
+                records = self._read_one_histfile_indexed(
+                    year, monthday, category, subkey, fromtime, totime)
+            else:
+                records = self._read_one_histfile(year, monthday, category,
+                                                  subkey)
             try:
-                for time, value in self._read_one_histfile(year, monthday,
-                                                           category, subkey):
+                for time, value in records:
                     if fromtime <= time <= totime:
                         if not inrange and lastvalue:
                             temp.append(lastvalue)
@@ -377,10 +703,62 @@ class FlatfileCacheDatabase(CacheDatabase):
             temp.append(lastvalue)
         yield ''.join(temp)
 
+    def ask_hist_downsampled(self, key, fromtime, totime, interval, mode):
+        try:
+            category, subkey = key.rsplit('/', 1)
+            category = category.replace('/', '-')
+        except ValueError:
+            category = 'nocat'
+            subkey = key
+        if fromtime > totime:
+            return []
+        self._flush_journal(totime)
+        if fromtime >= self._midnight:
+            days = [(self._year, self._currday)]
+        else:
+            days = allDays(fromtime, totime)
+        ret = []
+        for i, (year, monthday) in enumerate(days):
+            try:
+                points = None
+                if self.archive:
+                    archdir = self._get_archive(year, monthday, category)
+                    if archdir:
+                        points = archive.query(archdir, subkey, fromtime,
+                                               totime, interval, mode)
+                        if points is not None:
+                            points = [(time, repr(value))
+                                      for (time, value) in points]
+                records = []
+                if i == 0 or points is None:
+                    if self.histindex:
+                        records = self._read_one_histfile_indexed(
+                            year, monthday, category, subkey, fromtime,
+                            fromtime if points is not None else totime)
+                    else:
+                        records = self._read_one_histfile(
+                            year, monthday, category, subkey)
+                    records = list(records)
+                if i == 0:
+                    # return the first value before the range too
+                    before = [r for r in records if r[0] < fromtime and r[1]]
+                    if before:
+                        ret.append('%r@%s=%s\n' % (before[-1][0], key,
+                                                   before[-1][1]))
+                if points is None:
+                    points = archive.reduce_records(
+                        [r for r in records if fromtime <= r[0] <= totime],
+                        interval, mode)
+                ret.extend('%r@%s=%s\n' % (time, key, value)
+                           for (time, value) in points)
+            except Exception:
+                self.log.exception('error reading store file for history query')
+        return [''.join(ret)]
+
     def _clean(self):
         def cleanonce():
             with self._cat_lock:
-                for cat, (fd, lock, db) in self._cat.items():
+                for cat, (_, lock, db) in self._cat.items():
                     with lock:
                         for subkey, entry in db.items():
                             if not entry.value or entry.expired:
@@ -388,15 +766,11 @@ class FlatfileCacheDatabase(CacheDatabase):
                             time = currenttime()
                             if entry.ttl and (entry.time + entry.ttl < time):
                                 entry.expired = True
-                                for client in self._server._connected.values():
-                                    client.update(cat + '/' + subkey,
-                                                  OP_TELLOLD, entry.value,
-                                                  time, None)
-                                if fd is None:
-                                    fd = self._create_fd(cat)
-                                    self._cat[cat][0] = fd
-                                fd.write('%s\t%s\t-\t-\n' % (subkey, time))
-                                fd.flush()
+                                self._update_clients(cat + '/' + subkey,
+                                                     OP_TELLOLD, entry.value,
+                                                     time, None)
+                                self._store(cat, '%s\t%s\t-\t-\n' %
+                                            (subkey, time))
         while not self._stoprequest:
             sleep(self._long_loop_delay)
             cleanonce()
@@ -429,7 +803,7 @@ class FlatfileCacheDatabase(CacheDatabase):
                 if newcat not in self._cat:
                     # the first item, fd, is created on demand below
                     self._cat[newcat] = [None, threading.Lock(), {}]
-                fd, lock, db = self._cat[newcat]
+                _, lock, db = self._cat[newcat]
             update = True
             with lock:
                 if subkey in db:
@@ -444,18 +818,15 @@ class FlatfileCacheDatabase(CacheDatabase):
                         # do not delete old value, it is already expired
                         update = not store_on_disk
                 if update:
+                    if subkey not in db:
+                        self._index.add(self._fullkey(newcat, subkey))
                     db[subkey] = CacheEntry(time, ttl, value)
                     if store_on_disk:
-                        if fd is None:
-                            fd = self._create_fd(newcat)
-                            self._cat[newcat][0] = fd
-                        fd.write('%s\t%s\t%s\t%s\n' % (
+                        self._store(newcat, '%s\t%s\t%s\t%s\n' % (
                             subkey, time,
                             ttl and '-' or (value and '+' or '-'),
                             value or '-'))
-                        fd.flush()
             if update and (not ttl or time + ttl > now):
                 key = newcat + '/' + subkey
-                for client in self._server._connected.values():
-                    if client is not from_client:
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._update_clients(key, OP_TELL, value or '', time, ttl,
+                                     from_client)
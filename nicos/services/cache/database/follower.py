@@ -0,0 +1,310 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Cache database that replicates the database of another cache server."""
+
+from collections import deque
+from time import time as currenttime
+
+from nicos.core import CacheError, Param, floatrange, host
+from nicos.devices.cacheclient import BaseCacheClient
+from nicos.protocols.cache import BUFSIZE, DEFAULT_CACHE_PORT, END_MARKER, \
+    FLAG_NO_STORE, OP_ASK, OP_LOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, \
+    OP_TELLOLD, OP_WILDCARD
+from nicos.services.cache.database.base import CacheDatabase
+from nicos.services.cache.database.memory import MemoryCacheDatabase
+from nicos.services.cache.entry import CacheEntry
+
+
+class PrimaryConnection(BaseCacheClient):
+    """Connection of a follower to the primary cache, used to forward writes,
+    locks and history queries.
+    """
+
+    def _connect_action(self):
+        pass
+
+    def _handle_msg(self, time, ttlop, ttl, tsop, key, op, value):
+        pass
+
+
+class ReplicationClient(BaseCacheClient):
+    """Connection of a follower to the primary cache that receives all keys
+    and their updates.
+    """
+
+    _follower = None
+
+    def _connect_action(self):
+        follower = self._follower
+        follower._begin_sync()
+        # subscribe before requesting the snapshot, so that no update between
+        # the two can get lost
+        msg = '@%s\n@%s\n%s%s\n' % (OP_SUBSCRIBE, OP_WILDCARD,
+                                    END_MARKER, OP_ASK)
+        self._socket.sendall(msg.encode())
+
+        # read response up to the end marker (and to the end of a line, since
+        # updates can already follow it)
+        chunks = []
+        tail = b''
+        found = False
+        sentinel = (END_MARKER + OP_TELLOLD + '\n').encode()
+        while True:
+            newdata = self._socket.recv(BUFSIZE)
+            if not newdata:
+                raise CacheError('connection closed during replication sync')
+            chunks.append(newdata)
+            window = tail + newdata
+            found = found or sentinel in window
+            if found and newdata.endswith(b'\n'):
+                break
+            tail = window[-len(sentinel):]
+
+        self._process_data(b''.join(chunks))
+        follower._end_sync()
+
+    def _handle_msg(self, time, ttlop, ttl, tsop, key, op, value):
+        if op not in (OP_TELL, OP_TELLOLD) or key == END_MARKER:
+            return
+        try:
+            time = float(time)
+        except (TypeError, ValueError):
+            time = currenttime()
+        try:
+            ttl = float(ttl)
+        except (TypeError, ValueError):
+            ttl = None
+        self._follower._replicate(key, value or None, time, ttl)
+
+
+class FollowerCacheDatabase(MemoryCacheDatabase):
+    """Cache database that replicates the database of a primary cache server.
+
+    This allows to spread read-heavy clients (like remote GUIs and monitors)
+    over several cache servers, without adding load to the primary.
+
+    The follower subscribes to all keys of the *primary* cache and keeps a
+    replica of their current values in memory, from which queries and
+    subscriptions of its clients are answered.  Writes, rewrites and locks are
+    forwarded to the primary; writes are also applied to the replica at once.
+
+    If *histwindow* is nonzero, the values of this many recent seconds are
+    also kept, and history queries within this window are answered locally.
+    All other history queries are forwarded to the primary.
+
+    Forwarded lock requests and history queries are answered synchronously,
+    so they are bounded by *forwardtimeout* to not stall the server's other
+    connections for long when the primary does not respond.
+    """
+
+    parameters = {
+        'primary':    Param('"host[:port]" of the primary cache instance',
+                            type=host(defaultport=DEFAULT_CACHE_PORT),
+                            mandatory=True),
+        'histwindow': Param('Seconds of recent history to keep in memory',
+                            type=floatrange(0), default=0, unit='s'),
+        'forwardtimeout': Param('Timeout for lock requests and history '
+                                'queries forwarded to the primary',
+                                type=floatrange(0.1), default=2, unit='s'),
+    }
+
+    def doInit(self, mode):
+        MemoryCacheDatabase.doInit(self, mode)
+        # start of the range of locally known history
+        self._histstart = currenttime()
+        # keys received during a sync with the primary
+        self._synckeys = None
+        # own writes for which the update from the primary is still expected
+        self._pending = {}
+        self._replication = None
+        self._primary = None
+
+    def initDatabase(self):
+        self._primary = PrimaryConnection(self.name + '_primary',
+                                          cache=self.primary, prefix='',
+                                          lowlevel=True)
+        self._primary._worker.start()
+        self._replication = ReplicationClient(self.name + '_replication',
+                                              cache=self.primary, prefix='',
+                                              lowlevel=True)
+        self._replication._follower = self
+        self._replication._worker.start()
+        self._replication.waitForStartup(10)
+        if not self._replication._connected:
+            self.log.warning('could not get the initial values from the '
+                             'primary cache, will retry')
+
+    def doShutdown(self):
+        for client in (self._replication, self._primary):
+            if client:
+                client.shutdown()
+
+    def _begin_sync(self):
+        # on (re)connect, the history while disconnected is incomplete
+        self._histstart = currenttime()
+        self._synckeys = set()
+        with self._db_lock:
+            self._pending.clear()
+
+    def _end_sync(self):
+        synckeys, self._synckeys = self._synckeys, None
+        with self._db_lock:
+            removed = [key for (key, entries) in self._db.items()
+                       if key not in synckeys and entries[-1].value is not None]
+        # keys that were removed on the primary while we were disconnected
+        now = currenttime()
+        for key in removed:
+            self._store(key, None, now, None, None, False)
+        self.log.info('replicated %d keys from %s', len(synckeys),
+                      self.primary)
+
+    def _replicate(self, key, value, time, ttl):
+        if '/' not in key:
+            key = 'nocat/' + key
+        if self._synckeys is not None:
+            self._synckeys.add(key)
+        with self._db_lock:
+            pending = self._pending.get(key)
+            if pending and (time, value) in pending:
+                # our own write, the primary skipped the ones before it
+                while pending.popleft() != (time, value):
+                    pass
+                if not pending:
+                    del self._pending[key]
+                return
+        self._store(key, value, time, ttl, None, False)
+
+    def _store(self, key, value, time, ttl, from_client, always_send_update):
+        with self._db_lock:
+            entries = self._db.get(key)
+            if entries is None:
+                entries = self._db[key] = deque()
+                self._index.add(key)
+            send_update = True
+            if entries:
+                lastent = entries[-1]
+                if lastent.time == time and lastent.value == value:
+                    # already known, e.g. when resyncing
+                    return
+                if lastent.value == value and not lastent.ttl:
+                    # not a real update
+                    send_update = False
+            entries.append(CacheEntry(time, ttl, value))
+            if from_client is not None and (send_update or always_send_update):
+                self._pending.setdefault(key, deque(maxlen=1000)).append(
+                    (time, value))
+            if self.histwindow:
+                # keep the last entry before the window
+                cutoff = currenttime() - self.histwindow
+                while len(entries) > 1 and entries[1].time < cutoff:
+                    entries.popleft()
+            else:
+                while len(entries) > 1:
+                    entries.popleft()
+        if send_update or always_send_update:
+            self._update_clients(key, OP_TELL, value or '', time, ttl,
+                                 from_client)
+
+    def tell(self, key, value, time, ttl, from_client):
+        if value is None:
+            # deletes cannot have a TTL
+            ttl = None
+        if ttl:
+            msg = '%r+%s@%s%s%s\n' % (time, ttl, key, OP_TELL, value or '')
+        else:
+            msg = '%r@%s%s%s\n' % (time, key, OP_TELL, value or '')
+        always_send_update = False
+        if key.endswith(FLAG_NO_STORE):
+            key = key[:-len(FLAG_NO_STORE)]
+            always_send_update = True
+        if '/' not in key:
+            key = 'nocat/' + key
+        # rewritten keys are not stored here: the primary sends their updates
+        self._store(key, value, time, ttl, from_client, always_send_update)
+        if from_client is not None:
+            # values from the server itself (like its sysinfo) stay local
+            self._primary._queue.put(msg)
+
+    def rewrite(self, key, value):
+        self._primary._queue.put('%s%s%s\n' % (key, OP_REWRITE, value or ''))
+
+    def lock(self, key, value, time, ttl):
+        if ttl:
+            msg = '%r+%s@%s%s%s\n' % (time, ttl, key, OP_LOCK, value)
+        else:
+            msg = '%r@%s%s%s\n' % (time, key, OP_LOCK, value)
+        try:
+            return [msgmatch.string + '\n' for msgmatch in
+                    self._primary._single_request(
+                        msg, retry=1, timeout=self.forwardtimeout)]
+        except (CacheError, OSError):
+            self.log.warning('cannot forward lock request to primary cache')
+            # deny, there is no way to check for other lockers
+            return [key + OP_LOCK + 'primary cache unreachable\n']
+
+    def _is_local_hist(self, fromtime):
+        return self.histwindow and fromtime >= self._histstart and \
+            fromtime >= currenttime() - self.histwindow
+
+    def _forward_hist(self, key, fromtime, totime, resolution=''):
+        msg = '%r-%r@%s%s%s\n%s%s\n' % (fromtime, totime, key, OP_ASK,
+                                        resolution, END_MARKER, OP_ASK)
+        sentinel = (END_MARKER + OP_TELLOLD + '\n').encode()
+        try:
+            lines = [msgmatch.string + '\n' for msgmatch in
+                     self._primary._single_request(
+                         msg, sentinel, retry=1, timeout=self.forwardtimeout)
+                     if msgmatch.group('time')]
+        except (CacheError, OSError):
+            self.log.warning('cannot forward history query to primary cache')
+            return []
+        return [''.join(lines)]
+
+    def ask_hist(self, key, fromtime, totime):
+        if fromtime > totime:
+            return []
+        if not self._is_local_hist(fromtime):
+            return self._forward_hist(key, fromtime, totime)
+        ret = []
+        # return the first value before the range too
+        inrange = False
+        with self._db_lock:
+            entries = list(self._db.get(key, ()))
+        for entry in entries:
+            if fromtime <= entry.time <= totime:
+                ret.append('%r@%s=%s\n' % (entry.time, key, entry.value or ''))
+                inrange = True
+            elif not inrange and entry.value and entry.time < fromtime:
+                ret = ['%r@%s=%s\n' % (entry.time, key, entry.value)]
+        if not ret:
+            return []
+        return [''.join(ret)]
+
+    def ask_hist_downsampled(self, key, fromtime, totime, interval, mode):
+        if not self._is_local_hist(fromtime):
+            return self._forward_hist(key, fromtime, totime,
+                                      '%r,%s' % (interval, mode))
+        return CacheDatabase.ask_hist_downsampled(self, key, fromtime, totime,
+                                                  interval, mode)
@@ -0,0 +1,172 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Index files for the history stored by the flatfile cache database.
+
+For every store file (one category on one day), the index records the
+timestamp, byte offset and presence of a value of every line, grouped by
+subkey.  With it, history queries only read the lines of the requested subkey
+that are actually needed.
+"""
+
+import os
+import pickle
+from array import array
+
+import numpy as np
+
+INDEX_VERSION = 1
+
+
+class StoreFileIndex:
+    """Index of a single store file.
+
+    The index can be extended incrementally when lines are appended to the
+    file; only complete lines are indexed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # number of bytes of the store file that are covered by the index
+        self.size = 0
+        # maxsplit for the lines, depending on the file format version
+        self.nsplit = None
+        # map subkey -> (times, offsets, hasvalue) arrays
+        self.entries = {}
+
+    @classmethod
+    def load(cls, filename, indexfile):
+        """Load the index from *indexfile*, if it is valid for the store file.
+
+        Returns None if the index needs to be rebuilt.
+        """
+        try:
+            with open(indexfile, 'rb') as fp:
+                data = pickle.load(fp)
+        except Exception:
+            return None
+        if not isinstance(data, dict) or \
+           data.get('version') != INDEX_VERSION or \
+           data['size'] > os.stat(filename).st_size:
+            return None
+        index = cls(filename)
+        index.size = data['size']
+        index.nsplit = data['nsplit']
+        index.entries = data['entries']
+        return index
+
+    def save(self, indexfile):
+        data = {'version': INDEX_VERSION, 'size': self.size,
+                'nsplit': self.nsplit, 'entries': self.entries}
+        tmpfile = indexfile + '.tmp'
+        with open(tmpfile, 'wb') as fp:
+            pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, indexfile)
+
+    def update(self):
+        """Index all complete lines appended since the last update.
+
+        Returns True if new lines were indexed.
+        """
+        if os.stat(self.filename).st_size <= self.size:
+            return False
+        oldsize = self.size
+        with open(self.filename, 'rb') as fd:
+            fd.seek(self.size)
+            offset = self.size
+            if self.nsplit is None:
+                firstline = fd.readline()
+                if not firstline.endswith(b'\n'):
+                    return False
+                if firstline.startswith(b'# NICOS cache store file v2'):
+                    self.nsplit = 3
+                    offset = len(firstline)
+                else:
+                    self.nsplit = 2
+                    fd.seek(0)
+            entries = self.entries
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    # incomplete line still being written
+                    break
+                lineoffset = offset
+                offset += len(line)
+                line = line.decode('utf-8', 'replace')
+                if '\x00' in line:
+                    continue
+                fields = line.rstrip().split(None, self.nsplit)
+                try:
+                    time = float(fields[1])
+                except (IndexError, ValueError):
+                    continue
+                entry = entries.get(fields[0])
+                if entry is None:
+                    entry = entries[fields[0]] = (array('d'), array('q'),
+                                                  array('b'))
+                entry[0].append(time)
+                entry[1].append(lineoffset)
+                entry[2].append(fields[-1] != '-')
+        self.size = offset
+        return offset > oldsize
+
+    def select(self, subkey, fromtime, totime):
+        """Return the offsets of the lines for *subkey* needed for a history
+        query from *fromtime* to *totime*.
+
+        These are the last line with a value before the range (unless it comes
+        after the first line inside the range), and all lines inside the range,
+        in file order.
+        """
+        entry = self.entries.get(subkey)
+        if entry is None:
+            return []
+        times = np.frombuffer(entry[0], dtype=float)
+        offsets = np.frombuffer(entry[1], dtype=np.int64)
+        hasvalue = np.frombuffer(entry[2], dtype=np.int8)
+        if len(times) > 1 and np.all(times[1:] >= times[:-1]):
+            # usual case: times are ordered, use a binary search
+            first = np.searchsorted(times, fromtime, 'left')
+            last = np.searchsorted(times, totime, 'right')
+            inrange = np.arange(first, last)
+        else:
+            inrange = np.flatnonzero((times >= fromtime) & (times <= totime))
+            first = inrange[0] if len(inrange) else len(times)
+        before = np.flatnonzero((times[:first] < fromtime) &
+                                (hasvalue[:first] != 0))
+        if len(before):
+            return [int(offsets[before[-1]])] + offsets[inrange].tolist()
+        return offsets[inrange].tolist()
+
+    def read(self, offsets):
+        """Yield (time, value) for the lines at the given offsets."""
+        nsplit = self.nsplit
+        with open(self.filename, 'rb') as fd:
+            for offset in offsets:
+                fd.seek(offset)
+                fields = fd.readline().decode('utf-8').rstrip().split(
+                    None, nsplit)
+                value = fields[-1]
+                if value == '-':
+                    value = ''
+                yield (float(fields[1]), value)
@@ -137,6 +137,7 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
                             entry.expired = True
 
                         self._db[msgkey] = [entry]
+                        self._index.add(msgkey)
         self._cleaner.start()
         self.log.info('Processed %i messages.', message_count)
 
@@ -150,9 +151,8 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
                     time = currenttime()
                     if entry.ttl and (entry.time + entry.ttl < time):
                         entry.expired = True
-                        for client in self._server._connected.values():
-                            client.update(key, OP_TELLOLD, entry.value, time,
-                                          None)
+                        self._update_clients(key, OP_TELLOLD, entry.value,
+                                             time, None)
 
         while not self._stoprequest:
             sleep(self._long_loop_delay)
@@ -202,6 +202,7 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
             key = newcat + '/' + subkey
             with self._db_lock:
                 entries = self._db.setdefault(key, [])
+                self._index.add(key)
                 if entries:
                     lastent = entries[-1]
                     if lastent.value == value and not lastent.expired:
@@ -212,9 +213,8 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
                 if send_update:
                     self._update_topic(key, thisent)
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._update_clients(key, OP_TELL, value or '', time, ttl,
+                                     from_client)
 
 
 class KafkaCacheDatabaseWithHistory(KafkaCacheDatabase):
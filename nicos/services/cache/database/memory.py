@@ -30,6 +30,7 @@ from nicos.core import Param, intrange
 from nicos.protocols.cache import FLAG_NO_STORE, OP_TELL, OP_TELLOLD
 from nicos.services.cache.database.base import CacheDatabase
 from nicos.services.cache.entry import CacheEntry
+from nicos.services.cache.index import KeyIndex
 
 
 class MemoryCacheDatabase(CacheDatabase):
@@ -38,6 +39,8 @@ class MemoryCacheDatabase(CacheDatabase):
     def doInit(self, mode):
         self._db = {}
         self._db_lock = threading.Lock()
+        # index of all keys in self._db for wildcard queries
+        self._index = KeyIndex()
         CacheDatabase.doInit(self, mode)
 
     def ask(self, key, ts, time, ttl):
@@ -68,10 +71,8 @@ class MemoryCacheDatabase(CacheDatabase):
         ret = set()
         with self._db_lock:
             # look for matching keys
-            for dbkey, entries in self._db.items():
-                if key not in dbkey:
-                    continue
-                lastent = entries[-1]
+            for dbkey in self._index.match(key):
+                lastent = self._db[dbkey][-1]
                 # check for removed keys
                 if lastent.value is None:
                     continue
@@ -118,6 +119,7 @@ class MemoryCacheDatabase(CacheDatabase):
             key = newcat + '/' + subkey
             with self._db_lock:
                 entries = self._db.setdefault(key, [])
+                self._index.add(key)
                 if entries:
                     lastent = entries[-1]
                     if lastent.value == value and not lastent.ttl:
@@ -126,9 +128,8 @@ class MemoryCacheDatabase(CacheDatabase):
                 # never cache more than a single entry, memory fills up too fast
                 entries[:] = [CacheEntry(time, ttl, value)]
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._update_clients(key, OP_TELL, value or '', time, ttl,
+                                     from_client)
 
 
 class MemoryCacheDatabaseWithHistory(MemoryCacheDatabase):
@@ -186,12 +187,12 @@ class MemoryCacheDatabaseWithHistory(MemoryCacheDatabase):
             with self._db_lock:
                 queue = deque([CacheEntry(None, None, None)], self.maxentries)
                 entries = self._db.setdefault(key, queue)
+                self._index.add(key)
                 lastent = entries[-1]
                 if lastent.value == value and not lastent.ttl:
                     # not a real update
                     send_update = False
                 entries.append(CacheEntry(time, ttl, value))
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._update_clients(key, OP_TELL, value or '', time, ttl,
+                                     from_client)
@@ -0,0 +1,178 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Indexes for fast matching of cache keys.
+
+Wildcard queries and subscriptions in the cache protocol match all keys that
+contain the requested string anywhere.  The classes here avoid comparing every
+query against every key.
+"""
+
+import threading
+from bisect import bisect_left, insort
+
+
+class KeyIndex:
+    """Index of cache keys for substring ("wildcard") lookups.
+
+    For every key, all "segment suffixes" (the parts of the key following a
+    slash) are kept in a sorted list.  Any occurrence of a pattern containing
+    a slash must be followed by a segment suffix starting with the part of the
+    pattern after its first slash, so the candidate keys can be found by a
+    binary search.  Patterns without a usable slash fall back to a scan of all
+    keys.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = set()
+        # sorted list of segment suffixes and the keys they belong to
+        self._suffixes = []
+        self._suffix_keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, key):
+        if key in self._keys:
+            return
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+            i = key.find('/')
+            while i != -1:
+                suffix = key[i + 1:]
+                keys = self._suffix_keys.get(suffix)
+                if keys is None:
+                    self._suffix_keys[suffix] = {key}
+                    insort(self._suffixes, suffix)
+                else:
+                    keys.add(key)
+                i = key.find('/', i + 1)
+
+    def discard(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return
+            self._keys.discard(key)
+            i = key.find('/')
+            while i != -1:
+                suffix = key[i + 1:]
+                keys = self._suffix_keys[suffix]
+                keys.discard(key)
+                if not keys:
+                    del self._suffix_keys[suffix]
+                    del self._suffixes[bisect_left(self._suffixes, suffix)]
+                i = key.find('/', i + 1)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._suffixes = []
+            self._suffix_keys = {}
+
+    def match(self, pattern):
+        """Return a list of all keys that contain *pattern*."""
+        slash = pattern.find('/')
+        with self._lock:
+            if slash == -1 or slash == len(pattern) - 1:
+                return [key for key in self._keys if pattern in key]
+            rest = pattern[slash + 1:]
+            suffixes = self._suffixes
+            candidates = set()
+            i = bisect_left(suffixes, rest)
+            while i < len(suffixes) and suffixes[i].startswith(rest):
+                candidates.update(self._suffix_keys[suffixes[i]])
+                i += 1
+        return [key for key in candidates if pattern in key]
+
+
+class SubscriptionMatcher:
+    """Keeps track of the subscriptions of all clients of a cache server.
+
+    For every key that is updated, the set of interested clients is determined
+    once and then cached until the subscriptions change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # map subscribed pattern -> set of clients, for subscriptions with and
+        # without timestamp
+        self._plain = {}
+        self._ts = {}
+        # map key -> tuple of (client, with timestamp)
+        self._resolved = {}
+
+    def subscribe(self, client, pattern, ts):
+        with self._lock:
+            subs = self._ts if ts else self._plain
+            subs.setdefault(pattern, set()).add(client)
+            self._resolved = {}
+
+    def unsubscribe(self, client, pattern, ts):
+        with self._lock:
+            subs = self._ts if ts else self._plain
+            clients = subs.get(pattern)
+            if clients is None or client not in clients:
+                return
+            clients.discard(client)
+            if not clients:
+                del subs[pattern]
+            self._resolved = {}
+
+    def remove_client(self, client):
+        with self._lock:
+            for subs in (self._ts, self._plain):
+                for pattern, clients in list(subs.items()):
+                    clients.discard(client)
+                    if not clients:
+                        del subs[pattern]
+            self._resolved = {}
+
+    def match(self, key):
+        """Return a tuple of (client, with_timestamp) for all clients that
+        want to get updates for *key*.
+
+        Like for `CacheWorker.update`, subscriptions with timestamp take
+        precedence, and every client is returned at most once.
+        """
+        result = self._resolved.get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            clients = {}
+            for pattern, subscribers in self._ts.items():
+                if pattern in key:
+                    for client in subscribers:
+                        clients[client] = True
+            for pattern, subscribers in self._plain.items():
+                if pattern in key:
+                    for client in subscribers:
+                        clients.setdefault(client, False)
+            result = self._resolved[key] = tuple(clients.items())
+        return result
@@ -37,30 +37,70 @@ line protocol.
 
 import queue
 import select
+import selectors
 import socket
 import threading
+from collections import deque
 from time import sleep, time as currenttime
 
 from nicos import config, session
-from nicos.core import Attach, Device, Param, host
+from nicos.core import Attach, Device, Param, host, intrange, oneof
 from nicos.protocols.cache import BUFSIZE, CYCLETIME, DEFAULT_CACHE_PORT, \
-    OP_ASK, OP_LOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, \
-    OP_UNSUBSCRIBE, OP_WILDCARD, line_pattern, msg_pattern
+    ENCODING_KEY, OP_ASK, OP_LOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, \
+    OP_TELLOLD, OP_UNSUBSCRIBE, OP_WILDCARD, cache_load, compact_dump, \
+    line_pattern, parse_msg
 # pylint: disable=unused-import
 from nicos.services.cache.database import CacheDatabase, \
-    FlatfileCacheDatabase, MemoryCacheDatabase, \
+    FlatfileCacheDatabase, FollowerCacheDatabase, MemoryCacheDatabase, \
     MemoryCacheDatabaseWithHistory
 from nicos.utils import closeSocket, createThread, getSysInfo, loggers, \
     parseHostPort
 
 
+class CompactEncoder:
+    """Converts PyON values to the compact encoding for the clients that
+    requested it, remembering the results for recently seen values.
+
+    Only containers are converted, since scalars are cheap to decode anyway.
+    Values that cannot be converted are passed on unchanged.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        try:
+            return self._memo[value]
+        except KeyError:
+            pass
+        if not value or value[0] not in '([{' or 'cache_unpickle' in value:
+            return value
+        try:
+            result = compact_dump(cache_load(value))
+        except ValueError:
+            result = value
+        with self._lock:
+            if len(self._memo) >= self.maxsize:
+                # forget the oldest entry
+                del self._memo[next(iter(self._memo))]
+            self._memo[value] = result
+        return result
+
+
 class CacheWorker:
     """Worker thread class for the cache server.
 
     One worker starts two threads: one for receiving data from the connection,
-    and one for sending.  Data to send must be posited in `self.send_queue`.
+    and one for sending.  Data to send must be passed to `send()`.
     """
 
+    # shared by all workers whose clients requested the compact encoding
+    compact_encoder = CompactEncoder()
+    # set while a request is handled in the background (event loop mode)
+    querying = False
+
     def __init__(self, db, sock, name, loglevel):
         self.name = name
         # actual value handling is done by the database object
@@ -74,6 +114,8 @@ class CacheWorker:
         # list of subscriptions with timestamp requested
         self.ts_updates_on = set()
         self.stoprequest = False
+        # value encoder, if the client requested the compact encoding
+        self.encode = None
 
         self.log = session.getLogger(name)
         self.log.setLevel(loggers.loglevels[loglevel])
@@ -82,12 +124,19 @@ class CacheWorker:
         self.start_sender(name)
 
         # start receiver thread
-        self.receiver = createThread('receiver %s' % name, self._receiver_thread)
+        self.start_receiver(name)
 
     def start_sender(self, name):
         self.send_queue = queue.Queue()
         self.sender = createThread('sender %s' % name, self._sender_thread)
 
+    def start_receiver(self, name):
+        self.receiver = createThread('receiver %s' % name, self._receiver_thread)
+
+    def send(self, data):
+        """Queue a string to be sent to the client."""
+        self.send_queue.put(data)
+
     def __str__(self):
         return 'worker(%s)' % self.name
 
@@ -112,6 +161,15 @@ class CacheWorker:
     def _sender_thread(self):
         while not self.stoprequest:
             data = self.send_queue.get()
+            # send everything queued in the meantime with the same write
+            chunks = [data]
+            try:
+                while True:
+                    chunks.append(self.send_queue.get_nowait())
+            except queue.Empty:
+                pass
+            if len(chunks) > 1:
+                data = ''.join(chunks)
             # self.log.debug('sending: %r', data)
             if self.sock is None:  # connection already closed
                 return
@@ -137,7 +195,7 @@ class CacheWorker:
     def _receiver_thread(self):
         data = b''
         while not self.stoprequest:
-            data = self._process_data(data, self.send_queue.put)
+            data = self._process_data(data, self.send)
             # wait for data with 3 times the client timeout
             try:
                 res = select.select([self.sock], [], [], CYCLETIME * 3)
@@ -166,13 +224,19 @@ class CacheWorker:
         self.closedown()
 
     def _process_data(self, data, reply_callback):
-        # split data buffer into message lines and handle these
+        # split data buffer into message lines and handle these; the replies
+        # are sent together, so that pipelined requests get their responses
+        # in a single write
+        replies = []
+        i = 0
         match = line_pattern.match(data)
         while match:
             line = match.group(1)
-            data = data[match.end():]
+            i = match.end()
             if not line:
                 self.log.info('got empty line, closing connection')
+                if replies:
+                    reply_callback(''.join(replies))
                 self.closedown()
                 return b''
             try:
@@ -181,23 +245,28 @@ class CacheWorker:
                 self.log.warning('error handling line %r', line, exc=err)
             else:
                 # self.log.debug('return is %r', ret)
-                for item in ret:
-                    reply_callback(item)
+                replies.extend(ret)
+            if self.querying:
+                # the request is handled in the background: keep the rest
+                # until it is done, to send the replies in order
+                break
             # continue loop with next match
-            match = line_pattern.match(data)
-        return data
+            match = line_pattern.match(data, i)
+        if replies:
+            reply_callback(''.join(replies))
+        return data[i:]
 
     def _handle_line(self, line):
         # self.log.debug('handling line: %s', line)
-        match = msg_pattern.match(line)
-        if not match:
+        msg = parse_msg(line)
+        if not msg:
             # disconnect on trash lines (for now)
             if line:
                 self.log.warning('garbled line: %r', line)
             self.closedown()
             return []
         # extract and clean up individual values
-        time, ttlop, ttl, tsop, key, op, value = match.groups()
+        time, ttlop, ttl, tsop, key, op, value = msg
         key = key.lower()
         value = value or None  # no value -> value gets deleted
         try:
@@ -214,18 +283,32 @@ class CacheWorker:
         if ttlop == '-' and ttl:
             ttl = ttl - time
 
+        if key == ENCODING_KEY and op == OP_ASK:
+            return self._negotiate_encoding(value)
+
         # dispatch operations to database object
         if op == OP_TELL:
             self.db.tell(key, value, time, ttl, self)
         elif op == OP_ASK:
             if ttl is not None:
-                return self.db.ask_hist(key, time, time + ttl)
+                if value:
+                    # requested resolution (and mode) for downsampling
+                    interval, _, mode = value.partition(',')
+                    try:
+                        interval = float(interval)
+                    except ValueError:
+                        interval = 0
+                    if interval > 0:
+                        return self._query(
+                            self.db.ask_hist_downsampled,
+                            key, time, time + ttl, interval, mode or 'minmax')
+                return self._query(self.db.ask_hist, key, time, time + ttl)
             else:
                 # although passed, time and ttl are ignored here
-                return self.db.ask(key, tsop, time, ttl)
+                return self._encode_replies(self.db.ask(key, tsop, time, ttl))
         elif op == OP_WILDCARD:
             # time and ttl are currently ignored for wildcard requests
-            return self.db.ask_wc(key, tsop, time, ttl)
+            return self._encode_replies(self.db.ask_wc(key, tsop, time, ttl))
         elif op == OP_SUBSCRIBE:
             # both time and ttl are ignored for subscription requests,
             # but the return format changes when the @ is included
@@ -233,41 +316,64 @@ class CacheWorker:
                 self.ts_updates_on.add(key)
             else:
                 self.updates_on.add(key)
+            self.db.subscribe(self, key, bool(tsop))
         elif op == OP_UNSUBSCRIBE:
             if tsop:
                 self.ts_updates_on.discard(key)  # note: discard does not raise
             else:
                 self.updates_on.discard(key)
+            self.db.unsubscribe(self, key, bool(tsop))
         elif op == OP_TELLOLD:
             # the server shouldn't get TELLOLD, ignore it
             pass
         elif op == OP_LOCK:
-            return self.db.lock(key, value, time, ttl)
+            return self._query(self.db.lock, key, value, time, ttl)
         elif op == OP_REWRITE:
             self.db.rewrite(key, value)
         return []
 
-    def update(self, key, op, value, time, ttl):
-        """Check if we need to send the update given."""
-        # make sure line has at least a default timestamp
-        for mykey in self.ts_updates_on:
-            # do a substring match on key
-            if mykey in key:
-                if not time:
-                    time = currenttime()
-                # self.log.debug('sending update of %s to %s', key, value)
-                if ttl is not None:
-                    msg = '%r+%s@%s%s%s\n' % (time, ttl, key, op, value)
-                else:
-                    msg = '%r@%s%s%s\n' % (time, key, op, value)
-                self.send_queue.put(msg)
-                return  # send at most one update
-        # same for requested updates without timestamp
-        for mykey in self.updates_on:
-            if mykey in key:
-                # self.log.debug('sending update of %s to %s', key, value)
-                self.send_queue.put(key + op + value + '\n')
-                return  # send at most one update
+    def _query(self, func, *args):
+        """Call a database method that can block for a while (reading history
+        from disk or forwarding to another cache) and return its replies.
+        """
+        return func(*args)
+
+    def _negotiate_encoding(self, encoding):
+        if encoding == 'compact':
+            self.encode = self.compact_encoder
+        else:
+            encoding = 'pyon'
+            self.encode = None
+        return [ENCODING_KEY + OP_TELL + encoding + '\n']
+
+    def _encode_replies(self, replies):
+        """Convert the values in reply lines to the requested encoding."""
+        encode = self.encode
+        if encode is None:
+            return replies
+        result = []
+        for line in replies:
+            head, sep, value = line.partition(OP_TELL)
+            if len(value) > 1:
+                line = head + sep + encode(value[:-1]) + '\n'
+            result.append(line)
+        return result
+
+    def send_update(self, key, op, value, time, ttl, ts):
+        """Send an update, with timestamp if *ts* is true."""
+        # self.log.debug('sending update of %s to %s', key, value)
+        if self.encode is not None:
+            value = self.encode(value)
+        if ts:
+            # make sure line has at least a default timestamp
+            if not time:
+                time = currenttime()
+            if ttl is not None:
+                self.send('%r+%s@%s%s%s\n' % (time, ttl, key, op, value))
+            else:
+                self.send('%r@%s%s%s\n' % (time, key, op, value))
+        else:
+            self.send(key + op + value + '\n')
 
 
 class CacheUDPWorker(CacheWorker):
@@ -319,6 +425,269 @@ class CacheUDPWorker(CacheWorker):
         return datalen
 
 
+class CacheEventWorker(CacheWorker):
+    """Worker class for the event loop based server mode.
+
+    Instead of starting threads of its own, the connection is registered with
+    one of the server's `CacheEventLoop` instances, which calls `handle_read`
+    and `handle_write` whenever the socket is ready.  Data to send can be
+    queued from any thread; the loop is woken up to write it out.
+
+    Requests that can block (history queries and locks) are handed to the
+    server's query threads, so that they do not stall the other clients of
+    the loop.  Further requests of the same client are processed after the
+    reply has been queued.
+    """
+
+    def __init__(self, db, sock, name, loglevel, loop):
+        self.loop = loop
+        # received, but not yet processed data
+        self.data = b''
+        # strings queued by send() and encoded data not yet written out
+        self._outqueue = deque()
+        self._outdata = b''
+        # set while the worker is scheduled for writing with the loop
+        self._scheduled = False
+        # set while the selector also waits for the socket to be writable
+        self.wantwrite = False
+        self.lastsend = currenttime()
+        CacheWorker.__init__(self, db, sock, name, loglevel)
+
+    def start_sender(self, name):
+        pass
+
+    def start_receiver(self, name):
+        self.sock.setblocking(False)
+        self.loop.add(self)
+
+    def is_active(self):
+        return not self.stoprequest
+
+    def closedown(self):
+        # the socket is unregistered and closed by the loop thread; this may be
+        # called more than once and from any thread
+        if not self.stoprequest:
+            self.stoprequest = True
+            self.loop.remove(self)
+
+    def join(self):
+        pass
+
+    def send(self, data):
+        self._outqueue.append(data)
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.schedule_write(self)
+
+    def handle_read(self):
+        try:
+            newdata = self.sock.recv(BUFSIZE)
+        except BlockingIOError:
+            return
+        except Exception:
+            newdata = b''
+        if not newdata:
+            # connection closed by the other end
+            self.closedown()
+            return
+        self.data += newdata
+        if not self.querying:
+            self.data = self._process_data(self.data, self.send)
+
+    def handle_resume(self):
+        """Process the requests received while a query was running."""
+        self.querying = False
+        if not self.stoprequest:
+            self.data = self._process_data(self.data, self.send)
+
+    def _query(self, func, *args):
+        self.querying = True
+        self.loop.submit(self, func, args)
+        return []
+
+    def run_query(self, func, args):
+        """Run a query in one of the server's query threads."""
+        try:
+            replies = list(func(*args))
+        except Exception as err:
+            self.log.warning('error handling query', exc=err)
+            replies = []
+        if replies:
+            self.send(''.join(replies))
+        self.loop.resume(self)
+
+    def handle_write(self):
+        # reset the flag *before* collecting, so that no data queued from other
+        # threads in the meantime is missed
+        self._scheduled = False
+        chunks = []
+        try:
+            while True:
+                chunks.append(self._outqueue.popleft())
+        except IndexError:
+            pass
+        if chunks:
+            self._outdata += ''.join(chunks).encode()
+        if self._outdata:
+            try:
+                sent = self.sock.send(self._outdata)
+            except BlockingIOError:
+                sent = 0
+            except Exception as err:
+                self.log.warning('other end closed, shutting down', exc=err)
+                self.closedown()
+                return
+            if sent:
+                self.lastsend = currenttime()
+                self._outdata = self._outdata[sent:]
+        if bool(self._outdata) != self.wantwrite:
+            self.loop.set_writable(self, not self.wantwrite)
+
+
+class CacheEventLoop:
+    """Serves many client connections from a single thread.
+
+    Workers are multiplexed with the `selectors` module.  Registration,
+    removal and scheduling of pending output can be requested from other
+    threads; the loop is then woken up through a socket pair.
+    """
+
+    def __init__(self, server, name):
+        self.name = name
+        self.log = server.log
+        # the server's queue of blocking requests for the query threads
+        self._queries = server._queries
+        # number of connections served by this loop, for load balancing
+        self.nclients = 0
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._woken = False
+        # requests from other threads, processed in the loop thread
+        self._added = deque()
+        self._removed = deque()
+        self._scheduled = deque()
+        self._resumed = deque()
+        # workers that have output pending on a non-writable socket
+        self._blocked = set()
+        self._stoprequest = False
+        self.thread = createThread('event loop %s' % name, self._loop)
+
+    def wakeup(self):
+        if not self._woken:
+            self._woken = True
+            try:
+                self._wakeup_send.send(b'\0')
+            except OSError:
+                # the pipe is full, so the loop is going to wake up anyway
+                pass
+
+    def add(self, worker):
+        self.nclients += 1
+        self._added.append(worker)
+        self.wakeup()
+
+    def remove(self, worker):
+        self._removed.append(worker)
+        self.wakeup()
+
+    def schedule_write(self, worker):
+        self._scheduled.append(worker)
+        self.wakeup()
+
+    def submit(self, worker, func, args):
+        """Run *func* with *args* in a query thread, see `CacheEventWorker`."""
+        self._queries.put((worker, func, args))
+
+    def resume(self, worker):
+        self._resumed.append(worker)
+        self.wakeup()
+
+    def set_writable(self, worker, flag):
+        """Must be called in the loop thread."""
+        worker.wantwrite = flag
+        events = selectors.EVENT_READ
+        if flag:
+            events |= selectors.EVENT_WRITE
+            self._blocked.add(worker)
+        else:
+            self._blocked.discard(worker)
+        try:
+            self._selector.modify(worker.sock, events, worker)
+        except (KeyError, ValueError):
+            pass
+
+    def stop(self):
+        self._stoprequest = True
+        self.wakeup()
+        self.thread.join()
+
+    def _loop(self):
+        while not self._stoprequest:
+            try:
+                events = self._selector.select(CYCLETIME * 3)
+            except OSError as err:
+                self.log.warning('error in select', exc=err)
+                sleep(CYCLETIME)
+                continue
+            for key, mask in events:
+                worker = key.data
+                if worker is None:
+                    try:
+                        while self._wakeup_recv.recv(BUFSIZE):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                if worker.stoprequest:
+                    continue
+                if mask & selectors.EVENT_READ:
+                    worker.handle_read()
+                if mask & selectors.EVENT_WRITE and not worker.stoprequest:
+                    worker.handle_write()
+            self._process_requests()
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                closeSocket(key.fileobj)
+        self._selector.close()
+        closeSocket(self._wakeup_recv)
+        closeSocket(self._wakeup_send)
+
+    def _process_requests(self):
+        # reset the flag *before* looking at the requests, see wakeup()
+        self._woken = False
+        while self._added:
+            worker = self._added.popleft()
+            self._selector.register(worker.sock, selectors.EVENT_READ, worker)
+        while self._resumed:
+            self._resumed.popleft().handle_resume()
+        while self._scheduled:
+            worker = self._scheduled.popleft()
+            if not worker.stoprequest:
+                worker.handle_write()
+        if self._blocked:
+            # same send timeout as for the threaded workers
+            timeout = currenttime() - 5
+            for worker in list(self._blocked):
+                if worker.lastsend < timeout:
+                    worker.log.warning('send timed out, shutting down')
+                    worker.closedown()
+        while self._removed:
+            worker = self._removed.popleft()
+            self._blocked.discard(worker)
+            sock, worker.sock = worker.sock, None
+            if sock is None:
+                continue
+            self.nclients -= 1
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            closeSocket(sock)
+
+
 class CacheServer(Device):
     """
     The server class.
@@ -329,6 +698,21 @@ class CacheServer(Device):
                           type=host(defaultport=DEFAULT_CACHE_PORT),
                           mandatory=True,
                           ext_desc="The default port is ``14869``."),
+        'servermode': Param('How client connections are served',
+                            type=oneof('threads', 'eventloop'),
+                            default='threads',
+                            ext_desc='With ``threads``, each client gets a '
+                            'receiver and a sender thread.  With '
+                            '``eventloop``, all TCP clients are multiplexed '
+                            'over a few event loop threads (see '
+                            '*eventloops*), which scales much better for '
+                            'many clients.'),
+        'eventloops': Param('Number of event loop threads to distribute the '
+                            'clients over in "eventloop" mode',
+                            type=intrange(1, 64), default=1),
+        'querythreads': Param('Number of threads for the history queries and '
+                              'lock requests in "eventloop" mode',
+                              type=intrange(1, 64), default=4),
     }
 
     attached_devices = {
@@ -346,14 +730,32 @@ class CacheServer(Device):
         self._connected = {}
         self._attached_db._server = self
         self._connectionLock = threading.Lock()
+        # event loops and query threads, if running in eventloop mode
+        self._loops = []
+        self._queries = queue.Queue()
+        self._querythreads = []
 
     def start(self, *startargs):
         if config.instrument == 'demo' and 'clear' in startargs:
             self._attached_db.clearDatabase()
         self._attached_db.initDatabase()
         self.storeSysInfo()
+        if self.servermode == 'eventloop':
+            self._querythreads = [
+                createThread('query %d' % i, self._query_thread)
+                for i in range(self.querythreads)]
+            self._loops = [CacheEventLoop(self, str(i))
+                           for i in range(self.eventloops)]
         self._worker = createThread('server', self._server_thread)
 
+    def _query_thread(self):
+        while True:
+            request = self._queries.get()
+            if request is None:
+                return
+            worker, func, args = request
+            worker.run_query(func, args)
+
     def storeSysInfo(self):
         key, res = getSysInfo('cache')
         self._attached_db.tell(key, str(res), currenttime(), None, None)
@@ -410,6 +812,7 @@ class CacheServer(Device):
                     self.log.info('client connection %s closed', addr)
                     client.closedown()
                     client.join()  # wait for threads to end
+                    self._attached_db.remove_client(client)
                     del self._connected[addr]
 
             # now check for additional incoming connections
@@ -433,8 +836,16 @@ class CacheServer(Device):
                     conn, addr = self._serversocket.accept()
                     addr = 'tcp://%s:%d' % addr
                     self.log.info('new connection from %s', addr)
-                    self._connected[addr] = CacheWorker(
-                        self._attached_db, conn, name=addr, loglevel=self.loglevel)
+                    if self._loops:
+                        # put the new client on the least busy loop
+                        loop = min(self._loops, key=lambda l: l.nclients)
+                        self._connected[addr] = CacheEventWorker(
+                            self._attached_db, conn, name=addr,
+                            loglevel=self.loglevel, loop=loop)
+                    else:
+                        self._connected[addr] = CacheWorker(
+                            self._attached_db, conn, name=addr,
+                            loglevel=self.loglevel)
                 elif self._serversocket_udp in res[0]:
                     # UDP data came in
                     data, addr = self._serversocket_udp.recvfrom(3072)
@@ -468,4 +879,11 @@ class CacheServer(Device):
                 client.join()
         self.log.info('waiting for server')
         self._worker.join()
+        for loop in self._loops:
+            self.log.info('stopping event loop %s', loop.name)
+            loop.stop()
+        for _ in self._querythreads:
+            self._queries.put(None)
+        for thread in self._querythreads:
+            thread.join()
         self.log.info('server finished')
@@ -28,8 +28,9 @@ import sys
 import threading
 import time
 
-from nicos import config, nicos_version
-from nicos.core import Attach, ConfigurationError, Device, Param, host, listof
+from nicos import config, nicos_version, session
+from nicos.core import Attach, ConfigurationError, Device, Param, dictof, \
+    floatrange, host, listof, oneof
 from nicos.core.utils import system_user
 from nicos.protocols.daemon.classic import DEFAULT_PORT
 from nicos.services.daemon.auth import Authenticator
@@ -77,7 +78,17 @@ class NicosDaemon(Device):
         'simmode':        Param('Whether to always start in dry run mode',
                                 type=bool),
         'autosimulate':   Param('Whether to simulate scripts when running them',
-                                type=bool, default=False)
+                                type=bool, default=False),
+        'coalesceevents': Param('Whether to replace cache updates and live '
+                                'data still queued for a lagging client by '
+                                'newer ones with the same key or detector',
+                                type=bool, default=True),
+        'eventrates':     Param('Maximum rates of sending cache updates (per '
+                                'key) and live data (per detector) to each '
+                                'client, by event name, e.g. '
+                                '{"livedata": 2}', unit='1/s',
+                                type=dictof(oneof('cache', 'livedata'),
+                                            floatrange(0.01))),
     }
 
     def doInit(self, mode):
@@ -134,7 +145,10 @@ class NicosDaemon(Device):
             self._server.emit(event, data, blobs or [], handler=handler)
 
     def statusinfo(self):
-        self.log.info('got SIGUSR2 - current stacktraces for each thread:')
+        self.log.info('got SIGUSR2')
+        if session.cache:
+            session.cache.statusinfo()
+        self.log.info('current stacktraces for each thread:')
         active = threading._active
         for tid, frame in list(sys._current_frames().items()):
             if tid in active:
@@ -142,6 +156,9 @@ class NicosDaemon(Device):
             else:
                 name = str(tid)
             self.log.info('%s: %s', name, formatExtendedStack(frame))
+        for handler in list(getattr(self._server, 'handlers', {}).values()):
+            self.log.info('events for handler #%s: %s', handler.ident,
+                          handler.event_stats())
 
     def start(self):
         """Start the daemon's server."""
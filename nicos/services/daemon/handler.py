@@ -32,6 +32,7 @@ import queue
 import socket
 import tempfile
 from base64 import b64decode, b64encode
+from time import time as currenttime
 
 import rsa
 
@@ -90,9 +91,12 @@ def command(needcontrol=False, needscript=None, name=None):
 
 
 # unique objects
-stop_queue = (object(), '')
+stop_queue = (object(), '', [], None)
 no_msg = object()
 
+# maximum number of events sent together
+EVENT_BATCH = 100
+
 
 class ConnectionHandler:
     """Protocol-unaware connection handler.
@@ -114,6 +118,11 @@ class ConnectionHandler:
         # limit memory usage to 100 Megs
         self.event_queue = SizedQueue(100*1024*1024)
         self.event_mask = set()
+        # statistics of the event sender
+        self.events_sent = 0
+        self.events_batches = 0
+        self.events_coalesced = 0
+        self.events_dropped = 0
         self.log = LoggerWrapper(self.daemon.log, '[new handler] ')
 
     def setIdent(self, ident):
@@ -232,22 +241,71 @@ class ConnectionHandler:
 
     # -- Event thread entry point ---------------------------------------------
 
+    def event_stats(self):
+        """Return statistics about the events sent to this client."""
+        return dict(
+            queued = len(self.event_queue.queue),
+            queuedbytes = self.event_queue.nbytes,
+            sent = self.events_sent,
+            batches = self.events_batches,
+            coalesced = self.event_queue.coalesced + self.events_coalesced,
+            dropped = self.events_dropped,
+        )
+
     def event_sender(self):
         """Take events from the handler instance's event queue and send them
         to the client.
+
+        All events queued at the same time are sent together.  Events that
+        can be coalesced (see `.coalescingKey`) are sent at most with the rate
+        configured in the daemon's ``eventrates`` for the event type; newer
+        events with the same key replace those held back.
         """
         self.log.info('event sender started')
         queue_get = self.event_queue.get
         event_mask = self.event_mask
-        while 1:
-            item = queue_get()
-            if item is stop_queue:
-                break
-            event, data, blobs = item
-            if event in event_mask:
+        rates = self.daemon.eventrates
+        # events held back by rate limiting, by key
+        deferred = {}
+        # earliest time for sending the next event, by key
+        next_send = {}
+        stop = False
+        while not stop:
+            timeout = None
+            if deferred:
+                timeout = max(0, min(next_send[key] for key in deferred) -
+                              currenttime())
+            items = []
+            try:
+                items.append(queue_get(True, timeout))
+                while len(items) < EVENT_BATCH:
+                    items.append(queue_get(False))
+            except queue.Empty:
+                pass
+            now = currenttime()
+            # held back events are older than the ones just taken
+            items[:0] = [deferred.pop(key) for key in list(deferred)
+                         if next_send[key] <= now]
+            batch = []
+            for item in items:
+                if item is stop_queue:
+                    stop = True
+                    break
+                event, data, blobs, key = item
+                if event in event_mask:
+                    continue
+                if key is not None and event in rates:
+                    if next_send.get(key, 0) > now:
+                        if key in deferred:
+                            self.events_coalesced += 1
+                        deferred[key] = item
+                        continue
+                    next_send[key] = now + 1.0 / rates[event]
+                batch.append((event, data, blobs))
+            if not batch:
                 continue
             try:
-                self.send_event(event, data, blobs)
+                self.send_events(batch)
             except socket.timeout:
                 # XXX move socket specific error handling to transport
                 self.log.error('send timeout in event sender')
@@ -256,9 +314,12 @@ class ConnectionHandler:
                 self.log.warning('connection broken in event sender: %s', err)
                 break
             except Exception:
-                self.log.exception('exception in event sender; event: %s, '
-                                   'data: %s', event, repr(data)[:1000])
-        self.log.info('closing connections from event sender')
+                self.log.exception('exception in event sender; events: %s',
+                                   repr(batch)[:1000])
+            self.events_sent += len(batch)
+            self.events_batches += 1
+        self.log.info('closing connections from event sender, event '
+                      'statistics: %s', self.event_stats())
         self.close()
 
     # -- Script control commands ----------------------------------------------
@@ -547,6 +608,9 @@ class ConnectionHandler:
               list of names of all existing devices
            devicefailures
               dict mapping failed device names to error strings
+           eventstats
+              dict of statistics about the events sent to this client (queue
+              depth, events sent, coalesced and dropped)
         """
         current_script = self.controller.current_script
         request_queue = self.controller.get_queue()
@@ -564,6 +628,7 @@ class ConnectionHandler:
                         session.explicit_setups),
             devices  = list(session.devices),
             devicefailures = session.device_failures,
+            eventstats = self.event_stats(),
         ))
 
     @command()
@@ -589,19 +654,29 @@ class ConnectionHandler:
         self.send_ok_reply(current_script and current_script.text or '')
 
     @command()
-    def gethistory(self, key, fromtime, totime):
+    def gethistory(self, key, fromtime, totime, interval=None):
         """Return history of a cache key, if available.
 
-        :param key: cache key (without prefix) to query history
+        :param key: cache key (without prefix) to query history, or several
+            keys separated by commas
         :param fromtime: start time as Unix timestamp
         :param totime: end time as Unix timestamp
-        :returns: list of (time, value) tuples
+        :param interval: if given, resolution in seconds to which the history
+            is downsampled by the cache
+        :returns: list of (time, value) tuples, or a list of them for each of
+            several keys
         """
         if not session.cache:
             self.send_ok_reply([])
-        history = session.cache.history('', key, float(fromtime),
-                                        float(totime))
-        self.send_ok_reply(history)
+            return
+        # all histories are queried in a single request to the cache
+        history = session.cache.history_many(key.split(','), float(fromtime),
+                                             float(totime),
+                                             interval and float(interval))
+        if ',' in key:
+            self.send_ok_reply(history)
+        else:
+            self.send_ok_reply(history[0])
 
     @command()
     def getcachekeys(self, query):
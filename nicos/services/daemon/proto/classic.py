@@ -36,7 +36,8 @@ from nicos.protocols.daemon import CloseConnection, ProtocolError, \
 from nicos.protocols.daemon.classic import ACK, ENQ, LENGTH, NAK, \
     PROTO_VERSION, READ_BUFSIZE, STX, code2command, event2code
 from nicos.services.daemon.handler import ConnectionHandler
-from nicos.utils import closeSocket, createThread
+from nicos.services.daemon.utils import coalescingKey
+from nicos.utils import closeSocket, createThread, sendBuffers
 
 
 class Server(BaseServer, socketserver.TCPServer):
@@ -63,11 +64,14 @@ class Server(BaseServer, socketserver.TCPServer):
         self.server_close()
 
     def emit(self, event, data, blobs, handler=None):
+        key = coalescingKey(event, data, blobs) \
+            if self.daemon.coalesceevents else None
         data = self.serializer.serialize_event(event, data)
         for hdlr in (handler,) if handler else self.handlers.values():
             try:
-                hdlr.event_queue.put((event, data, blobs), True, 0.1)
+                hdlr.event_queue.put((event, data, blobs, key), True, 0.1)
             except queue.Full:
+                hdlr.events_dropped += 1
                 # close event socket to let the connection get
                 # closed by the handler
                 self.daemon.log.warning('handler %s: queue full, '
@@ -271,13 +275,26 @@ class ServerTransport(ConnectionHandler, BaseServerTransport,
             raise ProtocolError('send_error_reply: connection broken (%s)' %
                                 err) from err
 
-    def send_event(self, evtname, payload, blobs):
-        self.event_sock.sendall(STX +
-                                event2code[evtname] +
-                                (b'%c' % len(blobs)) +
-                                LENGTH.pack(len(payload)))
-        # send data separately to avoid copying lots of data
-        self.event_sock.sendall(payload)
+    def _event_buffers(self, evtname, payload, blobs):
+        buffers = [STX + event2code[evtname] + (b'%c' % len(blobs)) +
+                   LENGTH.pack(len(payload)), payload]
         for blob in blobs:
-            self.event_sock.sendall(LENGTH.pack(len(blob)))
-            self.event_sock.sendall(blob)
+            buffers.append(LENGTH.pack(len(blob)))
+            buffers.append(blob)
+        return buffers
+
+    def send_event(self, evtname, payload, blobs):
+        # send data without joining it into one buffer to avoid copying lots
+        # of data, but with as few system calls as possible
+        sendBuffers(self.event_sock, self._event_buffers(evtname, payload,
+                                                         blobs))
+
+    def send_events(self, events):
+        buffers = []
+        for (evtname, payload, blobs) in events:
+            # one event has at most 512 buffers (255 blobs)
+            if len(buffers) > 512:
+                sendBuffers(self.event_sock, buffers)
+                buffers = []
+            buffers.extend(self._event_buffers(evtname, payload, blobs))
+        sendBuffers(self.event_sock, buffers)
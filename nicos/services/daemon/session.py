@@ -194,6 +194,9 @@ class DaemonSession(NoninteractiveSession):
 
     def setupCallback(self, setupnames, explicit):
         self.emitfunc('setup', (setupnames, explicit))
+        if setupnames:
+            # start the simulation template for the new setups in advance
+            self.getSimulationTemplate()
 
     def deviceCallback(self, action, devnames):
         self.emitfunc('device', (action, devnames))
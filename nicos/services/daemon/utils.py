@@ -34,6 +34,7 @@ import time
 from threading import Event, Lock
 
 from nicos import session
+from nicos.core.constants import LIVE
 from nicos.utils import fixupScript
 from nicos.utils.loggers import ACTION, recordToMessage
 
@@ -259,22 +260,57 @@ class ScriptQueue:
 
 # -- Size-limited queue (for event senders) ------------------------------------
 
+def coalescingKey(event, data, blobs):
+    """Return the key under which the given event can be replaced by a newer
+    one while it is still queued for a client, or None.
+
+    This is the case for cache updates (per cache key) and live data of a
+    detector.
+    """
+    if event == 'cache':
+        return (event, data[1])
+    if event == 'livedata' and blobs and data.get('tag') == LIVE:
+        return (event, data.get('det'))
+    return None
+
+
 class SizedQueue(queue.Queue):
-    """A Queue that limits the total size of event messages"""
+    """A Queue that limits the total size of event messages.
+
+    Items are tuples of (event, serialized data, blobs, key).  If the key is
+    not None and an item with the same key is still in the queue, the new item
+    replaces the queued one (see `coalescingKey`).
+    """
     def _init(self, maxsize):
         assert maxsize > 0
         self.nbytes = 0
+        self.pending = {}
+        self.coalesced = 0
         queue.Queue._init(self, maxsize)
 
     def _qsize(self):
         return self.nbytes
 
     def _put(self, item):
+        key = item[3]
+        if key is not None:
+            entry = self.pending.get(key)
+            if entry is not None:
+                self.nbytes += len(item[1]) - len(entry[0][1])
+                entry[0] = item
+                self.coalesced += 1
+                return
+            entry = self.pending[key] = [item]
+        else:
+            entry = [item]
         # size of the queue item should never be zero, so add one
         self.nbytes += len(item[1]) + 1
-        self.queue.append(item)
+        self.queue.append(entry)
 
     def _get(self):
-        item = self.queue.popleft()
+        entry = self.queue.popleft()
+        item = entry[0]
+        if item[3] is not None and self.pending.get(item[3]) is entry:
+            del self.pending[item[3]]
         self.nbytes -= len(item[1]) + 1
         return item
@@ -24,19 +24,24 @@
 
 """Contains a process that polls devices automatically."""
 
+import heapq
+import itertools
 import os
 import queue
 import signal
 import sys
 import threading
 import traceback
+from collections import deque
 from os import path
 from time import sleep, time as currenttime
 
 from nicos import config, session
 from nicos.core import ConfigurationError, Device, DeviceAlias, Param, \
-    Readable, listof, status
+    Readable, dictof, floatrange, intrange, listof, status
+from nicos.core.utils import commResource
 from nicos.devices.generic.cache import CacheReader
+from nicos.protocols.cache import FLAG_NO_STORE
 from nicos.utils import createSubprocess, createThread, loggers, \
     watchFileContent, whyExited
 from nicos.utils.files import findSetup
@@ -44,6 +49,438 @@ from nicos.utils.files import findSetup
 POLL_MIN_VALID_TIME = 0.15  # latest time slot to poll before value times out due to maxage
 POLL_BUSY_INTERVAL = 0.5    # if dev is busy, poll this often
 POLL_MIN_WAIT = 0.1         # minimum amount of time between two calls to poll()
+POLL_STRETCH_AFTER = 10     # stretch intervals after this many unchanged ones
+
+
+class PollStats:
+    """Statistics about the polls of a single device.
+
+    Also determines the factor by which the poll interval is stretched in
+    adaptive mode: it grows when the value has not changed for more than
+    `POLL_STRETCH_AFTER` poll intervals, and is reset by `changed`.
+    """
+
+    def __init__(self):
+        self.npolls = 0
+        self.nerrors = 0
+        self.polltime = 0.
+        self.maxpolltime = 0.
+        # durations of the most recent polls, for percentiles
+        self.durations = deque(maxlen=1000)
+        self.nlate = 0
+        self.lateness = 0.
+        self.maxlateness = 0.
+        self.lastvalue = None
+        self.lastchange = currenttime()
+        self.factor = 1
+
+    def add_poll(self, duration, value):
+        self.npolls += 1
+        self.polltime += duration
+        self.maxpolltime = max(self.maxpolltime, duration)
+        self.durations.append(duration)
+        try:
+            changed = bool(value != self.lastvalue)
+        except Exception:  # e.g. arrays, treat them as changed
+            changed = True
+        if changed:
+            self.lastvalue = value
+            self.changed()
+
+    def add_error(self):
+        self.nerrors += 1
+
+    def add_lateness(self, lateness):
+        self.nlate += 1
+        self.lateness += lateness
+        self.maxlateness = max(self.maxlateness, lateness)
+
+    def changed(self):
+        """Reset the stretch factor (the device is or will be changing)."""
+        self.lastchange = currenttime()
+        self.factor = 1
+
+    def stretch(self, interval, maxfactor):
+        """Return the poll interval stretched according to the time since the
+        value last changed.
+        """
+        if maxfactor > 1 and interval:
+            unchanged = currenttime() - self.lastchange
+            self.factor = min(maxfactor, max(
+                1, unchanged / (POLL_STRETCH_AFTER * interval)))
+            return interval * self.factor
+        return interval
+
+    def summary(self):
+        durations = sorted(self.durations)
+        return {
+            'polls': self.npolls,
+            'errors': self.nerrors,
+            'errorrate': self.nerrors / ((self.npolls + self.nerrors) or 1),
+            'mean': self.polltime / (self.npolls or 1),
+            'p95': durations[int(0.95 * (len(durations) - 1))]
+            if durations else 0.,
+            'max': self.maxpolltime,
+            'lateness': self.lateness / (self.nlate or 1),
+            'maxlateness': self.maxlateness,
+            'stretch': self.factor,
+        }
+
+
+class PollTask:
+    """The state of polling a single device in scheduler mode.
+
+    This is the equivalent of the device poller thread in the default mode:
+    the same events (received via cache callbacks) change the polling
+    interval or trigger a poll.  But instead of waiting for the next event or
+    poll, `step` is called by a worker of the `PollScheduler` whenever the
+    task is due.
+    """
+
+    def __init__(self, scheduler, devname, deadline):
+        self.scheduler = scheduler
+        self.poller = scheduler.poller
+        self.log = scheduler.log
+        self.devname = devname
+        self.dev = None
+        # the communication resource, until the device exists it is unknown
+        self.resource = ('device', devname)
+        # events received since the last step
+        self.events = []
+        # time when the task is due next
+        self.deadline = deadline
+        # true while the task is taken by a worker
+        self.active = False
+        # true if the device should not be polled
+        self.done = False
+        # true if a poll was requested, but rate-limited
+        self.forced = False
+        self.errstate = [0, 10]  # number of errors, current wait time
+        self.retry = 0           # time of next try after an error
+        self.i = 0
+        self.lastpoll = 0
+        self.interval = None
+        self.maxage = 0
+        self._oldvalues = {}
+        self.stats = self.poller._stats.setdefault(devname.lower(),
+                                                   PollStats())
+
+    def _set_interval(self):
+        self.interval = self.dev.pollinterval
+        self.maxage = self.interval - POLL_MIN_VALID_TIME if self.interval \
+            else (self.dev.maxage or 0)
+
+    def _set_busy(self):
+        self.interval = POLL_BUSY_INTERVAL
+        self.maxage = self.interval / 2.
+
+    def _create(self):
+        # device creation should be serialized due to the many global state
+        # updates in the session object
+        with self.poller._creation_lock:
+            dev = session.getDevice(self.devname)
+
+        if not isinstance(dev, Readable):
+            self.log.info('%s is not a readable', dev)
+            self.done = True
+            return
+        if isinstance(dev, (DeviceAlias, CacheReader)):
+            self.log.info('%s is a DeviceAlias or a CacheReader, '
+                          'not polling', dev)
+            self.done = True
+            return
+
+        for name, info in dev.parameters.items():
+            if info.volatile:
+                self.scheduler.put(self, 'pollparam:%s' % name)
+
+        self.log.debug('%-10s: registering callbacks', dev)
+        session.cache.addCallback(dev, 'target', self._dev_target)
+        session.cache.addCallback(dev, 'status', self._dev_status)
+        session.cache.addCallback(dev, 'maxage', self._param)
+        session.cache.addCallback(dev, 'pollinterval', self._param)
+        for adev in dev._adevs.values():
+            if not isinstance(adev, Readable):
+                continue
+            session.cache.addCallback(adev, 'value', self._adev_value)
+            session.cache.addCallback(adev, 'target', self._adev_target)
+            session.cache.addCallback(adev, 'status', self._adev_status)
+
+        self.dev = dev
+        self._set_interval()
+        self.resource = self.scheduler.resource_of(dev)
+
+    # cache callbacks, see Poller._worker_thread
+
+    def _dev_target(self, key, value, time):
+        if value is not None:
+            self.scheduler.put(self, 'dev_target')
+            self._oldvalues[key] = value
+
+    def _dev_status(self, key, value, time):
+        if value[0] != self._oldvalues.get(key):
+            if value[0] == status.BUSY:
+                self.scheduler.put(self, 'dev_busy')
+            else:
+                self.scheduler.put(self, 'dev_normal')
+            self._oldvalues[key] = value[0]
+
+    def _adev_value(self, key, value, time):
+        if value != self._oldvalues.get(key):
+            self.scheduler.put(self, 'adev_value')
+            self._oldvalues[key] = value
+
+    def _adev_target(self, key, value, time):
+        if value != self._oldvalues.get(key):
+            self.scheduler.put(self, 'adev_target')
+            self._oldvalues[key] = value
+
+    def _adev_status(self, key, value, time):
+        if value[0] != self._oldvalues.get(key):
+            if value[0] == status.BUSY:
+                self.scheduler.put(self, 'adev_busy')
+            else:
+                self.scheduler.put(self, 'adev_normal')
+            self._oldvalues[key] = value[0]
+
+    def _param(self, key, value, time):
+        self.scheduler.put(self, 'param')
+
+    def _handle_event(self, event):
+        """Handle an event; return true if it should trigger a poll."""
+        if event in ('adev_busy', 'adev_target', 'adev_value', 'dev_busy',
+                     'dev_target'):
+            self._set_busy()
+            self.stats.changed()
+            # only poll if an attached device just went busy
+            return event == 'adev_busy'
+        elif event in ('adev_normal', 'dev_normal'):
+            self.stats.changed()
+            return event == 'adev_normal'
+        elif event == 'param':
+            self._set_interval()
+        elif event.startswith('pollparam:'):
+            try:
+                self.dev._pollParam(event[10:])
+            except Exception:
+                self.dev.log.warning('error polling parameter %s',
+                                     event[10:], exc=True)
+            return True
+        return False
+
+    def _timed_deadline(self):
+        nextpoll = self.lastpoll + (self.stretched_interval() or 3600)
+        # note: dev.maxage is intended here!
+        timesout = self.lastpoll + (self.dev.maxage - POLL_MIN_VALID_TIME
+                                    if self.dev.maxage else POLL_MIN_VALID_TIME)
+        return min(nextpoll, timesout)
+
+    def stretched_interval(self):
+        if self.interval != self.dev.pollinterval:
+            # busy
+            return self.interval
+        return self.stats.stretch(self.interval, self.poller.adaptivepoll)
+
+    def next_deadline(self):
+        """Determine when the task is due next."""
+        if self.retry:
+            return self.retry
+        if self.events:
+            return currenttime()
+        deadline = self._timed_deadline()
+        if self.forced:
+            deadline = min(deadline, self.lastpoll + POLL_MIN_WAIT)
+        return deadline
+
+    def step(self):
+        """Handle the events, and poll the device if required."""
+        self.retry = 0
+        if self.dev is None:
+            self._create()
+            if self.done:
+                return
+        events = self.scheduler.take_events(self)
+        ct = currenttime()
+        dopoll = self.forced or ct >= self._timed_deadline()
+        for event in events:
+            self.log.debug('%-10s: event %s', self.dev, event)
+            dopoll = self._handle_event(event) or dopoll
+        if not dopoll:
+            return
+
+        # do rate-limiting if too many events occur which would retrigger
+        # this device
+        if self.lastpoll + POLL_MIN_WAIT > ct:
+            self.log.debug('%-10s: rate-limiting poll()', self.dev)
+            self.forced = True
+            return
+        self.forced = False
+
+        # only poll if enabled
+        if self.dev.pollinterval is not None:
+            self.i += 1
+            stval, rdval = self.dev.poll(self.i, maxage=self.maxage)
+            duration = currenttime() - ct
+            self.stats.add_poll(duration, rdval)
+            self.log.debug('%-10s: status = %-25s, value = %s (%.3f s)',
+                           self.dev, stval, rdval, duration)
+            # adjust timing of we are no longer busy
+            if stval is not None and stval[0] != status.BUSY:
+                self._set_interval()
+        # keep track of when we last (tried to) poll
+        self.lastpoll = currenttime()
+        # reset error count and waittime after first successful poll
+        if self.i == 1:
+            self.errstate[:] = [0, 10]
+            self.log.info('%-10s: polled successfully', self.dev)
+
+    def failed(self):
+        """Handle an exception during `step`."""
+        errstate = self.errstate
+        errstate[0] += 1
+        self.stats.add_error()
+        # only warn 5 times in a row, and later occasionally
+        if self.dev is None:
+            self.log.warning('%-10s: error creating device, retrying in '
+                             '%d sec', self.devname, errstate[1], exc=True)
+        else:
+            self.log.warning('%-10s: error polling, retrying in %d sec',
+                             self.dev, errstate[1], exc=True)
+            # start over as in a new polling loop
+            self.i = 0
+            self.lastpoll = 0
+            self.forced = False
+            self._set_interval()
+        if errstate[0] % 5 == 0:
+            # use exponential back-off for the wait time; in the worst
+            # case wait 10 minutes between attempts
+            errstate[1] = min(2 * errstate[1], 600)
+        self.retry = currenttime() + errstate[1]
+
+
+class PollScheduler:
+    """Polls devices with a small pool of worker threads.
+
+    The tasks for all devices are kept in a priority queue, ordered by the
+    time they are due next.  Devices that share a communication resource (see
+    `Poller.pollgroups`) are never polled concurrently: a worker that takes a
+    task of a resource currently in use hands it over to the worker using
+    the resource, which polls it right after its current device.
+    """
+
+    def __init__(self, poller, nworkers):
+        self.poller = poller
+        self.log = poller.log
+        self.nworkers = nworkers
+        self.tasks = {}
+        self.threads = []
+        self._stoprequest = False
+        self._cond = threading.Condition()
+        # heap of (deadline, sequence number, task); entries whose deadline is
+        # not the current deadline of the task are stale
+        self._queue = []
+        self._seq = itertools.count()
+        # maps resources in use -> tasks waiting for the resource
+        self._busy = {}
+        # maps device name -> resource for explicitly configured groups
+        self._groups = {}
+        for group, devnames in poller.pollgroups.items():
+            for devname in devnames:
+                self._groups[devname.lower()] = ('group', group)
+
+    def add(self, devname):
+        # start staggered to not poll all devs at once
+        deadline = currenttime() + 0.0719 * len(self.tasks)
+        task = PollTask(self, devname, deadline)
+        with self._cond:
+            self.tasks[devname.lower()] = task
+            self._push(task)
+
+    def resource_of(self, dev):
+        """Return the communication resource used by the device."""
+        if dev.name.lower() in self._groups:
+            return self._groups[dev.name.lower()]
+        return ('device', commResource(dev))
+
+    def start(self):
+        for i in range(self.nworkers):
+            self.threads.append(createThread('poll worker %d' % (i + 1),
+                                             self._worker_thread))
+
+    def stop(self):
+        with self._cond:
+            self._stoprequest = True
+            self._cond.notify_all()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def put(self, task, event):
+        """Queue an event for the task, making it due immediately."""
+        with self._cond:
+            task.events.append(event)
+            if not task.active and not task.retry:
+                task.deadline = currenttime()
+                self._push(task)
+                self._cond.notify()
+
+    def take_events(self, task):
+        with self._cond:
+            events, task.events = task.events, []
+        return events
+
+    def _push(self, task):
+        heapq.heappush(self._queue, (task.deadline, next(self._seq), task))
+
+    def _get(self):
+        """Wait for the next due task; return None if stopped."""
+        queue = self._queue
+        while not self._stoprequest:
+            # drop stale entries
+            while queue and (queue[0][2].active or queue[0][2].done or
+                             queue[0][0] != queue[0][2].deadline):
+                heapq.heappop(queue)
+            ct = currenttime()
+            if queue and queue[0][0] <= ct:
+                deadline, _, task = heapq.heappop(queue)
+                task.active = True
+                task.stats.add_lateness(ct - deadline)
+                return task
+            self._cond.wait(min(queue[0][0] - ct, 1) if queue else 1)
+        return None
+
+    def _worker_thread(self):
+        while True:
+            with self._cond:
+                task = self._get()
+                if task is None:
+                    return
+                resource = task.resource
+                if resource in self._busy:
+                    # the worker using the resource polls it next
+                    self._busy[resource].append(task)
+                    continue
+                self._busy[resource] = []
+            while task:
+                try:
+                    task.step()
+                except Exception:
+                    task.failed()
+                with self._cond:
+                    task.active = False
+                    if not task.done:
+                        task.deadline = task.next_deadline()
+                        self._push(task)
+                        self._cond.notify()
+                    waiting = self._busy[resource]
+                    if waiting:
+                        task = waiting.pop(0)
+                    else:
+                        del self._busy[resource]
+                        task = None
+                if self._stoprequest:
+                    return
 
 
 class Poller(Device):
@@ -60,11 +497,30 @@ class Poller(Device):
                             'master setup', type=listof(str)),
         'blacklist':  Param('Devices that should never be polled',
                             type=listof(str)),
+        'pollworkers': Param('Number of threads that poll all devices of a '
+                             'setup according to a common schedule (0 means '
+                             'one thread for each device)',
+                             type=intrange(0, 100), default=0),
+        'pollgroups': Param('Groups of devices that share a communication '
+                            'resource and are never polled concurrently '
+                            '(only used with pollworkers)',
+                            type=dictof(str, listof(str))),
+        'adaptivepoll': Param('Maximum factor by which the poll interval of '
+                              'devices is stretched while their value does '
+                              'not change (1 means no stretching); devices '
+                              'are still polled before their maxage expires',
+                              type=floatrange(1, 100), default=1),
+        'statsinterval': Param('Interval for publishing the poll statistics '
+                               'in the cache (0 means never)', unit='s',
+                               type=floatrange(0), default=60),
     }
 
     def doInit(self, mode):
         self._stoprequest = False
         self._workers = {}
+        self._scheduler = None
+        # maps lowercased device name -> PollStats
+        self._stats = {}
         self._creation_lock = threading.Lock()
 
     def doUpdateLoglevel(self, value):
@@ -133,7 +589,12 @@ class Poller(Device):
             while not self._stoprequest:
                 # determine maximum waiting time with a default of 1h
                 ct = currenttime()
-                nextpoll = lastpoll + (interval or 3600)
+                if interval == dev.pollinterval:
+                    # not busy: stretch the interval in adaptive mode
+                    nextpoll = lastpoll + (stats.stretch(
+                        interval, self.adaptivepoll) or 3600)
+                else:
+                    nextpoll = lastpoll + (interval or 3600)
                 # note: dev.maxage is intended here!
                 timesout = lastpoll + (dev.maxage - POLL_MIN_VALID_TIME
                                        if dev.maxage else POLL_MIN_VALID_TIME)
@@ -150,6 +611,9 @@ class Poller(Device):
                         # if the timeout is reached, this raises queue.Empty
                         event = work_queue.get(True, maxwait)
                         self.log.debug('%-10s: event %s', dev, event)
+                        if event.startswith(('adev_', 'dev_')):
+                            # no more stretching of the poll interval
+                            stats.changed()
 
                         # handle events....
                         # use pass to trigger a poll or continue to just fetch the next event
@@ -194,7 +658,8 @@ class Poller(Device):
                                                 event[10:], exc=True)
 
                     except queue.Empty:
-                        pass  # just poll if timed out
+                        # just poll if timed out
+                        stats.add_lateness(currenttime() - ct - maxwait)
                 else:
                     self.log.debug('%-10s: ignoring events for one round', dev)
 
@@ -208,7 +673,9 @@ class Poller(Device):
                 if dev.pollinterval is not None:
                     i += 1
                     # if the polling fails, raise into outer loop which handles this...
+                    start = currenttime()
                     stval, rdval = dev.poll(i, maxage=maxage)
+                    stats.add_poll(currenttime() - start, rdval)
                     self.log.debug('%-10s: status = %-25s, value = %s',
                                    dev, stval, rdval)
                     # adjust timing of we are no longer busy
@@ -225,6 +692,7 @@ class Poller(Device):
         # end of poll_loop(dev)
 
         errstate = [0, 10]  # number of errors, current wait time
+        stats = self._stats.setdefault(devname.lower(), PollStats())
         dev = None
         registered = False
 
@@ -270,6 +738,7 @@ class Poller(Device):
 
             except Exception:
                 errstate[0] += 1
+                stats.add_error()
                 # only warn 5 times in a row, and later occasionally
                 if dev is None:
                     self.log.warning('%-10s: error creating device, '
@@ -292,8 +761,14 @@ class Poller(Device):
     # end of _worker_thread
 
     def enqueue_params_poll(self, key, value, time, tell):
-        dev, key = key[len('poller/'):].split('/', 2)
-        if dev in self._workers:
+        dev, _, key = key[len('poller/'):].partition('/')
+        if key != 'pollparams':
+            return
+        if self._scheduler and dev in self._scheduler.tasks:
+            task = self._scheduler.tasks[dev]
+            for param in value:
+                self._scheduler.put(task, 'pollparam:%s' % param)
+        elif dev in self._workers:
             worker = self._workers[dev]
             for param in value:
                 worker.work_queue.put('pollparam:%s' % param)
@@ -307,6 +782,9 @@ class Poller(Device):
         if setup == '[dummy]':
             return
 
+        if self.pollworkers:
+            self._scheduler = PollScheduler(self, self.pollworkers)
+
         try:
             session.loadSetup(setup, allow_startupcode=False)
             for devname in session.getSetupInfo()[setup]['devices']:
@@ -322,6 +800,10 @@ class Poller(Device):
                     self.log.warning('%-10s: error importing device class, '
                                      'not retrying this device', devname, exc=True)
                     continue
+                if self._scheduler:
+                    self.log.debug('scheduling polls of %s', devname)
+                    self._scheduler.add(devname)
+                    continue
                 self.log.debug('starting thread for %s', devname)
                 work_queue = queue.Queue()
                 worker = createThread('%s poller' % devname,
@@ -332,6 +814,11 @@ class Poller(Device):
                 # start staggered to not poll all devs at once....
                 # use just a small delay, exact value does not matter
                 sleep(0.0719)
+            if self._scheduler:
+                self._scheduler.start()
+            if self.statsinterval:
+                createThread('stats publisher', self._publish_stats,
+                             args=(setup,))
             session.cache.addPrefixCallback('poller', self.enqueue_params_poll)
 
         except ConfigurationError as err:
@@ -343,6 +830,21 @@ class Poller(Device):
         createThread('refresh checker', self._checker, args=(setup,))
         self.log.info('%s poller startup complete', setup)
 
+    def _publish_stats(self, setup):
+        nextpublish = currenttime() + self.statsinterval
+        while not self._stoprequest:
+            sleep(1)
+            if currenttime() < nextpublish:
+                continue
+            nextpublish += self.statsinterval
+            for devname, stats in list(self._stats.items()):
+                if not stats.npolls and not stats.nerrors:
+                    continue
+                # no need to store this in the history
+                session.cache.put_raw(
+                    'poller/%s/stats/%s' % (setup, devname), stats.summary(),
+                    ttl=2 * self.statsinterval, flag=FLAG_NO_STORE)
+
     def _checker(self, setupname):
         if setupname not in session._setup_info:
             # setup has errors or has disappeared, try the file directly
@@ -365,6 +867,8 @@ class Poller(Device):
             sleep(1)
         for worker in self._workers.values():
             worker.join()
+        if self._scheduler:
+            self._scheduler.join()
 
     def quit(self, signum=None):
         if self._setup is None:
@@ -375,8 +879,12 @@ class Poller(Device):
         self._stoprequest = True
         for worker in self._workers.values():
             worker.work_queue.put('quit', False)  # wake up to quit
+        if self._scheduler:
+            self._scheduler.stop()
         for worker in self._workers.values():
             worker.join()
+        if self._scheduler:
+            self._scheduler.join()
         self.log.info('poller finished')
 
     def reload(self):
@@ -392,9 +900,26 @@ class Poller(Device):
 
     def statusinfo(self):
         self.log.info('got SIGUSR2')
+        if session.cache:
+            session.cache.statusinfo()
         if self._setup is not None:
+            for devname, stats in sorted(self._stats.items()):
+                if not stats.npolls and not stats.nerrors:
+                    continue
+                info = stats.summary()
+                self.log.info('%-10s: %d polls, %d errors; poll duration '
+                              '%.1f ms on average, %.1f ms p95, %.1f ms '
+                              'maximum; lateness %.1f ms on average, %.1f ms '
+                              'maximum; interval stretched by %.1f',
+                              devname, info['polls'], info['errors'],
+                              1000. * info['mean'], 1000. * info['p95'],
+                              1000. * info['max'], 1000. * info['lateness'],
+                              1000. * info['maxlateness'], info['stretch'])
+            workers = list(self._workers.values())
+            if self._scheduler:
+                workers.extend(self._scheduler.threads)
             info = []
-            for worker in self._workers.values():
+            for worker in workers:
                 wname = worker.getName()
                 if worker.is_alive():
                     info.append('%s: alive' % wname)
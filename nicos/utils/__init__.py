@@ -417,6 +417,28 @@ def closeSocket(sock, socket=socket):
         pass
 
 
+def sendBuffers(sock, buffers):
+    """Send all *buffers* over the stream socket *sock*.
+
+    This is equivalent to ``sock.sendall(b''.join(buffers))``, but the
+    buffers are not copied, and where possible they are sent with few calls
+    to ``sendmsg``.  There must not be more than 1024 buffers.
+    """
+    if not hasattr(sock, 'sendmsg'):  # not available on Windows
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+    views = [memoryview(buf).cast('B') for buf in buffers if len(buf)]
+    while views:
+        sent = sock.sendmsg(views)
+        # drop everything that was sent completely, and the sent part of the
+        # first buffer that was not
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+
+
 @contextmanager
 def tcpSocketContext(host, defaultport, timeout=None):
     """Context manager for `tcpSocket` (for arguments see there).
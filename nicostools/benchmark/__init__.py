@@ -0,0 +1,64 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Benchmarks for NICOS services.
+
+Each submodule implements one benchmark with an ``add_arguments(parser)``
+function to register its command line options and a ``run(opts)`` function.
+They are run with the ``tools/nicos-benchmark`` script.
+"""
+
+from time import perf_counter
+
+
+def percentile(values, pct):
+    """Return the *pct* percentile of the list of *values*."""
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100. * (len(values) - 1))))
+    return values[index]
+
+
+def timeit(func, *args, repeat=5, number=1000):
+    """Return the best time per call of ``func(*args)`` in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = perf_counter()
+        for _ in range(number):
+            func(*args)
+        best = min(best, (perf_counter() - started) / number)
+    return best
+
+
+def report(title, rows):
+    """Print a simple table of (name, value, unit) rows."""
+    print(title)
+    print('=' * len(title))
+    width = max(len(row[0]) for row in rows) if rows else 0
+    for name, value, unit in rows:
+        if isinstance(value, float):
+            value = '%.4g' % value
+        print('%-*s  %12s %s' % (width, name, value, unit))
+    print()
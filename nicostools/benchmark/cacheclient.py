@@ -0,0 +1,161 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Regression benchmark for the update handling of the cache client.
+
+A stream of cache updates is replayed into a `CacheClient`, without and with
+the memo of decoded values, and with the suppression of callbacks for
+unchanged values.  The stream can be recorded from a running cache server
+with ``--record FILE``; otherwise, a synthetic stream with typical device
+updates is used.
+"""
+
+import random
+import tempfile
+from time import perf_counter, time as currenttime
+
+from nicos import config, session
+from nicos.core.sessions import Session
+from nicos.devices.cacheclient import CacheClient
+from nicos.protocols.cache import DEFAULT_CACHE_PORT, OP_SUBSCRIBE, \
+    cache_dump, cache_load
+from nicos.utils import closeSocket, tcpSocket
+
+from nicostools.benchmark import report
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default='localhost',
+                        help='cache server to record from (host[:port])')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the update stream into FILE')
+    parser.add_argument('-t', '--time', type=float, default=60,
+                        help='how long to record in seconds')
+    parser.add_argument('-s', '--stream', metavar='FILE',
+                        help='replay the update stream recorded in FILE')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of repetitions')
+
+
+class ReplayClient(CacheClient):
+    """Cache client that does not connect, but gets replayed updates."""
+
+    def _worker_thread(self):
+        pass
+
+
+class PlainReplayClient(ReplayClient):
+    """Replay client without the memo of decoded values."""
+
+    def _load_value(self, key, raw):
+        return cache_load(raw)
+
+
+def record(opts):
+    sock = tcpSocket(opts.cache, DEFAULT_CACHE_PORT)
+    sock.sendall(('@%s\n' % OP_SUBSCRIBE).encode())
+    data = b''
+    started = currenttime()
+    sock.settimeout(1)
+    while currenttime() < started + opts.time:
+        try:
+            data += sock.recv(65536)
+        except OSError:
+            pass
+    closeSocket(sock)
+    data = data[:data.rfind(b'\n') + 1]
+    with open(opts.record, 'wb') as fp:
+        fp.write(data)
+    print('recorded %d updates into %s' % (data.count(b'\n'), opts.record))
+
+
+def synthetic_stream():
+    # every device reports its value (mostly changing), status and target
+    # (mostly unchanged) and one array parameter (unchanged)
+    rnd = random.Random(0)
+    array = cache_dump([rnd.random() for _ in range(200)])
+    lines = []
+    t = 1600000000.
+    for i in range(5000):
+        dev = 'nicos/dev%d/' % rnd.randrange(50)
+        t += 0.01
+        lines.append('%r@%svalue=%r' % (t, dev, round(rnd.gauss(0, 1), 3)))
+        lines.append('%r@%sstatus=%s' % (
+            t, dev, cache_dump((200, 'idle') if rnd.random() < .95
+                               else (220, 'moving'))))
+        lines.append('%r@%starget=%r' % (t, dev, 5.0))
+        if i % 10 == 0:
+            lines.append('%r@%scalibration=%s' % (t, dev, array))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def replay(cls, data, repeat, **params):
+    best = float('inf')
+    for i in range(repeat):
+        client = cls('Replay%d' % i, cache='localhost', prefix='nicos',
+                     **params)
+        # a typical number of callbacks, e.g. for the device status
+        for key in {line.split(b'@')[1].split(b'=')[0].decode()[6:]
+                    for line in data.splitlines()}:
+            if key.endswith('/status'):
+                client._callbacks[key] = [lambda key, value, time: None]
+        started = perf_counter()
+        client._process_data(data)
+        best = min(best, perf_counter() - started)
+        stats = client._stats
+        client.shutdown()
+    return best, stats
+
+
+def run(opts):
+    if opts.record:
+        record(opts)
+        return
+    if opts.stream:
+        with open(opts.stream, 'rb') as fp:
+            data = fp.read()
+    else:
+        data = synthetic_stream()
+    nupdates = data.count(b'\n')
+
+    config.nicos_root = tempfile.mkdtemp()
+    session.__class__ = Session
+    session.__init__('benchmark')
+    try:
+        t_plain, _ = replay(PlainReplayClient, data, opts.repeat)
+        t_memo, stats = replay(ReplayClient, data, opts.repeat)
+        t_skip, skipstats = replay(ReplayClient, data, opts.repeat,
+                                   skipunchanged=True)
+    finally:
+        session.shutdown()
+    report('Cache client update handling', [
+        ('updates', nupdates, ''),
+        ('unchanged values', 100. * stats['unchanged'] / stats['updates'],
+         '%'),
+        ('callbacks suppressed', skipstats['suppressed'], ''),
+        ('without memo', t_plain / nupdates * 1e6, 'us/update'),
+        ('with memo', t_memo / nupdates * 1e6, 'us/update'),
+        ('with memo, skipunchanged', t_skip / nupdates * 1e6, 'us/update'),
+        ('speedup', t_plain / t_memo, 'x'),
+    ])
@@ -0,0 +1,97 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Benchmark for pipelined requests of a cache client.
+
+The values and histories of many keys are requested from a running cache
+server, once with one round trip per key (`CacheClient.get_explicit` and
+`CacheClient.history`) and once with a single pipelined request
+(`CacheClient.get_many` and `CacheClient.history_many`).
+"""
+
+import tempfile
+from time import perf_counter, time as currenttime
+
+from nicos import config, session
+from nicos.core.sessions import Session
+from nicos.devices.cacheclient import CacheClient
+
+from nicostools.benchmark import report
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default='localhost',
+                        help='cache server to test (host[:port])')
+    parser.add_argument('-k', '--keys', type=int, default=200,
+                        help='number of keys to request')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of repetitions')
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        started = perf_counter()
+        func(*args)
+        best = min(best, perf_counter() - started)
+    return best
+
+
+def run(opts):
+    config.nicos_root = tempfile.mkdtemp()
+    session.__class__ = Session
+    session.__init__('benchmark')
+    try:
+        client = CacheClient('Client', cache=opts.cache, prefix='nicos')
+        client.waitForStartup(5)
+        keys = ['benchmark_dev%d/value' % i for i in range(opts.keys)]
+        now = currenttime()
+        for i, key in enumerate(keys):
+            for j in range(10):
+                client.put(*key.split('/'), i + j, time=now - 100 + j)
+        client.flush()
+
+        def sequential_get():
+            for key in keys:
+                client.get_explicit(None, key)
+
+        def sequential_history():
+            for key in keys:
+                client.history(None, key, now - 200, now)
+
+        t_get = best_of(opts.repeat, sequential_get)
+        t_many = best_of(opts.repeat, client.get_many, keys)
+        t_hist = best_of(opts.repeat, sequential_history)
+        t_histmany = best_of(opts.repeat, client.history_many, keys,
+                             now - 200, now)
+        client.shutdown()
+    finally:
+        session.shutdown()
+    report('Cache client requests for %d keys (%s)' % (opts.keys, opts.cache),
+           [('get_explicit per key', t_get * 1000, 'ms'),
+            ('get_many', t_many * 1000, 'ms'),
+            ('speedup', t_get / t_many, 'x'),
+            ('history per key', t_hist * 1000, 'ms'),
+            ('history_many', t_histmany * 1000, 'ms'),
+            ('speedup', t_hist / t_histmany, 'x')])
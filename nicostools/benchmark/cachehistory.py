@@ -0,0 +1,128 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""History query benchmark for a cache server with a flatfile database.
+
+With ``--generate DIR``, a synthetic store with many keys and several days of
+history is written to DIR (use it as the ``storepath`` of a flatfile cache
+database).  Otherwise, history queries over 1, 7 and 30 days are sent to the
+running cache server and their latency is measured.  Run it once with the
+``histindex`` parameter of the database enabled and once with it disabled to
+compare the indexed and the sequential reader.  With ``--resolution``, the
+downsampled history is requested instead.
+"""
+
+import os
+import random
+from os import path
+from time import localtime, mktime, perf_counter
+
+from nicos.protocols.cache import DEFAULT_CACHE_PORT, END_MARKER, OP_ASK
+from nicos.utils import closeSocket, tcpSocket
+
+from nicostools.benchmark import percentile, report
+
+CATEGORY = 'benchmark/history'
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default='localhost',
+                        help='cache server to test (host[:port])')
+    parser.add_argument('-g', '--generate', metavar='DIR',
+                        help='generate a synthetic store in DIR instead')
+    parser.add_argument('-d', '--days', type=int, default=31,
+                        help='number of days to generate')
+    parser.add_argument('-k', '--keys', type=int, default=100,
+                        help='number of keys to generate')
+    parser.add_argument('-i', '--interval', type=float, default=10,
+                        help='mean update interval per key in seconds')
+    parser.add_argument('-R', '--resolution', type=float,
+                        help='query the history downsampled to this '
+                        'resolution in seconds')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of repetitions for each query')
+
+
+def last_midnight():
+    now = localtime()
+    return mktime(now[:3] + (0, 0, 0) + now[6:])
+
+
+def generate(opts):
+    rnd = random.Random(0)
+    midnight = last_midnight()
+    nupdates = int(86400 * opts.keys / opts.interval)
+    for day in range(1, opts.days + 1):
+        start = midnight - day * 86400
+        daydir = path.join(opts.generate, '%04d' % localtime(start)[0],
+                           '%02d-%02d' % localtime(start)[1:3])
+        os.makedirs(daydir, exist_ok=True)
+        times = sorted(rnd.uniform(start, start + 86400)
+                       for _ in range(nupdates))
+        filename = path.join(daydir, CATEGORY.replace('/', '-'))
+        with open(filename, 'w', encoding='utf-8') as fp:
+            fp.write('# NICOS cache store file v2\n')
+            for t in times:
+                fp.write('key%d\t%r\t+\t%r\n' % (rnd.randrange(opts.keys), t,
+                                                 rnd.random()))
+    print('generated %d days with %d updates each in %s' %
+          (opts.days, nupdates, opts.generate))
+
+
+def query(address, key, fromtime, totime, resolution):
+    sock = tcpSocket(address, DEFAULT_CACHE_PORT)
+    try:
+        sock.sendall(('%r-%r@%s%s%s\n%s%s\n' % (
+            fromtime, totime, key, OP_ASK, resolution or '', END_MARKER,
+            OP_ASK)).encode())
+        terminator = ('%s!\n' % END_MARKER).encode()
+        data = b''
+        while not data.endswith(terminator):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        closeSocket(sock)
+    return data.count(b'\n') - 1
+
+
+def run(opts):
+    if opts.generate:
+        generate(opts)
+        return
+    # the generated store ends at the last midnight
+    end = last_midnight()
+    rows = []
+    for days in (1, 7, 30):
+        key = '%s/key%d' % (CATEGORY, days)
+        timings = []
+        for _ in range(opts.repeat):
+            started = perf_counter()
+            nvalues = query(opts.cache, key, end - days * 86400, end,
+                            opts.resolution)
+            timings.append(perf_counter() - started)
+        rows.append(('%d day(s), %d values' % (days, nvalues),
+                     percentile(timings, 50) * 1000, 'ms (median)'))
+    report('History queries', rows)
@@ -0,0 +1,62 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Micro-benchmarks for the cache protocol helpers.
+
+Compares `parse_msg` with a match of the `msg_pattern` regular expression for
+a set of typical cache protocol lines.
+"""
+
+from nicos.protocols.cache import msg_pattern, parse_msg
+
+from nicostools.benchmark import report, timeit
+
+LINES = [
+    ('time+ttl@key=value', '1327504784.71+5@nicos/temp/value=5.003'),
+    ('time@key=value', '1327504784.7132@nicos/det/value=[1, 2, 3, 4, 5]'),
+    ('@key=tuple', "@nicos/mot/status=(200, 'idle')"),
+    ('key=value', 'nicos/temp/setpoint=5'),
+    ('key!', 'nicos/temp/value!'),
+    ('ask', '@nicos/temp/value?'),
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help='number of calls per measurement')
+
+
+def _regex(line, match=msg_pattern.match):
+    return match(line).groups()
+
+
+def run(opts):
+    rows = []
+    for name, line in LINES:
+        t_re = timeit(_regex, line, number=opts.number)
+        t_fast = timeit(parse_msg, line, number=opts.number)
+        rows.append(('%s: regex' % name, t_re * 1e6, 'us'))
+        rows.append(('%s: parse_msg' % name, t_fast * 1e6, 'us'))
+        rows.append(('%s: speedup' % name, t_re / t_fast, 'x'))
+    report('Cache line parsing', rows)
@@ -0,0 +1,138 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Benchmark for bursts of updates sent by a cache client.
+
+Like during a scan, a number of devices put their value, status and target
+into the cache in quick succession, and the time until the server has received
+all of them is measured: the time of the burst itself, and the time needed
+afterwards to drain the send queue (i.e. until `flush()` returns).  This is
+compared for
+the old way of sending (at most 10 messages per write), for batches up to the
+``sendbatch`` byte budget, and for batches with coalescing of superseded
+updates.  Needs a running cache server.
+"""
+
+import queue
+import tempfile
+from time import monotonic, perf_counter, time as currenttime
+
+from nicos import config, session
+from nicos.core.sessions import Session
+from nicos.devices.cacheclient import CacheClient
+
+from nicostools.benchmark import report
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default='localhost',
+                        help='cache server to test (host[:port])')
+    parser.add_argument('-d', '--devices', type=int, default=50,
+                        help='number of devices putting updates')
+    parser.add_argument('-s', '--steps', type=int, default=200,
+                        help='number of scan steps (updates per device key)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of repetitions')
+
+
+class LegacyClient(CacheClient):
+    """Cache client sending at most 10 queued messages per write."""
+
+    def _get_batch(self):
+        stats = self._sendstats
+        tosend = ''
+        itemcount = 0
+        try:
+            for _ in range(10):
+                queued, msg = self._queue.get(False)
+                tosend += msg
+                itemcount += 1
+                latency = monotonic() - queued
+                stats['latency'] += latency
+                stats['maxlatency'] = max(stats['maxlatency'], latency)
+        except queue.Empty:
+            pass
+        stats['messages'] += itemcount
+        stats['batches'] += 1
+        return tosend.encode(), itemcount
+
+
+def burst(client, opts):
+    started = perf_counter()
+    for step in range(opts.steps):
+        for i in range(opts.devices):
+            dev = 'benchmark_dev%d' % i
+            client.put(dev, 'value', step + i / 1000., time=currenttime())
+            client.put(dev, 'status', (200, 'idle'))
+            client.put(dev, 'target', float(step))
+    sent = perf_counter()
+    client.flush()
+    return sent - started, perf_counter() - sent
+
+
+def measure(cls, opts, **params):
+    best = (float('inf'), float('inf'))
+    for i in range(opts.repeat):
+        client = cls('Client%d' % i, cache=opts.cache, prefix='nicos',
+                     **params)
+        client.waitForStartup(5)
+        result = burst(client, opts)
+        if sum(result) < sum(best):
+            best = result
+            stats = dict(client._sendstats)
+        client.shutdown()
+    return best, stats
+
+
+def rows(name, times, stats):
+    return [
+        (name, '', ''),
+        ('  burst', times[0] * 1000, 'ms'),
+        ('  draining the queue', times[1] * 1000, 'ms'),
+        ('  writes', stats['batches'], ''),
+        ('  updates coalesced', stats['coalesced'], ''),
+        ('  queue latency avg',
+         1000. * stats['latency'] / stats['messages'], 'ms'),
+        ('  queue latency max', 1000. * stats['maxlatency'], 'ms'),
+    ]
+
+
+def run(opts):
+    config.nicos_root = tempfile.mkdtemp()
+    session.__class__ = Session
+    session.__init__('benchmark')
+    try:
+        t_legacy, legacystats = measure(LegacyClient, opts)
+        t_batch, stats = measure(CacheClient, opts)
+        t_coal, coalstats = measure(CacheClient, opts, coalesce=True)
+    finally:
+        session.shutdown()
+    nupdates = opts.devices * opts.steps * 3
+    report('Cache client update bursts (%s)' % opts.cache,
+           [('updates', nupdates, '')] +
+           rows('10 messages per write', t_legacy, legacystats) +
+           rows('byte budget batches', t_batch, stats) +
+           rows('with coalescing', t_coal, coalstats) +
+           [('speedup (batches)', sum(t_legacy) / sum(t_batch), 'x'),
+            ('speedup (coalescing)', sum(t_legacy) / sum(t_coal), 'x')])
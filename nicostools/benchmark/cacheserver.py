@@ -0,0 +1,153 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Fan-out benchmark for a running cache server.
+
+Many subscriber connections are opened to the server; a single publisher then
+sends updates, and the delay until each update arrives at every subscriber is
+measured.  Run it once against a server in "threads" mode and once against a
+server in "eventloop" mode to compare them.
+
+If the process ID of the server is given, its CPU time and thread count are
+also reported; from that, the number of update deliveries per second of
+server CPU time is calculated, which determines how many clients one core can
+serve.
+"""
+
+import selectors
+import threading
+from time import sleep, time as currenttime
+
+from nicos.protocols.cache import DEFAULT_CACHE_PORT, OP_SUBSCRIBE, OP_TELL
+from nicos.utils import closeSocket, tcpSocket
+
+from nicostools.benchmark import percentile, report
+
+PREFIX = 'benchmark/fanout/'
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default='localhost',
+                        help='cache server to test (host[:port])')
+    parser.add_argument('-n', '--clients', type=int, default=150,
+                        help='number of subscribing clients')
+    parser.add_argument('-u', '--updates', type=int, default=2000,
+                        help='number of updates to send')
+    parser.add_argument('-r', '--rate', type=float, default=500,
+                        help='updates per second to send')
+    parser.add_argument('-p', '--pid', type=int,
+                        help='process ID of the server, to measure its '
+                        'CPU usage (needs psutil)')
+
+
+class Subscribers:
+    """Collects the update latencies for all subscriber sockets."""
+
+    def __init__(self, address, nclients):
+        self.latencies = []
+        self.received = 0
+        self._stop = False
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        for _ in range(nclients):
+            sock = tcpSocket(address, DEFAULT_CACHE_PORT)
+            sock.sendall(('%s%s\n' % (PREFIX, OP_SUBSCRIBE)).encode())
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, [b''])
+            self._sockets.append(sock)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop:
+            for key, _ in self._selector.select(0.1):
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                now = currenttime()
+                buf = key.data[0] + data
+                lines = buf.split(b'\n')
+                key.data[0] = lines.pop()
+                for line in lines:
+                    value = line.partition(OP_TELL.encode())[2]
+                    self.latencies.append(now - float(value))
+                    self.received += 1
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        for sock in self._sockets:
+            closeSocket(sock)
+
+
+def run(opts):
+    process = None
+    if opts.pid:
+        import psutil
+        process = psutil.Process(opts.pid)
+
+    subscribers = Subscribers(opts.cache, opts.clients)
+    publisher = tcpSocket(opts.cache, DEFAULT_CACHE_PORT)
+    # let the server process all subscriptions
+    sleep(1)
+
+    if process:
+        threads = process.num_threads()
+        cpu_before = sum(process.cpu_times()[:2])
+    started = currenttime()
+    delay = 1. / opts.rate
+    for i in range(opts.updates):
+        publisher.sendall(('%skey%d%s%r\n' % (PREFIX, i % 100, OP_TELL,
+                                               currenttime())).encode())
+        sleep(delay)
+    expected = opts.updates * opts.clients
+    deadline = currenttime() + 10
+    while subscribers.received < expected and currenttime() < deadline:
+        sleep(0.1)
+    elapsed = currenttime() - started
+    subscribers.close()
+    closeSocket(publisher)
+
+    lat = subscribers.latencies
+    rows = [
+        ('clients', opts.clients, ''),
+        ('updates sent', opts.updates, ''),
+        ('deliveries', '%d/%d' % (subscribers.received, expected), ''),
+        ('throughput', subscribers.received / elapsed, 'deliveries/s'),
+        ('latency p50', percentile(lat, 50) * 1000, 'ms'),
+        ('latency p99', percentile(lat, 99) * 1000, 'ms'),
+        ('latency max', percentile(lat, 100) * 1000, 'ms'),
+    ]
+    if process:
+        cpu = sum(process.cpu_times()[:2]) - cpu_before
+        rows.extend([
+            ('server threads', threads, ''),
+            ('server CPU time', cpu, 's'),
+            ('deliveries per CPU second', subscribers.received / (cpu or 1e-9),
+             ''),
+            ('clients per core at this rate',
+             subscribers.received / (cpu or 1e-9) / opts.rate, ''),
+        ])
+    report('Cache fan-out benchmark (%s)' % opts.cache, rows)
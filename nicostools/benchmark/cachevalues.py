@@ -0,0 +1,74 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""Micro-benchmarks for the cache value encodings.
+
+Compares decoding typical values from PyON (`cache_load`) and from the compact
+encoding, and the memoized decoding by `ValueDecoder`.  Also shows the cost
+for the server to convert a value and the encoded sizes.
+"""
+
+from nicos.protocols.cache import ValueDecoder, cache_dump, cache_load, \
+    compact_dump
+
+from nicostools.benchmark import report, timeit
+
+VALUES = [
+    ('float', 5.003),
+    ('status', (200, 'idle')),
+    ('dict', {'x': 1.5, 'y': -2.25, 'mode': 'auto', 'limits': (0, 10)}),
+    ('array 100', [i * 0.5 for i in range(100)]),
+    ('array 1000', [i * 0.5 for i in range(1000)]),
+    ('nested 100', [(i, i * 0.5, 'ch%d' % i) for i in range(100)]),
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('-n', '--number', type=int, default=1000,
+                        help='number of calls per measurement')
+
+
+def run(opts):
+    rows = []
+    for name, value in VALUES:
+        pyon = cache_dump(value)
+        try:
+            compact = compact_dump(cache_load(pyon))
+        except ValueError:
+            compact = pyon
+        decoder = ValueDecoder()
+        decoder(pyon)
+        t_pyon = timeit(cache_load, pyon, number=opts.number)
+        t_compact = timeit(cache_load, compact, number=opts.number)
+        t_memo = timeit(decoder, pyon, number=opts.number)
+        t_convert = timeit(lambda v: compact_dump(cache_load(v)), pyon,
+                           number=opts.number)
+        rows.append(('%s: PyON' % name, t_pyon * 1e6, 'us'))
+        rows.append(('%s: compact' % name, t_compact * 1e6, 'us'))
+        rows.append(('%s: memoized' % name, t_memo * 1e6, 'us'))
+        rows.append(('%s: speedup' % name, t_pyon / t_compact, 'x'))
+        rows.append(('%s: server conversion' % name, t_convert * 1e6, 'us'))
+        rows.append(('%s: size PyON/compact' % name,
+                     '%d/%d' % (len(pyon), len(compact)), 'bytes'))
+    report('Cache value decoding', rows)
@@ -0,0 +1,165 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+
+"""Benchmark for the throughput of the daemon event connection.
+
+Live data events with large detector images are sent over a local socket pair
+and received with the client transport, once with a ``sendall`` call for
+every part of the event frame (as done before) and once with `sendBuffers`.
+Small events are sent one by one and in batches like the daemon's event
+sender does.  Then the serializers are compared for typical small event
+payloads.
+"""
+
+import socket
+import threading
+from time import perf_counter
+
+import numpy as np
+
+from nicos.clients.proto.classic import ClientTransport
+from nicos.protocols.daemon.classic import LENGTH, SERIALIZERS, STX, \
+    event2code
+from nicos.services.daemon.handler import EVENT_BATCH
+from nicos.services.daemon.proto.classic import ServerTransport
+from nicos.utils import byteBuffer, closeSocket
+
+from nicostools.benchmark import report, timeit
+
+SMALL_EVENTS = [
+    ('cache', (1614000000.123, 'nicos/motor/value', '=', '1.234')),
+    ('status', (0, 42)),
+    ('message', ['nicos', 1614000000.123, 20, 'moving motor to 1.234\n',
+                 None, 'req-1']),
+    ('datapoint', {'xvalues': [1.5, 2.5], 'yvalues': [100, 2000, 1.5],
+                   'xnames': ['motor', 'det'], 'uid': 'abc-def'}),
+]
+
+
+def add_arguments(parser):
+    parser.add_argument('-s', '--size', type=int, default=2048,
+                        help='size of the (square) detector image')
+    parser.add_argument('-n', '--frames', type=int, default=50,
+                        help='number of live data frames to send')
+    parser.add_argument('-e', '--events', type=int, default=100000,
+                        help='number of small events to send')
+    parser.add_argument('--number', type=int, default=10000,
+                        help='number of calls per serializer measurement')
+
+
+def send_event_sendall(handler, evtname, payload, blobs):
+    sock = handler.event_sock
+    sock.sendall(STX + event2code[evtname] + (b'%c' % len(blobs)) +
+                 LENGTH.pack(len(payload)))
+    sock.sendall(payload)
+    for blob in blobs:
+        sock.sendall(LENGTH.pack(len(blob)))
+        sock.sendall(blob)
+
+
+def send_each(send_event):
+    def send(handler, events):
+        for event in events:
+            send_event(handler, *event)
+    return send
+
+
+def send_batches(handler, events):
+    for i in range(0, len(events), EVENT_BATCH):
+        handler.send_events(events[i:i + EVENT_BATCH])
+
+
+def stream(send, events, serializer):
+    """Send the *events* with ``send(handler, events)`` and return the time
+    until the client has received all of them.
+    """
+    server_sock, client_sock = socket.socketpair()
+    handler = ServerTransport.__new__(ServerTransport)
+    handler.event_sock = server_sock
+    client = ClientTransport(serializer)
+    client.event_sock = client_sock
+    try:
+        started = perf_counter()
+        thread = threading.Thread(target=send, args=(handler, events))
+        thread.start()
+        for _ in range(len(events)):
+            client.recv_event()
+        thread.join()
+        elapsed = perf_counter() - started
+    finally:
+        closeSocket(server_sock)
+        closeSocket(client_sock)
+    return elapsed
+
+
+def compare(title, variants, events, serializer, nbytes=None):
+    rows = [('events', len(events), '')]
+    results = []
+    for name, send in variants:
+        elapsed = stream(send, events, serializer)
+        results.append(elapsed)
+        rows.append(('%s: events/s' % name, len(events) / elapsed, ''))
+        if nbytes:
+            rows.append(('%s: throughput' % name, nbytes / elapsed / 2**20,
+                         'MiB/s'))
+    rows.append(('speedup', results[0] / results[1], 'x'))
+    report(title, rows)
+
+
+def run(opts):
+    serializer = SERIALIZERS['classic']()
+    image = np.random.randint(0, 1000, (opts.size, opts.size)).astype('<u4')
+    params = dict(uid='uid', det='det', time=1.0, tag='live',
+                  datadescs=[dict(dtype=image.dtype.str, shape=image.shape,
+                                  count=1)])
+    events = [('livedata', serializer.serialize_event('livedata', params),
+               [byteBuffer(image)])] * opts.frames
+    compare('Live data events (%dx%d) over a socket pair' %
+            (opts.size, opts.size),
+            [('sendall per part', send_each(send_event_sendall)),
+             ('sendBuffers', send_each(ServerTransport.send_event))],
+            events, serializer, image.nbytes * opts.frames)
+
+    events = [('cache', serializer.serialize_event(evtname, payload), [])
+              for (evtname, payload) in SMALL_EVENTS if evtname == 'cache'] \
+        * opts.events
+    compare('Small events over a socket pair',
+            [('sendall per part', send_each(send_event_sendall)),
+             ('batches of %d' % EVENT_BATCH, send_batches)],
+            events, serializer)
+
+    rows = []
+    for name in sorted(SERIALIZERS):
+        serializer = SERIALIZERS[name]()
+        for evtname, payload in SMALL_EVENTS:
+            data = serializer.serialize_event(evtname, payload)
+            t_ser = timeit(serializer.serialize_event, evtname, payload,
+                           number=opts.number)
+            t_des = timeit(serializer.deserialize_event, data, evtname,
+                           number=opts.number)
+            rows.append(('%s %s: size' % (name, evtname), len(data), 'B'))
+            rows.append(('%s %s: round trip' % (name, evtname),
+                         (t_ser + t_des) * 1e6, 'us'))
+    report('Serialization of small events', rows)
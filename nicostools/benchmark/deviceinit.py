@@ -0,0 +1,136 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+
+"""Benchmark for the parameter initialization when creating devices.
+
+All devices of a set of demo setups are created and destroyed several times,
+with a cache client that keeps the values in memory: once with an empty cache
+(all parameter values are put into the cache) and then with all values
+present.  This is compared with a client that gets and puts the parameter
+values one by one, as it was done before the bulk lookup and update.
+"""
+
+import logging
+import os
+import tempfile
+from os import path
+from time import perf_counter
+
+from nicos import config, session
+from nicos.core import MASTER
+from nicos.core.sessions import Session
+from nicos.devices.cacheclient import CacheClient
+
+from nicostools.benchmark import report
+
+SETUPS = ['sans', 'cryo', 'magnet', 'vacuum', 'table', 'ccr']
+
+
+def add_arguments(parser):
+    parser.add_argument('-s', '--setup', action='append', default=[],
+                        help='demo setup to load (can be given multiple '
+                        'times, default: %s)' % ', '.join(SETUPS))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of repetitions')
+
+
+class LocalCacheClient(CacheClient):
+    """Cache client that does not connect, and only keeps the values."""
+
+    def _worker_thread(self):
+        self._startup_done.set()
+
+
+class PerKeyCacheClient(LocalCacheClient):
+    """Cache client that gets and puts the values of a device one by one."""
+
+    def get_device(self, dev, keys, default=None):
+        return {key: self.get(dev, key, default) for key in keys}
+
+    def put_many(self, dev, items, time=None):
+        for key, value in items:
+            self.put(dev, key, value, time)
+
+
+def create_all(devnames):
+    started = perf_counter()
+    created = []
+    for devname in devnames:
+        try:
+            session.createDevice(devname)
+        except Exception:
+            continue
+        created.append(devname)
+    elapsed = perf_counter() - started
+    for devname in reversed(created):
+        if devname in session.devices:
+            session.destroyDevice(devname)
+    return elapsed, created
+
+
+def measure(cls, devnames):
+    session.cache = cls('Cache', cache='localhost', prefix='nicos/',
+                        lowlevel=True)
+    try:
+        cold, created = create_all(devnames)
+        warm, _ = create_all(devnames)
+        nkeys = len(session.cache._db)
+    finally:
+        session.cache.shutdown()
+        session.cache = None
+    return cold, warm, len(created), nkeys
+
+
+def run(opts):
+    setuppath = path.join(config.nicos_root, 'nicos_demo', 'demo', 'setups')
+    config.nicos_root = tempfile.mkdtemp()
+    # the demo experiment creates its data directory relative to the cwd
+    os.chdir(config.nicos_root)
+    session.__class__ = Session
+    session.__init__('benchmark')
+    for handler in session.log.handlers:
+        handler.setLevel(logging.ERROR + 10)
+    try:
+        session.setMode(MASTER)
+        session.setSetupPath(setuppath)
+        session.loadSetup(opts.setup or SETUPS, autocreate_devices=False)
+        devnames = sorted(session.configured_devices)
+        results = {LocalCacheClient: [], PerKeyCacheClient: []}
+        # alternate between the clients to even out warm-up effects
+        for _ in range(opts.repeat):
+            for cls, result in results.items():
+                result.append(measure(cls, devnames))
+        bulk, perkey = [[min(values) for values in zip(*result)]
+                        for result in results.values()]
+    finally:
+        session.shutdown()
+    report('Creating %d devices (%d cache keys) from %s' %
+           (bulk[2], bulk[3], ', '.join(opts.setup or SETUPS)),
+           [('one by one, empty cache', 1000. * perkey[0], 'ms'),
+            ('one by one, filled cache', 1000. * perkey[1], 'ms'),
+            ('bulk, empty cache', 1000. * bulk[0], 'ms'),
+            ('bulk, filled cache', 1000. * bulk[1], 'ms'),
+            ('speedup (empty cache)', perkey[0] / bulk[0], 'x'),
+            ('speedup (filled cache)', perkey[1] / bulk[1], 'x')])
@@ -0,0 +1,123 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+
+"""Benchmark for the dead time of waiting for devices in a scan.
+
+A virtual motor is moved in steps like in a scan, and the time between the end
+of each movement and the return of the wait is measured.  This is compared for
+the old way of waiting (checking the device every 0.3 seconds) and for
+`multiWait`, which uses increasing delays between the checks without a cache.
+With ``--cache``, the session uses the given cache server and `multiWait` is
+woken up by the updates of the motor instead.
+"""
+
+import tempfile
+from time import perf_counter
+
+from nicos import config, session
+from nicos.core import MASTER, status
+from nicos.core.sessions import Session
+from nicos.core.utils import multiWait
+from nicos.devices.cacheclient import CacheClient
+from nicos.devices.generic.virtual import VirtualMotor
+
+from nicostools.benchmark import percentile, report
+
+
+def add_arguments(parser):
+    parser.add_argument('-c', '--cache', default=None,
+                        help='cache server to use (host[:port]), default is '
+                        'to run without cache')
+    parser.add_argument('-n', '--points', type=int, default=500,
+                        help='number of scan points')
+    parser.add_argument('-s', '--speed', type=float, default=10.,
+                        help='motor speed in steps per second')
+
+
+class TimedMotor(VirtualMotor):
+    """Virtual motor remembering when its last movement ended."""
+
+    _idle_since = 0
+
+    def _setROParam(self, param, value):
+        VirtualMotor._setROParam(self, param, value)
+        if param == 'curstatus' and value[0] == status.OK:
+            self._idle_since = perf_counter()
+
+
+def legacy_wait(dev):
+    while not dev.isCompleted():
+        session.delay(0.3)
+
+
+def scan(dev, wait, opts):
+    deadtimes = []
+    started = perf_counter()
+    for i in range(opts.points):
+        dev.start(float(i + 1))
+        wait(dev)
+        deadtimes.append(perf_counter() - dev._idle_since)
+    return perf_counter() - started, deadtimes
+
+
+def rows(name, result, opts):
+    total, deadtimes = result
+    return [
+        (name, '', ''),
+        ('  total', total, 's'),
+        ('  per point', 1000. * total / opts.points, 'ms'),
+        ('  dead time avg', 1000. * sum(deadtimes) / opts.points, 'ms'),
+        ('  dead time p95', 1000. * percentile(deadtimes, 95), 'ms'),
+        ('  dead time max', 1000. * max(deadtimes), 'ms'),
+    ]
+
+
+def run(opts):
+    config.nicos_root = tempfile.mkdtemp()
+    session.__class__ = Session
+    session.__init__('benchmark')
+    try:
+        if opts.cache:
+            session.cache = CacheClient('Cache', cache=opts.cache,
+                                        prefix='nicos/', lowlevel=True)
+            session.cache.waitForStartup(5)
+        session.setMode(MASTER)
+        dev = TimedMotor('benchmark_motor', unit='steps', speed=opts.speed,
+                         abslimits=(-1e6, 1e6), curvalue=0)
+        legacy = scan(dev, legacy_wait, opts)
+        dev.maw(0)
+        new = scan(dev, lambda dev: multiWait([dev]), opts)
+    finally:
+        session.shutdown()
+    legacy_avg = sum(legacy[1]) / opts.points
+    new_avg = sum(new[1]) / opts.points
+    report('Waiting for a virtual motor (%s)' % (opts.cache or 'no cache'),
+           [('points', opts.points, ''),
+            ('move time per point',
+             1000. * (new[0] - sum(new[1])) / opts.points, 'ms')] +
+           rows('checks every 0.3 s', legacy, opts) +
+           rows('multiWait', new, opts) +
+           [('dead time reduction', 1000. * (legacy_avg - new_avg), 'ms'),
+            ('speedup (total)', legacy[0] / new[0], 'x')])
@@ -0,0 +1,153 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+
+"""Benchmark for reading the information of all setups at startup.
+
+By default, a facility tree with the given number of setups is generated
+in a temporary directory: each setup defines some devices, and every tenth
+setup uses ``configdata()`` from a shared config setup.  With ``--path``, the
+setups of an existing tree (e.g. ``nicos_mlz``) are read instead.  Reading
+all setup files is compared with reading them through a cold and a warm
+setup cache, and with a warm cache after some setup files have changed.
+"""
+
+import logging
+import os
+import random
+import shutil
+import tempfile
+from os import path
+from time import perf_counter
+
+from nicos.core.sessions.setupcache import SetupCache
+from nicos.core.sessions.setups import readSetups
+from nicos.utils.files import iterSetups
+
+from nicostools.benchmark import report
+
+SETUP_TEMPLATE = '''\
+description = 'generated setup %(index)d'
+group = 'optional'
+
+includes = []
+
+devices = dict(
+%(devices)s)
+'''
+
+DEVICE_TEMPLATE = '''\
+    dev%(index)d_%(num)d = device('nicos.devices.generic.VirtualMotor',
+        description = 'motor %(num)d',
+        abslimits = (-100, 100),
+        speed = %(speed)s,
+        unit = 'deg',
+        fmtstr = '%%.3f',
+    ),
+'''
+
+CONFIG_SETUP = '''\
+description = 'shared configuration'
+group = 'configdata'
+
+SPEED = 1.5
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('-p', '--path', action='append', default=[],
+                        help='read setups from this directory instead of '
+                        'generating them (can be given multiple times)')
+    parser.add_argument('-n', '--setups', type=int, default=1200,
+                        help='number of setups to generate')
+    parser.add_argument('-d', '--devices', type=int, default=10,
+                        help='number of devices per generated setup')
+    parser.add_argument('-m', '--modified', type=int, default=10,
+                        help='number of setups to modify for the last run')
+
+
+def generate(root, opts):
+    setupdir = path.join(root, 'facility', 'instrument', 'setups')
+    os.makedirs(path.join(setupdir, 'special'))
+    with open(path.join(setupdir, 'special', 'config.py'), 'w',
+              encoding='utf-8') as fp:
+        fp.write(CONFIG_SETUP)
+    for i in range(opts.setups):
+        speed = 'configdata(\'config.SPEED\')' if i % 10 == 0 else '1'
+        devices = ''.join(DEVICE_TEMPLATE % dict(index=i, num=j, speed=speed)
+                          for j in range(opts.devices))
+        with open(path.join(setupdir, 'setup%d.py' % i), 'w',
+                  encoding='utf-8') as fp:
+            fp.write(SETUP_TEMPLATE % dict(index=i, devices=devices))
+    return [setupdir]
+
+
+def timed(paths, log, cache):
+    started = perf_counter()
+    infodict = readSetups(paths, log, cache)
+    return perf_counter() - started, len(infodict)
+
+
+def run(opts):
+    log = logging.getLogger('benchmark')
+    root = tempfile.mkdtemp()
+    try:
+        paths = opts.path or generate(root, opts)
+        cache = SetupCache(path.join(root, 'setupcache', 'setupinfo.pickle'))
+        # first run imports all modules needed by the setups
+        timed(paths, log, False)
+        uncached, nsetups = timed(paths, log, False)
+        cold, _ = timed(paths, log, cache)
+        warm, _ = timed(paths, log, cache)
+        # touch some files without changing them, and change some others
+        filenames = sorted(filename for (_, filename) in iterSetups(paths))
+        touched = random.sample(filenames, min(opts.modified,
+                                               len(filenames)))
+        for filename in touched:
+            os.utime(filename)
+        touchedtime, _ = timed(paths, log, cache)
+        # copy setups to be modified, we might not own them
+        if opts.path:
+            shutil.copytree(paths[0], path.join(root, 'copy'))
+            paths = [path.join(root, 'copy')] + paths[1:]
+            timed(paths, log, cache)
+            filenames = sorted(filename for (_, filename)
+                               in iterSetups(paths[:1]))
+        for filename in random.sample(filenames, min(opts.modified,
+                                                     len(filenames))):
+            with open(filename, 'a', encoding='utf-8') as fp:
+                fp.write('\n# modified\n')
+        modified, _ = timed(paths, log, cache)
+        cachesize = path.getsize(cache.filename)
+    finally:
+        shutil.rmtree(root)
+    report('Reading %d setups from %s' %
+           (nsetups, ', '.join(opts.path) or 'a generated tree'),
+           [('without cache', 1000. * uncached, 'ms'),
+            ('cold cache', 1000. * cold, 'ms'),
+            ('warm cache', 1000. * warm, 'ms'),
+            ('warm, %d touched' % len(touched), 1000. * touchedtime, 'ms'),
+            ('warm, %d modified' % opts.modified, 1000. * modified, 'ms'),
+            ('cache file size', cachesize / 1024., 'kB'),
+            ('speedup (warm)', uncached / warm, 'x')])
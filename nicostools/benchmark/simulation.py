@@ -0,0 +1,90 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+
+"""Benchmark for the startup latency of dry runs.
+
+A script is simulated several times, once with a new simulation process for
+each dry run (which imports NICOS, loads the setups and reads all cache
+values), and once by forking a pre-warmed template process (the
+``simulation_template`` option).  The setups are those of the configured
+instrument (set ``INSTRUMENT``, e.g. to ``nicos_demo.demo``), and the cache
+server configured in them must be running.
+"""
+
+import logging
+from time import perf_counter
+
+from nicos import config, session
+from nicos.core.sessions import Session
+
+from nicostools.benchmark import percentile, report
+
+
+def add_arguments(parser):
+    parser.add_argument('-s', '--setup', action='append', default=[],
+                        help='setup to load (can be given multiple times, '
+                        'default: system)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of dry runs')
+    parser.add_argument('-c', '--code', default='read()',
+                        help='script to simulate (default: %(default)s)')
+
+
+def measure(code, repeat):
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        session.runSimulation(code, quiet=True)
+        times.append(perf_counter() - started)
+    return times
+
+
+def run(opts):
+    setups = opts.setup or ['system']
+    session.__class__ = Session
+    session.__init__('benchmark')
+    for handler in session.log.handlers:
+        handler.setLevel(logging.ERROR + 10)
+    try:
+        session.loadSetup(setups)
+        config.simulation_template = False
+        fresh = measure(opts.code, opts.repeat)
+        config.simulation_template = True
+        started = perf_counter()
+        if not session.getSimulationTemplate().wait(120):
+            raise SystemExit('the simulation template could not be started')
+        warmup = perf_counter() - started
+        forked = measure(opts.code, opts.repeat)
+    finally:
+        session.shutdown()
+    report('Dry run latency of %r with setups %s' %
+           (opts.code, ', '.join(setups)),
+           [('new process, median', 1000. * percentile(fresh, 50), 'ms'),
+            ('new process, max', 1000. * max(fresh), 'ms'),
+            ('template startup', 1000. * warmup, 'ms'),
+            ('forked template, median', 1000. * percentile(forked, 50), 'ms'),
+            ('forked template, max', 1000. * max(forked), 'ms'),
+            ('speedup (median)',
+             percentile(fresh, 50) / percentile(forked, 50), 'x')])
@@ -76,6 +76,9 @@ devices = dict(
     dev4 = device('test.test_simple.test_device.Dev4',
         intparam = 42.,
     ),
+    dev5 = device('test.test_simple.test_device.Dev5',
+        reconf = 2,
+    ),
     bus = device('test.test_simple.test_device.Bus',
         comtries = 3,
         comdelay = 0,
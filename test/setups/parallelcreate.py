@@ -0,0 +1,40 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+name = 'parallel device creation test'
+
+devices = dict(
+    slow1 = device('test.test_simple.test_session.SlowDevice'),
+    slow2 = device('test.test_simple.test_session.SlowDevice'),
+    slow3 = device('test.test_simple.test_session.SlowDevice'),
+    slow4 = device('test.test_simple.test_session.SlowDevice'),
+    top = device('test.test_simple.test_session.SlowDevice',
+        attached = ['slow1', 'slow2'],
+    ),
+    lookup = device('test.test_simple.test_session.LookupDevice',
+        lookup = 'late',
+    ),
+    late = device('test.test_simple.test_session.SlowDevice'),
+)
@@ -0,0 +1,109 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the columnar history archive of the flatfile cache
+database."""
+
+import random
+
+import numpy as np
+
+from nicos.services.cache.database import archive
+
+
+def write_store(filename, records):
+    with open(filename, 'w', encoding='utf-8') as fp:
+        fp.write('# NICOS cache store file v2\n')
+        for key, time, value in records:
+            fp.write('%s\t%r\t+\t%s\n' % (key, time, value))
+
+
+def reference_buckets(times, values, interval):
+    buckets = {}
+    for t, v in zip(times, values):
+        if not np.isnan(v):
+            buckets.setdefault(np.floor(t / interval) * interval, []).append(v)
+    return {start: (min(vs), max(vs), sum(vs) / len(vs), len(vs))
+            for (start, vs) in buckets.items()}
+
+
+def test_pyramid_levels():
+    rnd = random.Random(1)
+    times = np.array(sorted(rnd.uniform(0, 20000) for _ in range(5000)))
+    values = np.array([rnd.choice([np.nan, rnd.gauss(0, 1)])
+                       for _ in range(5000)])
+    rows = archive.bucketize(times, values, archive.LEVELS[0])
+    for level in archive.LEVELS:
+        rows = archive.merge(rows, level)
+        ref = reference_buckets(times, values, level)
+        assert sorted(ref) == rows[archive.START].tolist()
+        for row in rows.T:
+            vmin, vmax, mean, count = ref[row[archive.START]]
+            assert row[archive.VMIN] == vmin
+            assert row[archive.VMAX] == vmax
+            assert abs(row[archive.MEAN] - mean) < 1e-9
+            assert row[archive.COUNT] == count
+            # the times belong to the extreme values
+            assert values[times == row[archive.TMIN]][0] == vmin
+            assert values[times == row[archive.TMAX]][0] == vmax
+
+
+def test_points():
+    rows = archive.bucketize(np.array([1., 2., 3., 11., 12.]),
+                             np.array([5., 1., 3., 2., 2.]), 10)
+    assert archive.points(rows, 10) == \
+        [(1., 5.), (2., 1.), (11., 2.), (12., 2.)]
+    assert archive.points(rows, 10, 'mean') == [(5., 3.), (15., 2.)]
+    # non-numeric values: the last value of every bucket
+    assert archive.reduce_records(
+        [(1., "'a'"), (2., "'b'"), (11., "'c'")], 10) == \
+        [(2., "'b'"), (11., "'c'")]
+
+
+def test_compact_and_query(tmp_path):
+    rnd = random.Random(2)
+    records = []
+    for i in range(3000):
+        records.append(('value', 1000 + i * 2.5, repr(rnd.gauss(0, 1))))
+        records.append(('status', 1000 + i * 2.5, "(200, 'idle')"))
+    records.append(('value', 9000, '-'))
+    filename = str(tmp_path / 'store')
+    write_store(filename, records)
+    archdir = str(tmp_path / 'archive')
+    assert archive.compact(filename, archdir) == 1
+    assert archive.query(archdir, 'status', 0, 10000, 60) is None
+
+    times = np.array([r[1] for r in records if r[0] == 'value'])
+    values = np.array([archive.parse_value(r[2])
+                       for r in records if r[0] == 'value'])
+    # with intervals that are multiples of the pyramid levels and aligned
+    # ranges, the pyramids give the same result as downsampling the raw data
+    for interval in (5, 60, 600, 7200):
+        for fromtime, totime in ((0, 20000), (7200, 14400)):
+            inrange = (times >= fromtime) & (times <= totime)
+            expected = archive.points(
+                archive.bucketize(times[inrange], values[inrange], interval),
+                interval)
+            assert archive.query(archdir, 'value', fromtime, totime,
+                                 interval) == expected
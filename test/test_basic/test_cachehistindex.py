@@ -0,0 +1,99 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the history index of the flatfile cache database."""
+
+import random
+
+from nicos.services.cache.database.histindex import StoreFileIndex
+
+
+def reference_select(records, subkey, fromtime, totime):
+    # the record selection done by reading the whole file
+    result = []
+    last = None
+    for i, (key, time, value) in enumerate(records):
+        if key != subkey:
+            continue
+        if fromtime <= time <= totime:
+            result.append(i)
+        elif not result and value != '-' and time < fromtime:
+            last = i
+    if last is not None:
+        result.insert(0, last)
+    return [(records[i][1], records[i][2].replace('-', '')) for i in result]
+
+
+def write_store(filename, records):
+    with open(filename, 'w', encoding='utf-8') as fp:
+        fp.write('# NICOS cache store file v2\n')
+        for key, time, value in records:
+            fp.write('%s\t%r\t+\t%s\n' % (key, time, value))
+
+
+def test_histindex(tmp_path):
+    rnd = random.Random(1)
+    for ordered in (True, False):
+        records = []
+        time = 1000.
+        for i in range(2000):
+            time += rnd.random()
+            records.append((rnd.choice(['value', 'status', 'target']),
+                            time if ordered else rnd.uniform(1000, 2000),
+                            rnd.choice(['-', str(i), "'a b'"])))
+        filename = str(tmp_path / 'store')
+        write_store(filename, records)
+        index = StoreFileIndex(filename)
+        assert index.update()
+        assert not index.update()
+        for _ in range(50):
+            fromtime = rnd.uniform(900, 2100)
+            totime = fromtime + rnd.uniform(-10, 500)
+            for subkey in ('value', 'status', 'nonexisting'):
+                assert list(index.read(index.select(subkey, fromtime,
+                                                    totime))) == \
+                    reference_select(records, subkey, fromtime, totime)
+
+        # saving and loading
+        index.save(str(tmp_path / 'index'))
+        loaded = StoreFileIndex.load(filename, str(tmp_path / 'index'))
+        assert loaded.select('value', 1000, 1500) == \
+            index.select('value', 1000, 1500)
+
+
+def test_histindex_incremental(tmp_path):
+    filename = str(tmp_path / 'store')
+    write_store(filename, [('value', 1.0, '1'), ('value', 2.0, '2')])
+    with open(filename, 'a', encoding='utf-8') as fp:
+        # incomplete line: not indexed yet
+        fp.write('value\t3.0\t+\t3')
+    index = StoreFileIndex(filename)
+    index.update()
+    assert list(index.read(index.select('value', 0, 10))) == \
+        [(1.0, '1'), (2.0, '2')]
+    with open(filename, 'a', encoding='utf-8') as fp:
+        fp.write('\nvalue\t4.0\t+\t4\n')
+    assert index.update()
+    assert list(index.read(index.select('value', 2.5, 10))) == \
+        [(2.0, '2'), (3.0, '3'), (4.0, '4')]
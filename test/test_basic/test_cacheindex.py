@@ -0,0 +1,88 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the cache server key and subscription indexes."""
+
+import random
+
+from nicos.services.cache.index import KeyIndex, SubscriptionMatcher
+
+
+def make_keys(rnd, n):
+    parts = ['nicos', 'sim', 'dev', 'mot1', 'mot2', 'det', 'value', 'status',
+             'target', 'x', 'devx', 'nicos_x']
+    keys = set()
+    while len(keys) < n:
+        keys.add('/'.join(rnd.choice(parts)
+                          for _ in range(rnd.randint(1, 4))))
+    return sorted(keys)
+
+
+def test_keyindex():
+    rnd = random.Random(42)
+    keys = make_keys(rnd, 300)
+    index = KeyIndex()
+    for key in keys:
+        index.add(key)
+    index.add(keys[0])
+    assert len(index) == len(keys)
+    patterns = ['', '/', 'nicos/', 'nicos/dev/', '/value', 'v/value', 'x/',
+                'dev', 's/d', 'os/mot1/sta', 'nonexisting/', 'mot2/']
+    patterns += [key[rnd.randint(0, len(key)):][:rnd.randint(1, 12)]
+                 for key in keys[:100]]
+    for pattern in patterns:
+        assert sorted(index.match(pattern)) == \
+            [key for key in keys if pattern in key], pattern
+
+    for key in keys[::2]:
+        index.discard(key)
+    keys = keys[1::2]
+    for pattern in patterns:
+        assert sorted(index.match(pattern)) == \
+            [key for key in keys if pattern in key], pattern
+    index.clear()
+    assert index.match('nicos/') == []
+
+
+def test_subscriptions():
+    matcher = SubscriptionMatcher()
+    matcher.subscribe('c1', 'nicos/', False)
+    matcher.subscribe('c2', 'nicos/mot/', True)
+    matcher.subscribe('c2', 'nicos/', False)
+    matcher.subscribe('c3', 'value', True)
+
+    assert dict(matcher.match('nicos/mot/value')) == \
+        {'c1': False, 'c2': True, 'c3': True}
+    assert dict(matcher.match('nicos/det/status')) == \
+        {'c1': False, 'c2': False}
+    assert matcher.match('other/key') == ()
+
+    # cached results are invalidated on changes
+    matcher.unsubscribe('c2', 'nicos/mot/', True)
+    assert dict(matcher.match('nicos/mot/value')) == \
+        {'c1': False, 'c2': False, 'c3': True}
+    matcher.unsubscribe('c2', 'unknown/', False)
+    matcher.remove_client('c1')
+    assert dict(matcher.match('nicos/mot/value')) == \
+        {'c2': False, 'c3': True}
@@ -0,0 +1,154 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the cache protocol helpers."""
+
+import random
+
+import pytest
+
+from nicos.protocols.cache import COMPACT_TAG, ValueDecoder, cache_dump, \
+    cache_load, compact_dump, msg_pattern, opkeys, parse_msg
+
+
+def regex_parse(line):
+    match = msg_pattern.match(line)
+    return match.groups() if match else None
+
+
+@pytest.mark.parametrize('line', [
+    # common forms
+    '1327504784.71+5@nicos/temp/value=5.003',
+    '1327504784.71-1327504789.71@nicos/temp/value=5.003',
+    '1327504784.71@nicos/temp/value=5.003',
+    '+5@nicos/temp/value=1.102',
+    '@nicos/temp/value?',
+    'nicos/temp/setpoint=5',
+    'nicos/temp/value=',
+    'nicos/temp/value!',
+    'nicos/temp/*',
+    '@nicos/:',
+    'nicos/lock$+client',
+    'nicos/t~nicos/tcryo',
+    'nicos/temp/value#=1',
+    "nicos/mot/status=(200, 'moving: x=1')",
+    # unusual forms handled by the regex
+    '  12 + 5 @ nicos/key = value  ',
+    '1e5@key=1',
+    '1+1e-5@key=1',
+    '1.2.3@key=1',
+    '.5@key=1',
+    '12@34@key=1',
+    'key=\n',
+    'key=a\nb',
+    'key=\r\n',
+    '٣@key=1',
+    '1\xa0@key=1',
+    '@=',
+    '+@key=1',
+    '1-@key=1',
+    '',
+    '@',
+    'no operator',
+])
+def test_parse_msg(line):
+    assert parse_msg(line) == regex_parse(line)
+
+
+def test_parse_msg_fuzz():
+    rnd = random.Random(4711)
+    alphabet = list('0123456789.+-eE@ \t\r\nkey/#' + opkeys) + \
+        ['\xa0', '٣', '\xb2']
+    for _ in range(20000):
+        line = ''.join(rnd.choice(alphabet)
+                       for _ in range(rnd.randint(0, 15)))
+        assert parse_msg(line) == regex_parse(line), line
+
+    def number():
+        return rnd.choice(['', '1', '12.', '3.25', '1e5', '.5', ' 7 '])
+
+    for _ in range(20000):
+        line = '%s%s%s%s%snicos/dev/key%s%s%s' % (
+            number(), rnd.choice(['', '+', '-', ' - ']), number(),
+            rnd.choice(['', '@', ' @ ']), rnd.choice(['', ' ']),
+            rnd.choice(['', '#', ' ']), rnd.choice(opkeys),
+            rnd.choice(['', '1.5', "('a', 'b=c')", ' x ', 'a\nb']))
+        assert parse_msg(line) == regex_parse(line), line
+
+
+def check_types(a, b):
+    assert type(a) is type(b)
+    if isinstance(a, (list, tuple)):
+        for (x, y) in zip(a, b):
+            check_types(x, y)
+    elif isinstance(a, dict):
+        for k in a:
+            check_types(a[k], b[k])
+
+
+@pytest.mark.parametrize('value', [
+    (200, 'idle'),
+    [1.5, -2, 1e300, float('inf')],
+    [[1, 2], (3, [4.0])],
+    {'a': [1, 2], 2: {'b': None}},
+    frozenset([1, 'x', (2, 3)]),
+    (b'bytes', 1j, True, None, 'unicode ä'),
+    {},
+])
+def test_compact_encoding(value):
+    pyon = cache_dump(value)
+    compact = compact_dump(cache_load(pyon))
+    assert compact.startswith(COMPACT_TAG)
+    assert '\n' not in compact
+    decoded = cache_load(compact)
+    assert decoded == cache_load(pyon)
+    # the same (readonly) types as with PyON
+    check_types(decoded, cache_load(pyon))
+    # (the order of set elements in the PyON string is not deterministic)
+    assert cache_load(cache_dump(decoded)) == decoded
+
+
+def test_compact_encoding_unsupported():
+    with pytest.raises(ValueError):
+        compact_dump(object())
+
+
+def test_value_decoder():
+    decode = ValueDecoder(maxsize=2)
+    first = decode('(200, "idle")')
+    assert first == (200, 'idle')
+    assert decode('(200, "idle")') is first
+    assert (decode.hits, decode.misses) == (1, 1)
+    decode('[1]')
+    decode('[2]')
+    # the oldest entry was dropped
+    assert decode('(200, "idle")') is not first
+    assert decode.misses == 4
+    # pickled objects can be mutable and are not memoized
+    pickled = cache_dump(PickledValue())
+    assert decode(pickled) is not decode(pickled)
+
+
+class PickledValue:
+    pass
@@ -0,0 +1,208 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the daemon protocol serializers and framing."""
+
+import logging
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from nicos.clients.proto.classic import ClientTransport
+from nicos.core.constants import LIVE
+from nicos.protocols.daemon.classic import SERIALIZERS
+from nicos.services.daemon.handler import ConnectionHandler
+from nicos.services.daemon.proto.classic import ServerTransport
+from nicos.services.daemon.utils import SizedQueue, coalescingKey
+from nicos.utils import byteBuffer, closeSocket, readonlylist
+
+PAYLOADS = [
+    None,
+    'Meßzeit 1000s, d = 5 Å',
+    [1, 2.5, True, None],
+    {'status': (200, 'idle'), 'setups': [['a'], ['b']], 1: 'int key'},
+    {'big': 2**70, 'bytes': b'\x00\xff', 'nested': [(1, (2, 3))]},
+    readonlylist([1, 2]),
+]
+
+# JSON converts tuples to lists and dictionary keys to strings
+LOSSLESS = [name for name in sorted(SERIALIZERS) if name != 'json']
+
+
+@pytest.mark.parametrize('name', LOSSLESS)
+@pytest.mark.parametrize('payload', PAYLOADS)
+def test_roundtrip(name, payload):
+    serializer = SERIALIZERS[name]()
+    data = serializer.serialize_event('cache', payload)
+    assert serializer.deserialize_event(bytearray(data), 'cache') == \
+        ('cache', payload)
+    data = serializer.serialize_ok_reply(payload)
+    assert serializer.deserialize_reply(data, True) == (True, payload)
+    data = serializer.serialize_cmd('queue', ('name', payload))
+    assert serializer.deserialize_cmd(data, 'queue')[1][1] == payload
+
+
+def test_msgpack_types():
+    if 'msgpack' not in SERIALIZERS:
+        pytest.skip('msgpack not available')
+    serializer = SERIALIZERS['msgpack']()
+    payload = {'status': (200, 'idle'), 'value': np.float64(1.5)}
+    data = serializer.serialize_event('cache', payload)
+    _, result = serializer.deserialize_event(data, 'cache')
+    # unlike with JSON, tuples and other types are preserved
+    assert isinstance(result['status'], tuple)
+    assert isinstance(result['value'], np.float64)
+    # and the encoding is more compact than with pickle
+    assert len(data) < len(SERIALIZERS['classic']().serialize_event(
+        'cache', payload))
+
+
+@pytest.mark.parametrize('name', sorted(SERIALIZERS))
+def test_determine_serializer(name):
+    banner = dict(daemon_version='3.0', protocol_version=21,
+                  pw_hashing='rsa,plain', rsakey=b'key', serializer=name)
+    data = SERIALIZERS[name]().serialize_ok_reply(banner)
+    assert ClientTransport().determine_serializer(data, True).name == name
+
+
+@pytest.mark.parametrize('name', sorted(SERIALIZERS))
+def test_event_blobs(name):
+    serializer = SERIALIZERS[name]()
+    arrays = [np.arange(512 * 512, dtype='<u4').reshape((512, 512)),
+              np.array([], dtype='<u1'),
+              np.arange(10, dtype='<f8')]
+    params = dict(uid='uid', det='det', time=1.5,
+                  datadescs=[dict(dtype='<u4', shape=(512, 512), count=1)])
+    server_sock, client_sock = socket.socketpair()
+    # only the event socket is needed for sending events
+    handler = ServerTransport.__new__(ServerTransport)
+    handler.event_sock = server_sock
+    client = ClientTransport(serializer)
+    client.event_sock = client_sock
+    try:
+        # the client must read while the server sends, the blobs do not fit
+        # into the socket buffers
+        sender = threading.Thread(target=handler.send_events, args=([
+            ('livedata', serializer.serialize_event('livedata', params),
+             [byteBuffer(arr) for arr in arrays]),
+            ('cache', serializer.serialize_event('cache', (1, 'x', '=', 2)),
+             [])],))
+        sender.start()
+        event, data, blobs = client.recv_event()
+        assert event == 'livedata'
+        assert data['uid'] == 'uid'
+        assert [b.tobytes() for b in blobs] == [a.tobytes() for a in arrays]
+        assert (np.frombuffer(blobs[0], '<u4').reshape((512, 512)) ==
+                arrays[0]).all()
+        event, data, blobs = client.recv_event()
+        assert event == 'cache'
+        assert list(data) == [1, 'x', '=', 2]
+        assert blobs == []
+        sender.join()
+    finally:
+        closeSocket(server_sock)
+        closeSocket(client_sock)
+
+
+def test_coalescing_key():
+    assert coalescingKey('cache', (1, 'nicos/mot/value', '=', '1'), []) == \
+        ('cache', 'nicos/mot/value')
+    params = dict(uid='uid', det='det', tag=LIVE, time=0, datadescs=[])
+    assert coalescingKey('livedata', params, [b'data']) == ('livedata', 'det')
+    # file name notifications are never replaced
+    assert coalescingKey('livedata', dict(params, tag='file'), []) is None
+    assert coalescingKey('message', ['nicos', 0, 20, 'msg'], []) is None
+
+
+def test_sized_queue():
+    q = SizedQueue(1000)
+    q.put(('cache', b'12', [], ('cache', 'a')))
+    q.put(('message', b'123', [], None))
+    q.put(('cache', b'1234', [], ('cache', 'a')))
+    q.put(('cache', b'1', [], ('cache', 'b')))
+    assert q.nbytes == 4 + 1 + 3 + 1 + 1 + 1
+    assert q.coalesced == 1
+    # the newer item replaces the older one at its place in the queue
+    assert q.get(False)[1] == b'1234'
+    assert q.get(False)[1] == b'123'
+    q.put(('cache', b'12', [], ('cache', 'a')))
+    assert q.get(False)[1] == b'1'
+    assert q.get(False)[1] == b'12'
+    assert q.nbytes == 0
+    assert not q.pending
+
+
+class RecordingHandler(ConnectionHandler):
+    """Connection handler only recording the sent events."""
+
+    def __init__(self, eventrates):
+        daemon = SimpleNamespace(_controller=None, eventrates=eventrates,
+                                 log=logging.getLogger('test'))
+        ConnectionHandler.__init__(self, daemon)
+        self.batches = []
+
+    def send_events(self, events):
+        self.batches.append(events)
+
+
+def test_event_sender():
+    handler = RecordingHandler({'cache': 5})
+    q = handler.event_queue
+    # all queued events are sent together
+    for i in range(5):
+        q.put(('message', b'%d' % i, [], None))
+    handler.event_mask.add('watch')
+    q.put(('watch', b'', [], None))
+    # the cache keys are limited to 5 updates per second
+    for i in range(5):
+        q.put(('cache', b'%d' % i, [], ('cache', 'a')))
+    q.put(('cache', b'x', [], ('cache', 'b')))
+    handler.close()
+    handler.event_sender()
+    assert handler.batches == [
+        [('message', b'%d' % i, []) for i in range(5)] +
+        [('cache', b'4', []), ('cache', b'x', [])]]
+    assert handler.event_stats()['coalesced'] == 4
+
+    handler = RecordingHandler({'cache': 5})
+    thread = threading.Thread(target=handler.event_sender)
+    thread.start()
+    try:
+        for i in range(10):
+            handler.event_queue.put(('cache', b'%d' % i, [], ('cache', 'a')))
+            time.sleep(0.02)
+        time.sleep(0.3)
+    finally:
+        handler.close()
+        thread.join()
+    # the first update is sent immediately, the last one 0.2 s later, the
+    # others are replaced by newer ones
+    sent = [event[1] for batch in handler.batches for event in batch]
+    assert sent[0] == b'0'
+    assert sent[-1] == b'9'
+    assert len(sent) < 5
@@ -0,0 +1,148 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS tests for the persistent setup info cache."""
+
+import logging
+import os
+from os import path
+
+import pytest
+
+from nicos.core.sessions.setupcache import SetupCache
+from nicos.core.sessions.setups import readSetups
+
+from test.utils import module_root
+
+log = logging.getLogger('test')
+
+CONFIG = '''
+group = 'configdata'
+SPEED = %r
+'''
+
+SETUP = '''
+description = 'setup %s'
+devices = dict(
+    m = device('nicos.devices.generic.VirtualMotor',
+               speed = configdata('config.SPEED'),
+               abslimits = (0, 10), unit = 'mm'),
+)
+'''
+
+
+def write(filename, content):
+    with open(filename, 'w', encoding='utf-8') as fp:
+        fp.write(content)
+
+
+@pytest.fixture
+def setupdir(tmpdir):
+    setupdir = str(tmpdir.mkdir('setups'))
+    write(path.join(setupdir, 'config.py'), CONFIG % 1.0)
+    write(path.join(setupdir, 'motor.py'), SETUP % 'motor')
+    write(path.join(setupdir, 'plain.py'), 'description = "plain"\n')
+    return setupdir
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return SetupCache(str(tmpdir.join('cache', 'setupinfo.pickle')))
+
+
+def read(paths, cache):
+    cache.hits = cache.misses = 0
+    return readSetups(paths, log, cache)
+
+
+def test_same_info():
+    paths = [path.join(module_root, 'test', 'setups')]
+    uncached = readSetups(paths, log, False)
+    cache = SetupCache(path.join(module_root, 'test', 'root', 'setupcache',
+                                 'test_same_info.pickle'))
+    cache.clear()
+    for _ in range(2):
+        # first run fills the cache, second run reads from it
+        assert repr(read(paths, cache)) == repr(uncached)
+    assert cache.misses == 0
+    assert cache.hits == len(uncached)
+
+
+def test_changes(setupdir, cache):
+    info = read([setupdir], cache)
+    assert cache.misses == 3
+    assert info['motor']['devices']['m'][1]['speed'] == 1.0
+    assert info['motor']['filenames'] == [path.join(setupdir, 'motor.py'),
+                                          path.join(setupdir, 'config.py')]
+
+    assert read([setupdir], cache) == info
+    assert cache.hits == 3
+
+    # a touched file is still valid
+    os.utime(path.join(setupdir, 'plain.py'), (0, 0))
+    assert read([setupdir], cache) == info
+    assert cache.hits == 3
+    # ... and not hashed again the next time
+    assert read([setupdir], cache) == info
+    assert cache.hits == 3
+
+    # change of a setup and of a file used by configdata
+    write(path.join(setupdir, 'plain.py'), 'description = "changed"\n')
+    write(path.join(setupdir, 'config.py'), CONFIG % 2.0)
+    info = read([setupdir], cache)
+    assert cache.misses == 3
+    assert info['plain']['description'] == 'changed'
+    assert info['motor']['devices']['m'][1]['speed'] == 2.0
+
+    # removed setups are dropped from the cache
+    os.unlink(path.join(setupdir, 'plain.py'))
+    assert 'plain' not in read([setupdir], cache)
+    assert path.join(setupdir, 'plain.py') not in cache.entries
+
+
+def test_configdata_overridden(setupdir, tmpdir, cache):
+    read([setupdir], cache)
+    # config setup now found in a later path
+    otherdir = str(tmpdir.mkdir('other'))
+    write(path.join(otherdir, 'config.py'), CONFIG % 3.0)
+    info = read([setupdir, otherdir], cache)
+    assert info['motor']['devices']['m'][1]['speed'] == 3.0
+    assert cache.hits == 1  # the plain setup
+
+
+def test_unpicklable(setupdir, cache):
+    write(path.join(setupdir, 'func.py'), 'extended = dict(f=lambda: 1)\n')
+    read([setupdir], cache)
+    info = read([setupdir], cache)
+    assert cache.misses == 1
+    assert info['func']['extended']['f']() == 1
+
+
+def test_broken_cache(setupdir, cache):
+    info = read([setupdir], cache)
+    write(cache.filename, 'garbage')
+    assert read([setupdir], cache) == info
+    assert cache.misses == 3
+    assert read([setupdir], cache) == info
+    assert cache.hits == 3
@@ -29,6 +29,7 @@ import os
 import pickle
 import socket
 import sys
+import threading
 import time
 from datetime import timedelta
 
@@ -40,8 +41,8 @@ from nicos.utils import TB_CAUSE_MSG, Repeater, allDays, bitDescription, \
     formatDuration, formatExtendedFrame, formatExtendedStack, \
     formatExtendedTraceback, lazy_property, moveOutOfWay, num_sort, \
     parseConnectionString, parseDuration, readonlydict, readonlylist, \
-    safeName, safeWriteFile, squeeze, tcpSocket, timedRetryOnExcept, \
-    tupelize
+    safeName, safeWriteFile, sendBuffers, squeeze, tcpSocket, \
+    timedRetryOnExcept, tupelize
 from nicos.utils.timer import Timer
 
 from test.utils import raises
@@ -235,6 +236,50 @@ def test_tcpsocket(serversocket):
                 closeSocket(sock)
 
 
+class PartialSocket:
+    """Socket that only sends a few bytes with every call."""
+
+    def __init__(self):
+        self.data = b''
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(buffers)[:5]
+        self.data += data
+        return len(data)
+
+
+def test_send_buffers():
+    buffers = [b'abc', b'', memoryview(b'defghijk'), bytearray(b'lmn')]
+    sock = PartialSocket()
+    sendBuffers(sock, buffers)
+    assert sock.data == b'abcdefghijklmn'
+    assert sock.calls == 3
+
+    a, b = socket.socketpair()
+    try:
+        blob = bytes(range(256)) * 4096
+
+        def send():
+            sendBuffers(a, [b'head', memoryview(blob)])
+            a.shutdown(socket.SHUT_WR)
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        received = b''
+        while True:
+            data = b.recv(65536)
+            if not data:
+                break
+            received += data
+        sender.join()
+        assert received == b'head' + blob
+    finally:
+        closeSocket(a)
+        closeSocket(b)
+
+
 def test_timer():
     t = time.time()
 
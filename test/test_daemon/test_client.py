@@ -22,6 +22,8 @@
 #
 # *****************************************************************************
 
+import time
+
 import pytest
 
 from nicos import nicos_version
@@ -65,6 +67,7 @@ def test_simple(client, simple_mode):
     assert status['watch'] == {}                      # no watch expressions
     assert status['setups'][1] == ['stdsystem']       # explicit setups
     assert status['requests'] == []                   # no requests queued
+    assert status['eventstats']['sent'] > 0           # events sent so far
 
     # queue/unqueue/emergency
     client.run('sleep 0.1')
@@ -126,6 +129,26 @@ def test_simulation(client):
             return
 
 
+def test_gethistory(client):
+    load_setup(client, 'daemontest')
+    now = time.time()
+    client.run_and_wait('''\
+from nicos import session
+for i in range(5):
+    session.cache.put('histtest', 'a', i, time=%r + i)
+    session.cache.put('histtest', 'b', -i, time=%r + i)
+session.cache.flush()
+''' % (now - 10, now - 10))
+    client.wait_idle()
+    # (including the last value before the range)
+    hist_a = [[now - 10 + i, i] for i in range(1, 5)]
+    hist_b = [[now - 10 + i, -i] for i in range(1, 5)]
+    assert client.ask('gethistory', 'histtest/a', str(now - 8.5),
+                      str(now)) == hist_a
+    assert client.ask('gethistory', 'histtest/a,histtest/b', str(now - 8.5),
+                      str(now)) == [hist_a, hist_b]
+
+
 def test_dualaccess(client, adminclient):
     load_setup(client, 'daemontest')
     adminclient.run('fix(dm2, "test")', 'adminfix')
@@ -26,19 +26,36 @@
 
 """Tests for the cache."""
 
-from time import sleep
+import shutil
+import socket
+from os import path
+from threading import Timer
+from time import mktime, sleep, time
 
 import pytest
 
+from nicos.core import status
 from nicos.core.errors import CommunicationError, LimitError
+from nicos.core.utils import DeviceWaiter
 from nicos.devices.cacheclient import CacheClient
-from nicos.utils import readonlydict, readonlylist
+from nicos.protocols.cache import FLAG_NO_STORE, OP_ASK, OP_LOCK, \
+    SYNC_MARKER, cache_dump
+from nicos.services.cache.database.follower import FollowerCacheDatabase, \
+    PrimaryConnection
+from nicos.utils import ensureDirectory, readonlydict, readonlylist
 
-from test.utils import cache_addr, raises
+from test.utils import cache_addr, raises, runtime_root
 
 session_setup = 'cachetests'
 
 
+class UnconnectedClient(CacheClient):
+    """Cache client that leaves its send queue alone."""
+
+    def _worker_thread(self):
+        pass
+
+
 class TestCache:
 
     def test_float_literals(self, session):
@@ -117,6 +134,62 @@ class TestCache:
         assert cachedval5[2] == testval3
         assert cachedval6[2] == cachedval5[2]
 
+    def test_get_many(self, session):
+        cc = session.cache
+        cc.put('testcache', 'many1', 1, ttl=100)
+        cc.put('testcache', 'many2', 'two')
+        cc.flush()
+        result = cc.get_many(['testcache/many1', 'TestCache/Many2',
+                              'testcache/nonexisting'], Ellipsis)
+        assert result[0] == cc.get_explicit('testcache', 'many1')
+        assert result[0][1:] == (100, 1)
+        assert result[1][2] == 'two'
+        assert result[2] == (None, None, Ellipsis)
+        assert cc.get_many([]) == []
+
+    def test_device_bulk(self, session):
+        cc = session.cache
+        cc2 = CacheClient(name='cache2', prefix='nicos/', cache=cache_addr)
+        try:
+            cc2.waitForStartup(1)
+            cc.put_many('bulkdev', [('Value', 1), ('status', (200, 'ok'))])
+            cc.flush()
+            assert cc.get_device('bulkdev', ['value', 'Status', 'missing'],
+                                 Ellipsis) == {'value': 1,
+                                               'Status': (200, 'ok'),
+                                               'missing': Ellipsis}
+            assert cc.get_explicit('bulkdev', 'status')[2] == (200, 'ok')
+            for _ in range(50):
+                if cc2.get('bulkdev', 'value') == 1:
+                    break
+                sleep(0.1)
+            assert cc2.get_device('bulkdev', ['value', 'status']) == \
+                {'value': 1, 'status': (200, 'ok')}
+        finally:
+            cc2.shutdown()
+
+    def test_changes(self, session):
+        cc = session.cache
+
+        def changes(since=None):
+            version, values = cc.get_changes(since)
+            return version, {key: value for (key, value) in values.items()
+                             if key.startswith('changedev/')}
+
+        cc.put('changedev', 'value', 1)
+        version, values = changes()
+        assert values == {'changedev/value': 1}
+        assert changes(version)[1] == {}
+        cc.put('changedev', 'value', 2)
+        cc.put('changedev', 'status', (200, 'ok'))
+        cc.put('changedev', 'value', 3)
+        cc.delete('changedev', 'status')
+        version2, values = changes(version)
+        assert version2 > version
+        # deleted keys are included as Ellipsis
+        assert values == {'changedev/value': 3, 'changedev/status': Ellipsis}
+        assert changes(version2)[1] == {}
+
     def test_readonly_objects(self, session):
         cc = session.cache
         testval1 = readonlylist(('A', 'B', 'C'))
@@ -157,6 +230,273 @@ class TestCache:
         assert type(rod[2]['A']) == type(testval1)
         assert type(rod[2]['B']) == type(testval2)
 
+    def test_history(self, session):
+        cc = session.cache
+        now = time()
+        for i in range(10):
+            cc.put('testcache', 'hist', i, time=now - 10 + i)
+            cc.put('testcache', 'other', -i, time=now - 10 + i)
+        cc.flush()
+        assert cc.history('testcache', 'hist', now - 5.5, now) == \
+            [(now - 10 + i, i) for i in range(4, 10)]
+        # if nothing is in the range, the last value before is returned
+        assert cc.history('testcache', 'hist', now + 1, now + 2) == \
+            [(now - 1, 9)]
+
+    def test_history_many(self, session):
+        cc = session.cache
+        now = time()
+        for i in range(10):
+            cc.put('testcache', 'hist1', i, time=now - 10 + i)
+            cc.put('testcache', 'hist2', -i, time=now - 10 + i)
+        cc.flush()
+        keys = ['testcache/hist1', 'testcache/nonexisting', 'testcache/hist2']
+        histories = cc.history_many(keys, now - 5.5, now)
+        assert histories == [
+            [(now - 10 + i, i) for i in range(4, 10)],
+            [],
+            [(now - 10 + i, -i) for i in range(4, 10)],
+        ]
+        assert histories == [cc.history('', key, now - 5.5, now)
+                             for key in keys]
+        assert cc.history_many([], now - 5.5, now) == []
+
+    def test_history_downsampled(self, session):
+        cc = session.cache
+        start = (time() // 60 - 2) * 60
+        for i in range(60):
+            cc.put('testcache', 'down', i % 7, time=start + i)
+        cc.flush()
+        # the minimum and maximum of each bucket (and possibly the last value
+        # before the range from an earlier run)
+        hist = cc.history('testcache', 'down', start, start + 59, interval=30)
+        assert [h for h in hist if h[0] >= start] == \
+            [(start, 0), (start + 27, 6), (start + 35, 0), (start + 55, 6)]
+        hist = cc.history('testcache', 'down', start, start + 59,
+                          interval=30, mode='mean')
+        assert [h for h in hist if h[0] >= start] == \
+            [(start + 15, 85 / 30), (start + 45, 89 / 30)]
+
+    def test_history_downsampled_archive(self, session):
+        cc = session.cache
+        # a store file of a finished day that has no archive yet
+        start = mktime((2001, 2, 3, 12, 0, 0, 0, 0, -1))
+        daydir = path.join(runtime_root, 'cache', '2001', '02-03')
+        archdir = path.join(runtime_root, 'cache', '.archive', '2001',
+                            '02-03', 'nicos-testarchive')
+        shutil.rmtree(daydir, ignore_errors=True)
+        shutil.rmtree(archdir, ignore_errors=True)
+        ensureDirectory(daydir)
+        with open(path.join(daydir, 'nicos-testarchive'), 'w',
+                  encoding='utf-8') as fd:
+            fd.write('# NICOS cache store file v2\n')
+            for i in range(60):
+                fd.write('down\t%r\t+\t%d\n' % (start + i, i % 7))
+        expected = [(start, 0), (start + 27, 6), (start + 35, 0),
+                    (start + 55, 6)]
+        try:
+            # the first query is answered from the store file, while the
+            # archive is created in the background
+            assert cc.history('testarchive', 'down', start, start + 59,
+                              interval=30) == expected
+            for _ in range(100):
+                if path.isdir(archdir):
+                    break
+                sleep(0.05)
+            else:
+                pytest.fail('archive was not created')
+            assert cc.history('testarchive', 'down', start, start + 59,
+                              interval=30) == expected
+        finally:
+            shutil.rmtree(daydir, ignore_errors=True)
+            shutil.rmtree(archdir, ignore_errors=True)
+
+    def test_compact_encoding(self, session):
+        cc = session.cache
+        assert cc._encoding == 'compact'
+        cc2 = CacheClient(name='cache2', prefix='nicos', cache=cache_addr,
+                          encoding='pyon')
+        try:
+            assert cc2._encoding == 'pyon'
+            value = {'a': [1, (2.5, 'x')], 'b': frozenset([1])}
+            cc2.put('testcache', 'compact', value)
+            cc2.flush()
+            sleep(0.1)
+            assert cc.get('testcache', 'compact') == value
+            assert isinstance(cc.get('testcache', 'compact')['a'],
+                              readonlylist)
+            cc.put('testcache', 'compact2', [1, 2])
+            cc.flush()
+            sleep(0.1)
+            assert cc2.get('testcache', 'compact2') == [1, 2]
+        finally:
+            cc2.shutdown()
+
+    def test_value_memo(self, session):
+        cc = session.cache
+        cc2 = CacheClient(name='cache2', prefix='nicos', cache=cache_addr)
+        called = []
+
+        def callback(key, value, time):
+            called.append(value)
+
+        def put(value):
+            # unchanged values are only sent again with the no-store flag
+            cc2.put('testcache', 'memo', value, flag=FLAG_NO_STORE)
+            cc2.flush()
+            sleep(0.1)
+
+        cc.addCallback('testcache', 'memo', callback)
+        try:
+            put((200, 'idle'))
+            first = cc.get('testcache', 'memo')
+            unchanged = cc._stats['unchanged']
+            put((200, 'idle'))
+            # the decoded value is reused
+            assert cc.get('testcache', 'memo') is first
+            assert cc._stats['unchanged'] > unchanged
+            assert called == [(200, 'idle')] * 2
+            # optionally, callbacks are skipped for unchanged values
+            cc._setROParam('skipunchanged', True)
+            put((200, 'idle'))
+            put((220, 'busy'))
+            assert called == [(200, 'idle')] * 2 + [(220, 'busy')]
+            assert cc._stats['suppressed'] >= 1
+        finally:
+            cc._setROParam('skipunchanged', False)
+            cc.removeCallback('testcache', 'memo', callback)
+            cc2.shutdown()
+
+    def test_send_batches(self, session):
+        cc = UnconnectedClient(name='cache2', prefix='nicos', cache=cache_addr,
+                               sendbatch=1024)
+        try:
+            for i in range(100):
+                cc.put('dev', 'value', i, time=1)
+            # the batches are limited by the byte budget
+            counts = []
+            while not cc._queue.empty():
+                data, count = cc._get_batch()
+                assert data.count(b'\n') == count
+                assert len(data) < 1024 + 32
+                counts.append(count)
+            assert len(counts) == 3
+            assert sum(counts) == 100
+            assert cc._sendstats['messages'] == 100
+            assert cc._sendstats['coalesced'] == 0
+        finally:
+            cc.shutdown()
+
+    def test_send_coalesced(self, session):
+        cc = UnconnectedClient(name='cache2', prefix='nicos', cache=cache_addr,
+                               coalesce=True)
+        try:
+            cc.put('dev', 'value', 1, time=1)
+            cc.put('dev', 'status', (200, 'idle'), time=1)
+            cc.put('dev', 'value', 2, time=2, ttl=5)
+            # different flags are not coalesced
+            cc.put('dev', 'value', 3, time=3, flag=FLAG_NO_STORE)
+            cc.put('dev', 'value', 4, time=4)
+            # keys without the prefix are not coalesced
+            cc.put_raw('logbook/message', 'a', time=5)
+            cc.put_raw('logbook/message', 'b', time=6)
+            # other messages are barriers
+            cc._queue.put('%s%s\n' % (SYNC_MARKER, OP_ASK))
+            cc.put('dev', 'value', 5, time=7)
+            data, count = cc._get_batch()
+            assert count == 9
+            assert data.decode().splitlines() == [
+                '1@nicos/dev/status=%s' % cache_dump((200, 'idle')),
+                '3@nicos/dev/value#=3',
+                '4@nicos/dev/value=4',
+                '5@logbook/message=\'a\'',
+                '6@logbook/message=\'b\'',
+                '%s%s' % (SYNC_MARKER, OP_ASK),
+                '7@nicos/dev/value=5',
+            ]
+            assert cc._sendstats['coalesced'] == 2
+        finally:
+            cc.shutdown()
+
+    def test_wakeup(self, session):
+        cc = session.cache
+        cc2 = CacheClient(name='cache2', prefix='nicos/', cache=cache_addr)
+        try:
+            cc2.waitForStartup(1)
+            with DeviceWaiter(['wakedev'], 10) as waiter:
+                assert 'wakedev' in cc._wakeups
+                # updates from other processes wake up
+                waiter.delay = 10
+                timer = Timer(0.1, cc2.put, ('wakedev', 'status', (1, '')))
+                timer.start()
+                assert waiter.sleep() < 5
+                # ... and so do local updates from other threads
+                waiter.delay = 10
+                timer = Timer(0.1, cc.put, ('wakedev', 'status', (2, '')))
+                timer.start()
+                assert waiter.sleep() < 5
+                # but not updates by the waiting thread itself
+                waiter.delay = 0.2
+                cc.put('wakedev', 'value', 1)
+                assert waiter.sleep() >= 0.2
+            assert 'wakedev' not in cc._wakeups
+            # waiters for a single key ignore the other keys
+            with DeviceWaiter(['wakedev'], 10, 'status') as waiter:
+                assert 'wakedev/status' in cc._wakeups
+                waiter.delay = 0.2
+                timer = Timer(0.01, cc.put, ('wakedev', 'value', 2))
+                timer.start()
+                assert waiter.sleep() >= 0.2
+                waiter.delay = 10
+                timer = Timer(0.1, cc.put, ('wakedev', 'status', (3, '')))
+                timer.start()
+                assert waiter.sleep() < 5
+            assert 'wakedev/status' not in cc._wakeups
+        finally:
+            cc2.shutdown()
+
+    def test_waiter_cached_status(self, session):
+        class WaitDev:
+            busystates = (status.BUSY,)
+            checks = 0
+
+            def __str__(self):
+                return 'waitdev'
+
+            def isCompleted(self):
+                self.checks += 1
+                return False
+
+        dev = WaitDev()
+        cc2 = CacheClient(name='cache2', prefix='nicos/', cache=cache_addr)
+        try:
+            cc2.waitForStartup(1)
+            with DeviceWaiter([dev], 0.5) as waiter:
+                # no back-off with a cache
+                assert waiter.delay == 0.5
+                # the first check, and checks without new status from the
+                # cache, ask the device
+                assert not waiter.isCompleted(dev)
+                assert not waiter.isCompleted(dev)
+                assert dev.checks == 2
+                # a busy status from others is taken from the cache
+                cc2.put(dev, 'status', (status.BUSY, 'moving'))
+                assert waiter.sleep() < 0.5
+                assert not waiter.isCompleted(dev)
+                assert not waiter.isCompleted(dev)
+                assert dev.checks == 2
+                # ... but only while it is fresh
+                sleep(0.6)
+                assert not waiter.isCompleted(dev)
+                assert dev.checks == 3
+                # other states are always checked with the device
+                cc2.put(dev, 'status', (status.OK, 'idle'))
+                assert waiter.sleep() < 0.5
+                assert not waiter.isCompleted(dev)
+                assert dev.checks == 4
+        finally:
+            cc2.shutdown()
+
     def test_cache_reader(self, session, log):
         rd1 = session.getDevice('reader1')
         cc = session.cache
@@ -230,3 +570,26 @@ class TestCache:
             assert raises(LimitError, wrt1.move, 500)
         finally:
             cc2.shutdown()
+
+
+def test_follower_forward_timeout(session):
+    # a primary that accepts connections, but never answers
+    primary = socket.socket()
+    primary.bind(('localhost', 0))
+    primary.listen()
+    addr = 'localhost:%d' % primary.getsockname()[1]
+    db = FollowerCacheDatabase('followerdb', primary=addr, forwardtimeout=0.2)
+    db._primary = PrimaryConnection('followerdb_primary', cache=addr,
+                                    prefix='', lowlevel=True)
+    try:
+        db._primary._worker.start()
+        db._primary.waitForStartup(5)
+        started = time()
+        assert db.lock('lockkey', 'mine', started, None) == \
+            ['lockkey' + OP_LOCK + 'primary cache unreachable\n']
+        assert db.ask_hist('histkey', started - 100, started) == []
+        assert time() - started < 2
+    finally:
+        db._primary.shutdown()
+        db.shutdown()
+        primary.close()
@@ -28,11 +28,14 @@ import os
 import pickle
 import time
 from os import path
+from unittest import mock
 
 import pytest
 
 from nicos import config
 from nicos.commands.scan import scan
+from nicos.core.errors import ComputationError
+from nicos.devices.datasinks.special import SerializedSinkHandler
 from nicos.utils import readFile, updateFileCounter
 
 from test.utils import raises
@@ -271,3 +274,127 @@ class TestSinks:
         assert contents['experiment']['proposal'] == 'p1234'
         assert contents['measurement']['sample']['description']['name'] == \
             'mysample'
+
+    def test_pipelined_scan(self, session, log):
+        m = session.getDevice('motor2')
+        det = session.getDevice('det')
+        tdev = session.getDevice('tdev')
+        session.instrument._setROParam('pipelinescans', True)
+        try:
+            with log.assert_msg_matches(r'scan stage times: .*\(in the '
+                                        r'background'):
+                scan(m, 0, 1, 5, det, tdev, t=0.005)
+        finally:
+            session.instrument._setROParam('pipelinescans', False)
+
+        # all points have been handed to the sinks
+        dataset = session.experiment.data.getLastScans()[-1]
+        assert dataset.counter == 44
+        assert [point.number for point in dataset.subsets] == [1, 2, 3, 4, 5]
+        assert all(point.finished for point in dataset.subsets)
+        assert len(dataset.devvaluelists) == 5
+        calls = session.getDevice('testsink1')._handlers[0]._calls
+        assert calls == ['prepare', 'begin'] + ['addSubset'] * 5 + ['end']
+        calls = session.getDevice('testsink2')._handlers[0]._calls
+        assert calls[-1] == 'end'
+
+        scanfile = path.join(session.experiment.datapath, 'p1234_00000044.dat')
+        contents = readFile(scanfile)
+        assert len([line for line in contents
+                    if not line.startswith('#')]) == 5
+        assert contents[-1].startswith('### End of NICOS data file')
+
+    def test_async_sinks(self, session):
+        m = session.getDevice('motor2')
+        det = session.getDevice('det')
+        asciisink = session.getDevice('asciisink')
+        testsink = session.getDevice('testsink1')
+        asciisink._setROParam('dispatchmode', 'async')
+        testsink._setROParam('dispatchmode', 'bounded')
+        testsink._setROParam('maxlag', 1)
+        try:
+            scan(m, 0, 1, 5, det, t=0.005)
+            # handled in order, and finished at the end of the scan
+            calls = testsink._handlers[0]._calls
+            assert calls == ['prepare', 'begin'] + ['addSubset'] * 5 + ['end']
+            assert asciisink._dispatcher._queue.unfinished_tasks == 0
+            dataset = session.experiment.data.getLastScans()[-1]
+            contents = readFile(path.join(session.experiment.datapath,
+                                          'p1234_%08d.dat' % dataset.counter))
+            assert len([line for line in contents
+                        if not line.startswith('#')]) == 5
+            assert contents[-1].startswith('### End of NICOS data file')
+        finally:
+            asciisink._setROParam('dispatchmode', 'sync')
+            testsink._setROParam('dispatchmode', 'sync')
+
+    def test_async_sink_error(self, session, log):
+        m = session.getDevice('motor2')
+        det = session.getDevice('det')
+        testsink = session.getDevice('testsink1')
+        testsink._setROParam('dispatchmode', 'async')
+        try:
+            with mock.patch('test.utils.TestSinkHandler.addSubset',
+                            side_effect=RuntimeError('sink failed')):
+                with log.allow_errors():
+                    # the error is raised in the script
+                    with pytest.raises(RuntimeError, match='sink failed'):
+                        scan(m, 0, 1, 5, det, t=0.005)
+                    # (maybe more errors from other pending calls)
+                    try:
+                        testsink.flush()
+                    except RuntimeError:
+                        pass
+        finally:
+            testsink._setROParam('dispatchmode', 'sync')
+        assert testsink._handlers[0]._calls[-1] == 'end'
+
+    def test_async_sink_data(self, session):
+        m = session.getDevice('motor2')
+        det = session.getDevice('det')
+        serialsink = session.getDevice('serialsink')
+        serialsink._setROParam('dispatchmode', 'async')
+        end = SerializedSinkHandler.end
+
+        def slow_end(handler):
+            time.sleep(0.1)
+            end(handler)
+
+        try:
+            with mock.patch.object(SerializedSinkHandler, 'end', slow_end):
+                scan(m, 0, 1, 3, det, t=0.005)
+        finally:
+            serialsink._setROParam('dispatchmode', 'sync')
+        dataset = session.experiment.data.getLastScans()[-1]
+        with open(path.join(session.experiment.datapath, '.all_datasets'),
+                  'rb') as fp:
+            written = pickle.load(fp)[dataset.counter]
+        # the sink got the scan before it was trimmed
+        assert len(written.subsets) == 3
+        for point in written.subsets:
+            assert point.metainfo
+        assert not dataset.subsets[-1].metainfo
+
+    def test_pipelined_scan_error(self, session, log):
+        m = session.getDevice('motor2')
+        det = session.getDevice('det')
+        add_subset = session.getDevice('testsink1').handlerclass.addSubset
+
+        def failing_add_subset(handler, subset):
+            if subset.settype == 'point' and subset.number == 2:
+                raise ComputationError('sink failed')
+            add_subset(handler, subset)
+
+        session.instrument._setROParam('pipelinescans', True)
+        try:
+            with mock.patch('test.utils.TestSinkHandler.addSubset',
+                            failing_add_subset):
+                # the error is reported for the point that produced it
+                with log.assert_msg_matches(r'Could not finish point 2'):
+                    scan(m, 0, 1, 3, det, t=0.005)
+        finally:
+            session.instrument._setROParam('pipelinescans', False)
+        # ... and the next point is measured anyway
+        dataset = session.experiment.data.getLastScans()[-1]
+        assert [point.number for point in dataset.subsets] == [1, 2, 3]
+        assert len(dataset.devvaluelists) == 3
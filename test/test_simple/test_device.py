@@ -37,6 +37,8 @@ from test.utils import raises
 
 session_setup = 'device'
 methods_called = set()
+# values of Dev5.reconf seen during initialization
+reconf_seen = []
 
 
 class Dev1(Device):
@@ -131,6 +133,25 @@ class Dev2(HasLimits, HasOffset, CanDisable, Moveable):
         return True
 
 
+class Dev5(Device):
+    parameters = {
+        'reconf': Param('A parameter changed in the setup', type=int),
+        'other': Param('A parameter whose update reads reconf', type=int,
+                       settable=True),
+        'derived': Param('A parameter set by the update of other', type=int),
+    }
+
+    def doUpdateOther(self, value):
+        reconf_seen.append(self.reconf)
+        self._setROParam('derived', 10 * value)
+
+    def doUpdateDerived(self, value):
+        self._derived_seen = value
+
+    def doInit(self, mode):
+        reconf_seen.append(self.reconf)
+
+
 class Dev3(HasLimits, HasOffset, Moveable):
     parameters = {
         'offsetsign': Param('Offset sign', type=int, settable=True),
@@ -267,6 +288,23 @@ def test_params(session):
                   mandatory=True)
 
 
+def test_reconfigured_params(session, log):
+    dev5 = session.getDevice('dev5')
+    session.cache.put(dev5, 'reconf', 1)
+    session.cache.put(dev5, 'other', 1)
+    del reconf_seen[:]
+    dev5 = session.createDevice('dev5', recreate=True)
+    # the configured value is used, not the old one from the cache
+    assert reconf_seen == [2, 2]
+    assert dev5.reconf == 2
+    # a value set during init is not replaced by the old one from the cache
+    session.cache.put(dev5, 'derived', 5)
+    dev5 = session.createDevice('dev5', recreate=True)
+    assert dev5.derived == 10
+    assert dev5._derived_seen == 10
+    assert session.cache.get(dev5, 'derived') == 10
+
+
 def test_forbidden_assignments(session):
     dev = session.getDevice('dev2_1')
     # test assignment of a value to a device method must fail
@@ -26,10 +26,14 @@
 Test for multiwait
 """
 
+import threading
+import time
+
 import pytest
 
 from nicos.core.errors import ComputationError, MoveError, NicosTimeoutError
-from nicos.core.utils import multiWait
+from nicos.core.utils import WAIT_MIN_DELAY, DeviceWaiter, multiCall, \
+    multiWait
 
 from test.utils import raises
 
@@ -85,3 +89,43 @@ class TestMultiWait:
 
         with log.assert_errors(regex=".*multi_dev1.*", count=1):
             assert raises(ComputationError, multiWait, [dev1, dev2, dev3, dev4])
+
+
+def test_waiter_backoff(session):
+    dev1 = session.getDevice('dev1')
+    with DeviceWaiter([dev1], 0.05) as waiter:
+        # no cache in this setup: only wait with increasing delays
+        assert waiter.cache is None
+        assert waiter.delay == WAIT_MIN_DELAY
+        for _ in range(5):
+            waiter.sleep()
+        assert waiter.delay == 0.05
+
+
+
+def test_multicall(session, log):
+    active = {}
+    lock = threading.Lock()
+
+    def call(name):
+        with lock:
+            # calls for the same resource never overlap
+            assert not active.get(name)
+            active[name] = True
+        time.sleep(0.1)
+        with lock:
+            active[name] = False
+        if name.startswith('err'):
+            raise ComputationError(name)
+        return name.upper()
+
+    names = ['a', 'b', 'a', 'c', 'd']
+    assert multiCall(call, names) == ['A', 'B', 'A', 'C', 'D']
+    started = time.time()
+    assert multiCall(call, names, 4) == ['A', 'B', 'A', 'C', 'D']
+    assert time.time() - started < 0.4
+
+    # the first error in device order is raised, the others logged
+    with log.assert_errors(regex='err1', count=1):
+        with pytest.raises(ComputationError, match='err2'):
+            multiCall(call, ['a', 'err2', 'b', 'err1'], 4)
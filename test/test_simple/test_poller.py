@@ -0,0 +1,165 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2021 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   agent <agent@local>
+#
+# *****************************************************************************
+
+"""NICOS poller scheduler tests."""
+
+import threading
+import time
+
+import numpy
+
+from nicos.core import Attach, Device, HasCommunication, Readable, status
+from nicos.services.poller import Poller, PollScheduler, PollStats
+
+session_setup = 'pollertest'
+
+# (device name, start, end) of all reads
+reads = []
+reads_lock = threading.Lock()
+
+
+class Bus(HasCommunication, Device):
+    pass
+
+
+class SlowReadable(Readable):
+    attached_devices = {
+        'bus': Attach('The communication bus', Bus, optional=True),
+    }
+
+    def doRead(self, maxage=0):
+        start = time.time()
+        time.sleep(0.02)
+        with reads_lock:
+            reads.append((self.name, start, time.time()))
+        return 0
+
+    def doStatus(self, maxage=0):
+        return status.OK, ''
+
+
+def overlapping(dev1, dev2):
+    for (name1, start1, end1) in reads:
+        for (name2, start2, end2) in reads:
+            if name1 == dev1 and name2 == dev2 and \
+               start1 < end2 and start2 < end1:
+                return True
+    return False
+
+
+def test_scheduler(session):
+    poller = Poller('Poller', alwayspoll=[], pollworkers=3,
+                    pollgroups={'group': ['p3', 'p4']})
+    scheduler = PollScheduler(poller, poller.pollworkers)
+    try:
+        for devname in ['p1', 'p2', 'p3', 'p4', 'p5', 'pbus']:
+            scheduler.add(devname)
+        scheduler.start()
+        for _ in range(100):
+            time.sleep(0.05)
+            if all(scheduler.tasks[devname].stats.npolls >= 3
+                   for devname in ['p1', 'p2', 'p3', 'p4', 'p5']):
+                break
+        else:
+            assert False, 'devices not polled'
+        # not a readable
+        assert scheduler.tasks['pbus'].done
+
+        # devices are grouped by attached communication device, or explicitly
+        assert scheduler.tasks['p1'].resource == ('device', 'pbus')
+        assert scheduler.tasks['p2'].resource == ('device', 'pbus')
+        assert scheduler.tasks['p3'].resource == ('group', 'group')
+        assert scheduler.tasks['p4'].resource == ('group', 'group')
+        assert scheduler.tasks['p5'].resource == ('device', 'p5')
+        # and never polled concurrently
+        assert not overlapping('p1', 'p2')
+        assert not overlapping('p3', 'p4')
+
+        # events trigger polls
+        task = scheduler.tasks['p5']
+        npolls = task.stats.npolls
+        scheduler.put(task, 'pollparam:unit')
+        for _ in range(20):
+            time.sleep(0.05)
+            if task.stats.npolls > npolls:
+                break
+        assert task.stats.npolls > npolls
+        assert task.stats.polltime > 0
+        assert task.stats.nlate > 0
+        assert poller._stats['p5'] is task.stats
+
+        # adaptive polling: the interval of unchanged devices is stretched
+        poller._setROParam('adaptivepoll', 4)
+        task.stats.lastchange -= 60
+        assert task.stretched_interval() == 2
+        scheduler.put(task, 'dev_target')
+        for _ in range(20):
+            time.sleep(0.05)
+            if task.stats.factor == 1:
+                break
+        assert task.stretched_interval() == task.interval
+    finally:
+        scheduler.stop()
+        scheduler.join()
+        poller.shutdown()
+        for devname in ['p1', 'p2', 'p3', 'p4', 'p5', 'pbus']:
+            if devname in session.devices:
+                session.devices[devname].shutdown()
+
+
+def test_stats():
+    stats = PollStats()
+    for i in range(100):
+        stats.add_poll(0.001 * i, 0)
+    stats.add_error()
+    stats.add_lateness(0.1)
+    stats.add_lateness(0.3)
+    info = stats.summary()
+    assert info['polls'] == 100
+    assert info['errors'] == 1
+    assert info['errorrate'] == 1 / 101
+    assert abs(info['mean'] - 0.0495) < 1e-9
+    assert info['p95'] == 0.094
+    assert info['max'] == 0.099
+    assert info['lateness'] == 0.2
+    assert info['maxlateness'] == 0.3
+
+    # stretched after 10 intervals without change, up to the maximum factor
+    assert stats.stretch(1, 10) == 1
+    stats.lastchange -= 30
+    assert 2.9 < stats.stretch(1, 10) < 3.1
+    assert stats.stretch(1, 2) == 2
+    assert stats.stretch(1, 1) == 1
+    assert stats.stretch(None, 10) is None
+    # a change of the value resets the factor
+    stats.lastchange -= 30
+    stats.add_poll(0.001, 1)
+    assert stats.stretch(1, 10) == 1
+
+    # array values do not break the change detection
+    stats.lastchange -= 30
+    stats.add_poll(0.001, numpy.arange(3))
+    stats.add_poll(0.001, numpy.arange(3))
+    assert stats.npolls == 103
+    assert stats.stretch(1, 10) == 1
@@ -25,7 +25,10 @@
 
 """NICOS tests for nicos.commands.scan and nicos.core.scan modules."""
 
+import time
 import warnings
+from threading import Timer
+from unittest import mock
 
 import pytest
 
@@ -36,11 +39,12 @@ from nicos.commands.scan import appendscan, contscan, cscan, gridscan, \
     manualscan, scan, sweep, timescan, twodscan
 from nicos.core import CommunicationError, ModeError, NicosError, \
     PositionError, UsageError
-from nicos.core.acquire import CountResult
+from nicos.core.acquire import CountResult, _count_wait
 from nicos.core.scan import ContinuousScan
 from nicos.core.sessions.utils import MASTER, SLAVE
 from nicos.core.status import BUSY, OK
 from nicos.core.utils import waitForState
+from nicos.devices.generic import Detector
 
 from test.utils import raises
 
@@ -176,6 +180,31 @@ def test_scan2(session):
         session.experiment.detlist = []
 
 
+def test_scan_concurrent(session):
+    m = session.getDevice('motor')
+    det = session.getDevice('det')
+    m2 = session.getDevice('motor2')
+    m2.maw(2)
+    session.getDevice('manual').move(3)
+
+    dataman = session.experiment.data
+    try:
+        session.experiment.setEnvironment(['motor2', 'manual'])
+        scan(m, [0, 1], det, t=0.)
+        serial = dataman.getLastScans()[-1]
+        session.instrument._setROParam('acquireworkers', 4)
+        scan(m, [0, 1], det, t=0.)
+        concurrent = dataman.getLastScans()[-1]
+        assert concurrent.envvaluelists == serial.envvaluelists == \
+            [[2., 3.], [2., 3.]]
+        assert [v.name for v in concurrent.detvalueinfo] == \
+            ['timer', 'mon1', 'ctr1', 'ctr2', 'img.sum']
+        assert len(concurrent.detvaluelists[1]) == 5
+    finally:
+        session.instrument._setROParam('acquireworkers', 0)
+        session.experiment.envlist = []
+
+
 def test_scan_plotindex(session):
     m = session.getDevice('motor')
     m2 = session.getDevice('motor2')
@@ -494,3 +523,67 @@ def test_live_count(session):
     count()  # t=0
     count()  # t=0
     scan(m, [0, 4, 5], 0., det, live=1)  # live will be ignored
+
+
+def test_count_loop_wakeup(session):
+    det = session.getDevice('det')
+    instr = session.instrument
+    isCompleted = Detector.isCompleted
+    with mock.patch.object(Detector, 'isCompleted', autospec=True,
+                           side_effect=isCompleted) as spy:
+        # polling with the fixed countloopdelay by default
+        count(det, t=0.5)
+        polled = spy.call_count
+        # sleeping until the timer signals that it has finished
+        spy.reset_mock()
+        instr._setROParam('countloopmaxdelay', 1)
+        try:
+            started = time.time()
+            count(det, t=0.5)
+            assert time.time() - started < 1
+            assert spy.call_count < polled / 2
+        finally:
+            instr._setROParam('countloopmaxdelay', 0)
+
+
+def test_count_wait(session):
+    det = session.getDevice('det')
+    det.liveinterval = None
+    det.saveintervals = []
+    try:
+        # nothing to do during measurement: sleep until the (estimated) end
+        with mock.patch.object(Detector, 'estimateTime', return_value=None):
+            assert _count_wait([det], 0, 0.025, 1.) == 1.
+        with mock.patch.object(Detector, 'estimateTime', return_value=0.5):
+            assert _count_wait([det], 4.5, 0.025, 1.) == 0.5
+        with mock.patch.object(Detector, 'estimateTime', return_value=0):
+            assert _count_wait([det], 5, 0.025, 1.) == 0.025
+        # wake up for the next live readout
+        det._last_live = 0
+        det.liveinterval = 0.2
+        assert _count_wait([det], 0.1, 0.025, 1.) == pytest.approx(0.1)
+        # other detectors need the fixed delay
+        with mock.patch.object(Detector, 'nextMeasureEvent',
+                               return_value=None):
+            assert _count_wait([det], 0, 0.025, 1.) == 0.025
+    finally:
+        det.liveinterval = None
+
+
+def test_count_loop_finish_request(session, log):
+    det = session.getDevice('det')
+    session.instrument._setROParam('countloopmaxdelay', 10)
+
+    def request():
+        session.countloop_request = ('finish', 'finished by test')
+
+    timer = Timer(0.2, request)
+    timer.start()
+    started = time.time()
+    try:
+        with log.assert_warns('counting stopped: finished by test'):
+            count(det, t=30)
+        assert time.time() - started < 5
+    finally:
+        timer.cancel()
+        session.instrument._setROParam('countloopmaxdelay', 0)
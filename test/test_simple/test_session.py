@@ -24,15 +24,49 @@
 
 """NICOS axis test suite."""
 
+import threading
+import time
 from os import path
 
-from nicos.core import ConfigurationError
+from nicos import config, session as nicos_session
+from nicos.core import Attach, ConfigurationError, Device, Param
 from nicos.core.sessions.setups import readSetups
 
 from test.utils import ErrorLogged, module_root, raises
 
 session_setup = 'empty'
 
+# (device name, thread name, start, end) of devices in "parallelcreate"
+creation_log = []
+
+
+class SlowDevice(Device):
+    """Device that takes some time to initialize."""
+
+    attached_devices = {
+        'attached': Attach('attached devices', Device, multiple=True,
+                           optional=True),
+    }
+
+    def doInit(self, mode):
+        started = time.time()
+        time.sleep(0.2)
+        creation_log.append((self.name, threading.current_thread().name,
+                             started, time.time()))
+
+
+class LookupDevice(Device):
+    """Device that needs another device without attaching it."""
+
+    parameters = {
+        'lookup': Param('device to look up', type=str),
+    }
+
+    def doInit(self, mode):
+        nicos_session.getDevice(self.lookup)
+        creation_log.append((self.name, threading.current_thread().name,
+                             0, 0))
+
 
 def test_raisers(session):
     assert raises(ConfigurationError,
@@ -64,3 +98,57 @@ def test_device_names(session):
     assert raises(ErrorLogged, readSetups,
                   [path.join(module_root, 'test', 'faulty_setups')],
                   session.log)
+
+
+def test_parallel_creation(session, monkeypatch):
+    monkeypatch.setattr(config, 'device_creation_workers', 4)
+    del creation_log[:]
+    session.unloadSetup()
+    try:
+        started = time.time()
+        session.loadSetup('parallelcreate', autocreate_devices=True)
+        elapsed = time.time() - started
+        log = {name: (thread, start, end)
+               for (name, thread, start, end) in creation_log}
+        assert set(log) == {'slow1', 'slow2', 'slow3', 'slow4', 'top',
+                            'lookup', 'late'}
+        assert set(session.explicit_devices) >= set(log)
+        # attached devices are created before the device using them
+        assert log['top'][1] >= max(log['slow1'][2], log['slow2'][2])
+        # devices needing other devices are created in the main thread
+        assert log['lookup'][0] == threading.current_thread().name
+        assert log['slow3'][0].startswith('device creation')
+        # 6 slow devices, but slow1..4 and late are created at the same time
+        assert elapsed < 1.0
+    finally:
+        session.unloadSetup()
+        session.loadSetup('empty')
+
+
+def test_simulation_template(session, log, monkeypatch):
+    monkeypatch.setattr(config, 'simulation_template', True)
+    session.unloadSetup()
+    try:
+        session.loadSetup('vmotor1')
+        template = session.getSimulationTemplate()
+        assert template.wait(30)
+        assert session.getSimulationTemplate() is template
+        version = template._version
+        session.cache.put('vmotor', 'value', 42.)
+        with log.assert_msg_matches(r'vmotor is at 42'):
+            session.runSimulation('printinfo("vmotor is at", vmotor.read())')
+        # the changed value was sent to the template
+        assert template._version > version
+        # deleted keys are reset like in a new simulation
+        session.cache.put('vmotor', 'speed', 5.)
+        with log.assert_msg_matches(r'vmotor speed is 5'):
+            session.runSimulation('printinfo("vmotor speed is", vmotor.speed)')
+        session.cache.delete('vmotor', 'value')
+        session.cache.delete('vmotor', 'speed')
+        with log.assert_msg_matches(r'vmotor is at 0(\.0)? with speed 0'):
+            session.runSimulation('printinfo("vmotor is at", vmotor.read(), '
+                                  '"with speed", vmotor.speed)')
+    finally:
+        session.unloadSetup()
+        session.loadSetup('empty')
+    assert not template.alive()
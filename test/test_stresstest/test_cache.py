@@ -25,20 +25,24 @@
 """NICOS cache tests."""
 
 import os
-from time import sleep
+from threading import Thread
+from time import sleep, time as currenttime
 
 import pytest
 
-from nicos.devices.cacheclient import CacheError
+from nicos.core import CacheLockError
+from nicos.devices.cacheclient import CacheClient as PlainCacheClient, \
+    CacheError
 
 from test.utils import TestCacheClient as CacheClient, alt_cache_addr, \
-    killSubprocess, raises, startCache
+    cache_addr, killSubprocess, raises, startCache
 
 session_setup = 'cachestress'
 
 
 def all_setups():
-    yield from ['cache_db', 'cache_mem', 'cache_mem_hist']
+    yield from ['cache_db', 'cache_db_batched', 'cache_mem', 'cache_mem_hist',
+                'cache_eventloop', 'cache_follower']
 
     if os.environ.get('KAFKA_URI', None):
         yield 'cache_kafka'
@@ -96,3 +100,106 @@ def test_restart(session, setup):
         assert cachedval2[2] == testval
     finally:
         killSubprocess(cache)
+
+
+def test_eventloop_slow_history(session):
+    cache = startCache(alt_cache_addr, 'cache_slowhist')
+    other = PlainCacheClient('OtherCache', cache=alt_cache_addr,
+                             prefix='nicos/')
+    try:
+        sleep(1)
+        cc = session.cache
+        now = currenttime()
+        cc.put('slowhist', 'value', 1, time=now - 1)
+        cc.flush()
+        history = []
+        thread = Thread(target=lambda: history.extend(
+            cc.history('slowhist', 'value', now - 10, now)))
+        thread.start()
+        sleep(0.2)
+        # the history query does not stall the other clients of the loop
+        started = currenttime()
+        assert other.get_explicit('slowhist', 'value')[2] == 1
+        assert currenttime() - started < 0.5
+        thread.join()
+        assert history == [(now - 1, 1)]
+    finally:
+        other.shutdown()
+        killSubprocess(cache)
+
+
+def wait_for(func, value, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        if func() == value:
+            break
+        sleep(0.05)
+    return func()
+
+
+def test_batched_history(session):
+    cache = startCache(alt_cache_addr, 'cache_db_batched')
+    try:
+        sleep(1)
+        cc = session.cache
+        now = currenttime()
+        for i in range(5):
+            cc.put('batched', 'hist', i, time=now - 5 + i)
+        cc.flush()
+        assert wait_for(lambda: cc.get_explicit('batched', 'hist')[2], 4) == 4
+        # lines not yet written by the batched writer are found too
+        assert cc.history('batched', 'hist', now - 10, now) == \
+            [(now - 5 + i, i) for i in range(5)]
+    finally:
+        killSubprocess(cache)
+
+
+def test_follower(session):
+    cache = startCache(alt_cache_addr, 'cache_follower')
+    # connected to the primary cache
+    primary = PlainCacheClient('PrimaryCache', cache=cache_addr,
+                               prefix='nicos/')
+    # the test client does not lock
+    follower = PlainCacheClient('FollowerCache', cache=alt_cache_addr,
+                                prefix='nicos/')
+    try:
+        sleep(1)
+        cc = session.cache
+        # writes are forwarded to the primary
+        cc.put('follow', 'a', 1)
+        cc.flush()
+        assert wait_for(lambda: primary.get_explicit('follow', 'a')[2], 1) == 1
+        # and updates on the primary are replicated to the follower
+        primary.put('follow', 'b', 2)
+        primary.flush()
+        assert wait_for(lambda: cc.get('follow', 'b'), 2) == 2
+        assert cc.get_explicit('follow', 'b')[2] == 2
+
+        # locks are held by the primary
+        primary.lock('follow', sessionid='other')
+        assert raises(CacheLockError, follower.lock, 'follow',
+                      sessionid='mine')
+        primary.unlock('follow', sessionid='other')
+        follower.lock('follow', sessionid='mine')
+        assert raises(CacheLockError, primary.lock, 'follow',
+                      sessionid='other')
+        follower.unlock('follow', sessionid='mine')
+
+        # history queries in the window are answered by the follower, older
+        # ones by the primary
+        now = currenttime()
+        for i in range(10):
+            cc.put('follow', 'hist', i, time=now - 100 + 10 * i)
+        for i in range(10):
+            cc.put('follow', 'hist', 10 + i, time=now + 0.01 * i)
+        cc.flush()
+        assert wait_for(lambda: primary.get_explicit('follow', 'hist')[2],
+                        19) == 19
+        for (fromtime, totime) in [(now - 95, now + 1),
+                                   (now + 0.025, now + 1)]:
+            expected = primary.history('follow', 'hist', fromtime, totime)
+            assert expected
+            assert cc.history('follow', 'hist', fromtime, totime) == expected
+    finally:
+        primary.shutdown()
+        follower.shutdown()
+        killSubprocess(cache)
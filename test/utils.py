@@ -48,7 +48,8 @@ from nicos.devices.abstract import CanReference
 from nicos.devices.cacheclient import CacheClient
 from nicos.devices.generic import VirtualMotor
 from nicos.devices.notifiers import Mailer
-from nicos.services.cache.database import FlatfileCacheDatabase
+from nicos.services.cache.database import FlatfileCacheDatabase, \
+    MemoryCacheDatabase
 from nicos.utils import closeSocket, createSubprocess, tcpSocket
 from nicos.utils.loggers import ACTION, NicosLogger
 
@@ -72,6 +73,7 @@ config.group = None
 config.nicos_root = runtime_root
 config.pid_path = path.join(runtime_root, 'pid')
 config.logging_path = path.join(runtime_root, 'log')
+config.setup_cache_path = path.join(runtime_root, 'setupcache')
 
 
 def raises(exc, *args, **kwds):
@@ -311,11 +313,22 @@ class TestCacheDatabase(FlatfileCacheDatabase):
         if key == '__clear__':
             with self._cat_lock:
                 self._cat.clear()
+                self._index.clear()
             return
 
         FlatfileCacheDatabase.tell(self, key, value, time, ttl, from_client)
 
 
+class SlowHistoryCacheDatabase(MemoryCacheDatabase):
+
+    def ask_hist(self, key, fromtime, totime):
+        # Simulate a history query that has to read a lot from disk.
+        sleep(1)
+        with self._db_lock:
+            entries = list(self._db.get(key, ()))
+        return ['%r@%s=%s\n' % (entry.time, key, entry.value)
+                for entry in entries if fromtime <= entry.time <= totime]
+
 class TestSession(Session):
     autocreate_devices = False
     cache_class = TestCacheClient